@@ -0,0 +1,30 @@
+import sys, argparse, json
+
+from tk3dv.nocstools import benchmarking
+
+if __name__ == '__main__':
+    Parser = argparse.ArgumentParser(description='Benchmark NOCS alignment engines on synthetic correspondences.', fromfile_prefix_chars='@')
+    ArgGroup = Parser.add_argument_group()
+    ArgGroup.add_argument('--num-points', nargs='+', help='Specify the point counts to benchmark.', default=[100, 1000, 10000], type=int, required=False)
+    ArgGroup.add_argument('--outlier-ratios', nargs='+', help='Specify the outlier ratios to benchmark.', default=[0.0, 0.1, 0.3], type=float, required=False)
+    ArgGroup.add_argument('--noise-levels', nargs='+', help='Specify the noise levels (relative to object scale) to benchmark.', default=[0.0, 0.01], type=float, required=False)
+    ArgGroup.add_argument('--engines', nargs='+', help='Specify the engines to benchmark. Available: ' + ', '.join(benchmarking.AlignmentEngines.keys()), choices=list(benchmarking.AlignmentEngines.keys()), required=False)
+    ArgGroup.add_argument('--trials', help='Specify the number of trials per configuration.', default=5, type=int, required=False)
+    ArgGroup.add_argument('--seed', help='Specify the random seed.', default=0, type=int, required=False)
+    ArgGroup.add_argument('--output', help='Specify the output JSON file.', default='aligning_benchmark.json', required=False)
+    ArgGroup.add_argument('--baseline', help='Specify a previous JSON output to check for speed or accuracy regressions.', default=None, required=False)
+
+    Args = Parser.parse_args()
+
+    Results = benchmarking.runAlignmentBenchmark(Args.num_points, Args.outlier_ratios, Args.noise_levels, Engines=Args.engines, nTrials=Args.trials, Seed=Args.seed)
+    benchmarking.saveBenchmarkResults(Results, Args.output)
+
+    if Args.baseline is not None:
+        with open(Args.baseline) as f:
+            Baseline = json.load(f)['results']
+        Regressions = benchmarking.compareBenchmarkResults(Baseline, Results)
+        for R in Regressions:
+            print('[ WARN ]: Regression:', R)
+        if len(Regressions) > 0:
+            sys.exit(1)
+        print('[ INFO ]: No regressions with respect to', Args.baseline)
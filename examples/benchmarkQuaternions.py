@@ -0,0 +1,33 @@
+import argparse, timeit
+import numpy as np
+
+from tk3dv.extern import quaternions
+
+if __name__ == '__main__':
+    Parser = argparse.ArgumentParser(description='Compare batched quaternion operations with per-element calls.', fromfile_prefix_chars='@')
+    ArgGroup = Parser.add_argument_group()
+    ArgGroup.add_argument('--num', help='Specify the number of rotations.', default=10000, type=int, required=False)
+    ArgGroup.add_argument('--seed', help='Specify the random seed.', default=0, type=int, required=False)
+
+    Args = Parser.parse_args()
+
+    RNG = np.random.default_rng(Args.seed)
+    Q = RNG.normal(size=(Args.num, 4))
+    Q /= np.linalg.norm(Q, axis=1, keepdims=True)
+    M = quaternions.quat2mat_batch(Q)
+    V = RNG.normal(size=(Args.num, 3))
+    Theta = RNG.uniform(-np.pi, np.pi, size=Args.num)
+
+    Cases = [
+        ('quat2mat', lambda: quaternions.quat2mat_batch(Q), lambda: [quaternions.quat2mat(q) for q in Q]),
+        ('mat2quat', lambda: quaternions.mat2quat_batch(M), lambda: [quaternions.mat2quat(m) for m in M]),
+        ('mult', lambda: quaternions.mult_batch(Q, Q[::-1]), lambda: [quaternions.mult(a, b) for a, b in zip(Q, Q[::-1])]),
+        ('inverse', lambda: quaternions.inverse_batch(Q), lambda: [quaternions.inverse(q) for q in Q]),
+        ('rotate_vector', lambda: quaternions.rotate_vector_batch(V, Q), lambda: [quaternions.rotate_vector(v, q) for v, q in zip(V, Q)]),
+        ('angle_axis2quat', lambda: quaternions.angle_axis2quat_batch(Theta, V), lambda: [quaternions.angle_axis2quat(t, v) for t, v in zip(Theta, V)]),
+        ('angle_axis2mat', lambda: quaternions.angle_axis2mat_batch(Theta, V), lambda: [quaternions.angle_axis2mat(t, v) for t, v in zip(Theta, V)]),
+        ]
+    for Name, Batched, Single in Cases:
+        BatchTime = min(timeit.repeat(Batched, number=10, repeat=3)) / 10
+        SingleTime = min(timeit.repeat(Single, number=1, repeat=3))
+        print('[ INFO ]: {:<16} batched {:8.2f} ms, loop {:8.2f} ms, {:6.1f}x'.format(Name, BatchTime * 1e3, SingleTime * 1e3, SingleTime / BatchTime))
@@ -0,0 +1,24 @@
+import sys, argparse, glob
+
+from tk3dv.nocstools import obj_loader
+
+if __name__ == '__main__':
+    Parser = argparse.ArgumentParser(description='Precompute level of detail (LOD) chains for OBJ models and cache them next to the models.', fromfile_prefix_chars='@')
+    ArgGroup = Parser.add_argument_group()
+    ArgGroup.add_argument('--models', nargs='+', help='Specify input OBJ model paths. * globbing is supported.', required=True)
+    ArgGroup.add_argument('--levels', help='Specify the maximum number of decimated levels.', default=3, type=int, required=False)
+    ArgGroup.add_argument('--base-resolution', help='Specify the number of clusters along the bounding box diagonal for the finest decimated level.', default=obj_loader.LODBaseResolution, type=int, required=False)
+    ArgGroup.add_argument('--normalize', help='Choose to normalize models to lie within NOCS (must match the viewer, e.g. visualizeNOCSMap.py always normalizes).', action='store_true')
+    Parser.set_defaults(normalize=False)
+
+    Args = Parser.parse_args()
+
+    ModelFiles = []
+    for File in Args.models:
+        ModelFiles.extend(sorted(glob.glob(File)) if '*' in File else [File])
+
+    for MF in ModelFiles:
+        Arrays = obj_loader.loadMesh(MF, isNormalize=Args.normalize)
+        LODs = obj_loader.buildLODChain(Arrays, Args.levels, Args.base_resolution)
+        obj_loader.writeLODChain(MF, LODs, isNormalize=Args.normalize, nLevels=Args.levels, BaseResolution=Args.base_resolution)
+        print('[ INFO ]: Wrote', obj_loader.getLODFile(MF), 'with faces per level:', [len(Arrays['faces'])] + [len(L['faces']) for _, L in LODs])
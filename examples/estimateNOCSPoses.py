@@ -0,0 +1,62 @@
+import sys, os, argparse, glob
+
+from tk3dv.nocstools import datastructures as ds
+from tk3dv.nocstools import pose_estimation
+
+def getFileNames(InputList):
+    FileNames = []
+    for File in InputList:
+        if '*' in File:
+            GlobFiles = glob.glob(File, recursive=False)
+            GlobFiles.sort()
+            FileNames.extend(GlobFiles)
+        else:
+            FileNames.append(File)
+
+    return FileNames
+
+if __name__ == '__main__':
+    Parser = argparse.ArgumentParser(description='Estimate camera poses for many NOCS maps without the viewer.', fromfile_prefix_chars='@')
+    ArgGroup = Parser.add_argument_group()
+    ArgGroup.add_argument('--nocs-maps', nargs='+', help='Specify input NOCS maps. * globbing is supported.', required=True)
+    ArgGroup.add_argument('--intrinsics', help='Specify the intrinsics file. If not provided, the full camera is estimated.', required=False, default=None)
+    ArgGroup.add_argument('--num-points', help='Specify the number of pixels to use for camera pose registration. Defaults to 1000, or all pixels with --ransac and no intrinsics.', default=None, type=int, required=False)
+    ArgGroup.add_argument('--ransac', help='Choose to use RANSAC for full camera estimation (when no intrinsics are provided).', action='store_true')
+    Parser.set_defaults(ransac=False)
+    ArgGroup.add_argument('--ransac-threshold', help='Specify the RANSAC inlier reprojection error threshold in pixels.', default=2.0, type=float, required=False)
+    ArgGroup.add_argument('--seed', help='Specify the random seed used for subsampling and RANSAC.', default=0, type=int, required=False)
+    ArgGroup.add_argument('--workers', help='Specify the number of worker processes. Defaults to the number of CPUs.', default=None, type=int, required=False)
+    ArgGroup.add_argument('--cache-dir', help='Specify the pose cache directory (shared with visualizeNOCSMap.py --pose-cache).', default=os.path.join(os.path.expanduser('~'), '.cache', 'tk3dv', 'poses'), required=False)
+    ArgGroup.add_argument('--no-cache', help='Choose to disable the pose cache.', action='store_true')
+    Parser.set_defaults(no_cache=False)
+    ArgGroup.add_argument('--track', help='Choose to track the pose through the NOCS maps in order, warm-starting from the previous frame (needs --intrinsics). Runs sequentially and bypasses the cache.', action='store_true')
+    Parser.set_defaults(track=False)
+    ArgGroup.add_argument('--output', help='Specify the output pose file (JSON).', default='nocs_poses.json', required=False)
+
+    Args = Parser.parse_args()
+
+    Intrinsics = None
+    if Args.intrinsics is not None:
+        Intrinsics = ds.CameraIntrinsics(fromFile=Args.intrinsics)
+
+    NumPoints = Args.num_points
+    if NumPoints is None and (Args.ransac == False or Intrinsics is not None):
+        NumPoints = 1000
+    RANSACThreshold = Args.ransac_threshold if Args.ransac else None
+    CacheDir = None if Args.no_cache else Args.cache_dir
+
+    NMFiles = getFileNames(Args.nocs_maps)
+    print('[ INFO ]: Estimating poses for {} NOCS maps.'.format(len(NMFiles)))
+    if Args.track:
+        if Intrinsics is None:
+            print('[ ERR ]: --track needs --intrinsics.')
+            sys.exit(1)
+        Tracker = pose_estimation.PoseTracker(Intrinsics, N=NumPoints, RANSACThreshold=Args.ransac_threshold, Seed=Args.seed, isVerbose=True)
+        Poses = []
+        for NMF in NMFiles:
+            Pose = Tracker.track(pose_estimation.loadNOCSMap(NMF, (Intrinsics.Width, Intrinsics.Height)))
+            Poses.append(None if Pose is None else pose_estimation.poseToDict(*Pose))
+        print('[ INFO ]: Tracked {} frames with {} full RANSAC solves.'.format(Tracker.nFrames, Tracker.nFullSolves))
+    else:
+        Poses = pose_estimation.estimateCameraPosesBatch(NMFiles, CacheDir=CacheDir, nWorkers=Args.workers, N=NumPoints, Intrinsics=Intrinsics, RANSACThreshold=RANSACThreshold, Seed=Args.seed)
+    pose_estimation.savePoses(NMFiles, Poses, Args.output)
@@ -0,0 +1,24 @@
+import argparse, time
+import numpy as np
+
+from tk3dv.common import trajectory
+
+if __name__ == '__main__':
+    Parser = argparse.ArgumentParser(description='Interpolate a smooth fly-through between pyEasel cameras.', fromfile_prefix_chars='@')
+    ArgGroup = Parser.add_argument_group()
+    ArgGroup.add_argument('--cameras', help='Specify the pyEasel camera file with the keyframes (saved by GLViewer).', required=True)
+    ArgGroup.add_argument('--num-frames', help='Specify the number of output frames.', default=1000, type=int, required=False)
+    ArgGroup.add_argument('--rotation-mode', help='Specify the rotation interpolation.', choices=trajectory.RotationModes, default='squad', required=False)
+    ArgGroup.add_argument('--position-mode', help='Specify the position interpolation.', choices=trajectory.PositionModes, default='catmull-rom', required=False)
+    ArgGroup.add_argument('--output', help='Specify the output pyEasel camera file.', default='flythrough_cams.npz', required=False)
+    ArgGroup.add_argument('--poses', help='Specify an optional .npy file for the (N, 4, 4) camera to world poses.', default=None, required=False)
+
+    Args = Parser.parse_args()
+
+    Trajectory = trajectory.CameraTrajectory.fromCameraFile(Args.cameras, RotationMode=Args.rotation_mode, PositionMode=Args.position_mode)
+    Times = np.linspace(Trajectory.Times[0], Trajectory.Times[-1], Args.num_frames)
+    Tic = time.perf_counter()
+    Trajectory.saveCameraFile(Args.output, Times)
+    if Args.poses is not None:
+        np.save(Args.poses, Trajectory.getPoses(Times))
+    print('[ INFO ]: Interpolated {} cameras from {} keyframes in {:.3f} s.'.format(Args.num_frames, len(Trajectory.Times), time.perf_counter() - Tic))
@@ -29,56 +29,31 @@ class ModelNOCVizModule(EaselModule):
         self.Parser.set_defaults(color_order=False)
         ArgGroup.add_argument('--half-offset', help='Offset all points by +0.5.', action='store_true')
         self.Parser.set_defaults(half_offset=False)
-        ArgGroup.add_argument('--color-file', help='Choose a color from file. Should match number of points in model.', required=False)
+        ArgGroup.add_argument('--mesh-cache', help='Specify the cache directory for parsed OBJ models.', default=os.path.join(os.path.expanduser('~'), '.cache', 'tk3dv', 'meshes'), required=False)
+        ArgGroup.add_argument('--no-mesh-cache', help='Choose to disable the OBJ model cache.', action='store_true')
+        self.Parser.set_defaults(no_mesh_cache=False)
+        ArgGroup.add_argument('--lods', help='Specify the number of decimated levels of detail for models (0 disables). Precompute them with buildOBJLODs.py.', default=0, type=int, required=False)
+        ArgGroup.add_argument('--workers', help='Specify the number of processes used to load models. Defaults to the number of CPUs.', default=None, type=int, required=False)
+        ArgGroup.add_argument('--color-file', help='Choose a color from file. Should match number of vertices in model, or 3 x number of faces for per face corner colors.', required=False)
 
         self.Args, _ = self.Parser.parse_known_args(InputArgs)
         if len(sys.argv) <= 1:
             self.Parser.print_help()
             exit()
 
-        self.Models = []
-        self.OBJLoaders = []
-
-        for m in self.Args.models:
-            self.Models.append(datastructures.PointSet3D())
-            if self.Args.normalize == True:
-                print('[ INFO ]: Normalizing models to lie within NOCS.')
-                self.OBJLoaders.append(obj_loader.Loader(m, isNormalize=True))
-            else:
-                self.OBJLoaders.append(obj_loader.Loader(m, isNormalize=False))
-            if len(self.OBJLoaders[-1].vertices) > 0:
-                self.Models[-1].Points = np.array(self.OBJLoaders[-1].vertices)
-            if len(self.OBJLoaders[-1].vertcolors) > 0:
-                print('[ INFO ]: Found vertex colors. Will be used for rendering.')
-                self.Models[-1].Colors = np.asarray(self.OBJLoaders[-1].vertcolors)
-            else:
-                self.Models[-1].Colors = self.Models[-1].Points
-
-            if self.Args.color_file is not None:
-                print('[ INFO ]: Coloring models with file.')
-                Colors = np.load(self.Args.color_file)
-                # print(self.Models[-1].Colors.shape)
-                # print(Colors[:, :3].shape)
-                self.Models[-1].Colors = np.asarray(Colors[:, :3]) + 0.5
-            if self.Args.color_order == True:
-                print('[ INFO ]: Coloring models with point order color.')
-                Steps = np.linspace(0.0, 1.0, num=len(self.Models[-1]))
-                Colors = ColorPalette.mpl_colormap(Steps)
-                # print(self.Models[-1].Colors.shape)
-                # print(Colors[:, :3].shape)
-                self.Models[-1].Colors = np.asarray(Colors[:, :3])
-                # # TEMP
-                # np.save('colors', self.Models[-1].Points)
-
-            if self.Args.half_offset == True:
-                self.Models[-1].Points += 0.5
-
-            self.Models[-1].update()
+        # Models are parsed in parallel and added in draw() as they finish, see pollModels()
+        MeshCacheDir = None if self.Args.no_mesh_cache else self.Args.mesh_cache
+        if self.Args.normalize == True:
+            print('[ INFO ]: Normalizing models to lie within NOCS.')
+        self.ModelLoader = obj_loader.ParallelLoader(self.Args.models, isNormalize=self.Args.normalize, CacheDir=MeshCacheDir, nWorkers=self.Args.workers, nLODs=self.Args.lods)
+        self.Models = [None] * len(self.Args.models)
+        self.OBJLoaders = [None] * len(self.Args.models)
 
         self.isDrawNOCSCube = True
         self.isDrawPoints = False
         self.isDrawMesh = True
         self.isDrawBB = False
+        self.isLit = False
         self.isColorByOrder = False
         # self.RotateAngle = -90
         # self.RotateAxis = np.array([1, 0, 0])
@@ -88,10 +63,52 @@ class ModelNOCVizModule(EaselModule):
         self.nModels = len(self.Args.models)
         self.activeModelIdx = self.nModels # nModels will show all
 
+    def addModel(self, Idx, Loader):
+        self.OBJLoaders[Idx] = Loader
+        Model = datastructures.PointSet3D()
+        if len(Loader.vertices) > 0:
+            Model.Points = np.array(Loader.vertices)
+        if len(Loader.vertcolors) > 0:
+            print('[ INFO ]: Found vertex colors. Will be used for rendering.')
+            Model.Colors = np.asarray(Loader.vertcolors)
+        else:
+            Model.Colors = Model.Points
+
+        if self.Args.color_file is not None:
+            print('[ INFO ]: Coloring models with file.')
+            Colors = np.load(self.Args.color_file)
+            # print(Model.Colors.shape)
+            # print(Colors[:, :3].shape)
+            Model.Colors = Loader.toVertexAttribute(Colors[:, :3]) + 0.5
+        if self.Args.color_order == True:
+            print('[ INFO ]: Coloring models with point order color.')
+            Steps = np.linspace(0.0, 1.0, num=len(Model))
+            Colors = ColorPalette.mpl_colormap(Steps)
+            # print(Model.Colors.shape)
+            # print(Colors[:, :3].shape)
+            Model.Colors = np.asarray(Colors[:, :3])
+            # # TEMP
+            # np.save('colors', Model.Points)
+
+        if self.Args.half_offset == True:
+            Model.Points += 0.5
+
+        Model.update()
+        self.Models[Idx] = Model
+
+    def pollModels(self):
+        # Must be called from the GL thread
+        if self.ModelLoader.isDone():
+            return
+        for Idx in self.ModelLoader.poll():
+            self.addModel(Idx, self.ModelLoader.Loaders[Idx])
+
     def step(self):
         pass
 
     def draw(self):
+        self.pollModels()
+
         gl.glMatrixMode(gl.GL_MODELVIEW)
         gl.glPushMatrix()
 
@@ -107,8 +124,10 @@ class ModelNOCVizModule(EaselModule):
             if self.activeModelIdx != self.nModels:
                 if Idx != self.activeModelIdx:
                     continue
+            if m is None: # Still loading
+                continue
             if self.isDrawMesh:
-                self.OBJLoaders[Idx].draw(self.PointSize)
+                self.OBJLoaders[Idx].draw(self.PointSize, isLit=self.isLit)
             if self.isDrawPoints:
                 self.Models[Idx].draw(self.PointSize)
             if self.isDrawBB:
@@ -133,12 +152,15 @@ class ModelNOCVizModule(EaselModule):
             self.isDrawMesh = not self.isDrawMesh
         if a0.key() == QtCore.Qt.Key_B:
             self.isDrawBB = not self.isDrawBB
+        if a0.key() == QtCore.Qt.Key_L:
+            self.isLit = not self.isLit
         if a0.key() == QtCore.Qt.Key_S:
             print('[ INFO ]: Saving current model as OBJ.')
             if self.activeModelIdx == self.nModels:
                 for i, m in enumerate(self.Models):
-                    m.serialize('model_{}.obj'.format(str(i).zfill(3)))
-            else:
+                    if m is not None:
+                        m.serialize('model_{}.obj'.format(str(i).zfill(3)))
+            elif self.Models[self.activeModelIdx] is not None:
                 self.Models[self.activeModelIdx].serialize('model_{}.obj'.format(str(self.activeModelIdx).zfill(3)))
             sys.stdout.flush()
 
@@ -11,6 +11,7 @@ import numpy as np
 import OpenGL.GL as gl
 from tk3dv.nocstools import datastructures as ds
 from tk3dv.nocstools import obj_loader
+from tk3dv.nocstools import pose_estimation
 
 from palettable.tableau import Tableau_20, BlueRed_12, ColorBlind_10, GreenOrange_12
 from palettable.cartocolors.diverging import Earth_2
@@ -34,7 +35,18 @@ class NOCSMapModule(EaselModule):
         ArgGroup.add_argument('--models', nargs='+',
                               help='Specify OBJ models to load additionally. * globbing is supported.',
                               required=False)
-        ArgGroup.add_argument('--num-points', help='Specify the number of pixels to use for camera pose registration.', default=1000, type=int, required=False)
+        ArgGroup.add_argument('--num-points', help='Specify the number of pixels to use for camera pose registration. Defaults to 1000, or all pixels with --ransac and no intrinsics.', default=None, type=int, required=False)
+        ArgGroup.add_argument('--ransac', help='Choose to use RANSAC for full camera estimation (when no intrinsics are provided).', action='store_true')
+        self.Parser.set_defaults(ransac=False)
+        ArgGroup.add_argument('--track', help='Choose to track the camera pose through the NOCS maps in order (needs --intrinsics and --est-pose).', action='store_true')
+        self.Parser.set_defaults(track=False)
+        ArgGroup.add_argument('--mesh-cache', help='Specify the cache directory for parsed OBJ models.', default=os.path.join(os.path.expanduser('~'), '.cache', 'tk3dv', 'meshes'), required=False)
+        ArgGroup.add_argument('--no-mesh-cache', help='Choose to disable the OBJ model cache.', action='store_true')
+        self.Parser.set_defaults(no_mesh_cache=False)
+        ArgGroup.add_argument('--lods', help='Specify the number of decimated levels of detail for models (0 disables). Precompute them with buildOBJLODs.py.', default=0, type=int, required=False)
+        ArgGroup.add_argument('--workers', help='Specify the number of processes used to load OBJ models. Defaults to the number of CPUs.', default=None, type=int, required=False)
+        ArgGroup.add_argument('--pose-cache', help='Specify a pose cache directory (e.g. the one filled by estimateNOCSPoses.py) to reuse estimated poses.', required=False, default=None)
+        ArgGroup.add_argument('--ransac-threshold', help='Specify the RANSAC inlier reprojection error threshold in pixels.', default=2.0, type=float, required=False)
         ArgGroup.add_argument('--error-viz', help='Specify error wrto Nth NOCS map. If multiple NOCS maps are provided. Will compute the L2 errors between the Nth NOCS map and the rest. Will render this instead of RGB or colors.', default=-1, type=int, required=False)
 
         ArgGroup.add_argument('--est-pose', help='Choose to estimate pose.', action='store_true')
@@ -76,6 +88,7 @@ class NOCSMapModule(EaselModule):
         self.showBB = False
         self.showPoints = False
         self.showWireFrame = False
+        self.isLit = False
         self.isVizError = False
         self.showOBJModels = True
         self.loadData()
@@ -111,81 +124,6 @@ class NOCSMapModule(EaselModule):
                 #cv2.imwrite('norm_{}.png'.format(str(i).zfill(3)), NormCol)
                 self.NOCS[i] = ds.NOCSMap(self.NOCSMaps[i], RGB=cv2.cvtColor(NormCol, cv2.COLOR_BGR2RGB))# IMPORTANT: OpenCV loads as BGR, so convert to RGB
 
-    @staticmethod
-    def estimateCameraPoseFromNM(NOCSMap, NOCS, N=None, Intrinsics=None):
-        ValidIdx = np.where(np.all(NOCSMap != [255, 255, 255], axis=-1)) # row, col
-
-        # Create correspondences tuple list
-        x = np.array([ValidIdx[1], ValidIdx[0]]) # row, col ==> u, v
-        # Convert image coordinates from top left to bottom right (See Figure 6.2 in HZ)
-        x[0, :] = NOCSMap.shape[1] - x[0, :]
-        x[1, :] = NOCSMap.shape[0] - x[1, :]
-
-        X = NOCS.Points.T
-
-        # Subsample
-        # Enough to do pose estimation from a subset of points but randomly distributed in the image
-        MaxN = x.shape[1]
-        if N is not None:
-            MaxN = min(N, x.shape[1])
-        RandIdx = [i for i in range(0, x.shape[1])]
-        random.shuffle(RandIdx)
-        print('[ INFO ]: Using {} points for estimating camera pose'.format(MaxN))
-        sys.stdout.flush()
-        RandIdx = RandIdx[:MaxN]
-        x = x[:, RandIdx]
-        X = X[:, RandIdx]
-
-        X = X.astype(np.float32)
-        x = x.astype(np.float32)
-
-        if Intrinsics is not None:
-            # ---------------------------------
-            # If you are using Python:
-            # Numpy array slices won't work as input because solvePnP requires contiguous arrays (enforced by the assertion using cv::Mat::checkVector() around line 55 of modules/calib3d/src/solvepnp.cpp version 2.4.9)
-            # The P3P algorithm requires image points to be in an array of shape (N,1,2) due to its calling of cv::undistortPoints (around line 75 of modules/calib3d/src/solvepnp.cpp version 2.4.9) which requires 2-channel information.
-            # Thus, given some data D = np.array(...) where D.shape = (N,M), in order to use a subset of it as, e.g., imagePoints, one must effectively copy it into a new array: imagePoints = np.ascontiguousarray(D[:,:2]).reshape((N,1,2))
-            # ---------------------------------
-
-            x = np.copy(x.T).reshape((MaxN, 1, 2))
-            X = np.copy(X.T).reshape((MaxN, 1, 3))
-
-            RetVal, rvec, tvec, Inliers = cv2.solvePnPRansac(X, x, Intrinsics.Matrix, Intrinsics.DistCoeffs, iterationsCount=10000, reprojectionError=0.001, confidence=0.9999999, flags=cv2.SOLVEPNP_ITERATIVE)
-            # print(Inliers)
-            # RetVal, rvec, tvec = cv2.solvePnP(X, x, Intrinsics.Matrix, Intrinsics.DistCoeffs, flags=cv2.SOLVEPNP_EPNP)
-
-            # print(x.shape)
-            # print(X.shape)
-            # print(RetVal)
-
-            k = Intrinsics.Matrix
-            r, _ = cv2.Rodrigues(rvec) # Also outputs Jacobian
-            c = -r.T @ tvec
-
-            print('K-based estimate:\n')
-            print('R:\n', r, '\n')
-            print('C:\n', c, '\n')
-            print('K:\n', k, '\n\n')
-
-            return None, k, r, c, False
-
-        else:
-            Corr = []
-            for i in range(0, max(X.shape)):
-                Corr.append((x[:, i], X[:, i]))
-
-            p, c, k, r, Flip = calibration.calculateCameraParameters(Corr)
-
-            # # Rotation about z-axis by 180
-            # r = utilities.rotation_matrix(np.array([0, 0, 1]), math.pi) @ r # TODO: This is incorrect
-
-            print('Full estimate:\n')
-            print('R:\n', r, '\n')
-            print('C:\n', c, '\n')
-            print('K:\n', k, '\n\n')
-
-            return p, k, r, c, Flip
-
     @staticmethod
     def getFileNames(InputList):
         if InputList is None:
@@ -221,6 +159,13 @@ class NOCSMapModule(EaselModule):
         if self.Args.poses is not None:
             PoseFiles = self.getFileNames(self.Args.poses)
 
+        Tracker = None
+        if self.Args.track and self.Args.est_pose:
+            if self.Intrinsics is None:
+                print('[ WARN ]: Tracking needs intrinsics. Estimating every pose independently.')
+            else:
+                Tracker = pose_estimation.PoseTracker(self.Intrinsics, N=1000 if self.Args.num_points is None else self.Args.num_points, RANSACThreshold=self.Args.ransac_threshold)
+
         for (NMF, CF, PF) in zip(NMFiles, ColorFiles, PoseFiles):
             NOCSMap = cv2.imread(NMF, -1)
             NOCSMap = NOCSMap[:, :, :3] # Ignore alpha if present
@@ -240,7 +185,18 @@ class NOCSMapModule(EaselModule):
             self.NOCS.append(NOCS)
 
             if self.Args.est_pose == True:
-                _, K, R, C, Flip = self.estimateCameraPoseFromNM(NOCSMap, NOCS, N=self.Args.num_points, Intrinsics=self.Intrinsics) # The rotation and translation are about the NOCS origin
+                NumPoints = self.Args.num_points
+                if NumPoints is None and (self.Args.ransac == False or self.Intrinsics is not None):
+                    NumPoints = 1000
+                RANSACThreshold = self.Args.ransac_threshold if self.Args.ransac else None
+                # The rotation and translation are about the NOCS origin
+                Pose = None
+                if Tracker is not None:
+                    Pose = Tracker.track(NOCSMap)
+                if Pose is None:
+                    Pose = pose_estimation.estimateCameraPoseCached(NMF, CacheDir=self.Args.pose_cache, NOCSMap=NOCSMap, N=NumPoints, Intrinsics=self.Intrinsics, RANSACThreshold=RANSACThreshold
+                                                                    , Seed=0)
+                _, K, R, C, Flip = Pose
                 self.CamIntrinsics.append(K)
                 self.CamRots.append(R)
                 self.CamPos.append(C)
@@ -268,10 +224,10 @@ class NOCSMapModule(EaselModule):
         self.nNM = len(NMFiles)
         self.activeNMIdx = self.nNM # len(NMFiles) will show all
 
-        # Load OBJ models
+        # Load OBJ models in parallel. They are added in draw() as they finish
         ModelFiles = self.getFileNames(self.Args.models)
-        for MF in ModelFiles:
-            self.OBJModels.append(obj_loader.Loader(MF, isNormalize=True))
+        MeshCacheDir = None if self.Args.no_mesh_cache else self.Args.mesh_cache
+        self.ModelLoader = obj_loader.ParallelLoader(ModelFiles, isNormalize=True, CacheDir=MeshCacheDir, nWorkers=self.Args.workers, nLODs=self.Args.lods)
 
     def step(self):
         pass
@@ -354,9 +310,12 @@ class NOCSMapModule(EaselModule):
             self.drawNOCS(lineWidth=5.0)
 
         if self.showOBJModels:
+            if not self.ModelLoader.isDone():
+                self.ModelLoader.poll()
+                self.OBJModels = [OM for OM in self.ModelLoader.Loaders if OM is not None]
             if self.OBJModels is not None:
                 for OM in self.OBJModels:
-                    OM.draw(isWireFrame=self.showWireFrame)
+                    OM.draw(isWireFrame=self.showWireFrame, isLit=self.isLit)
 
         gl.glPopMatrix()
 
@@ -410,6 +369,8 @@ class NOCSMapModule(EaselModule):
             self.showPoints = not self.showPoints
         if a0.key() == QtCore.Qt.Key_W:
             self.showWireFrame = not self.showWireFrame
+        if a0.key() == QtCore.Qt.Key_L:
+            self.isLit = not self.isLit
         if a0.key() == QtCore.Qt.Key_S:
             print('[ INFO ]: Taking snapshot and saving active NOCS maps as OBJ. This might take a while...')
             sys.stdout.flush()
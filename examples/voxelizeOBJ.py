@@ -0,0 +1,21 @@
+import argparse, glob
+
+from tk3dv.nocstools import voxelizer
+
+if __name__ == '__main__':
+    Parser = argparse.ArgumentParser(description='Voxelize OBJ models into binvox files.', fromfile_prefix_chars='@')
+    ArgGroup = Parser.add_argument_group()
+    ArgGroup.add_argument('--models', nargs='+', help='Specify input OBJ model paths. * globbing is supported.', required=True)
+    ArgGroup.add_argument('--resolution', help='Specify the voxel grid resolution.', default=32, type=int, required=False)
+    ArgGroup.add_argument('--fill', help='Specify how to fill solids.', choices=voxelizer.FillModes, default='flood', required=False)
+    ArgGroup.add_argument('--output-dir', help='Specify the output directory. Default is next to each model.', default=None, required=False)
+    ArgGroup.add_argument('--workers', help='Specify the number of worker processes. Default is the number of CPUs.', default=None, type=int, required=False)
+
+    Args = Parser.parse_args()
+
+    ModelFiles = []
+    for File in Args.models:
+        ModelFiles.extend(sorted(glob.glob(File)) if '*' in File else [File])
+
+    OutFiles = voxelizer.voxelizeOBJs(ModelFiles, OutDir=Args.output_dir, Resolution=Args.resolution, Fill=Args.fill, nWorkers=Args.workers)
+    print('[ INFO ]: Voxelized {} of {} models.'.format(sum(F is not None for F in OutFiles), len(ModelFiles)))
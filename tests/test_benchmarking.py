@@ -0,0 +1,39 @@
+import math
+import numpy as np
+
+from tk3dv.nocstools import benchmarking
+from tk3dv.common import utilities
+
+def test_rotation_error_of_scaled_estimates():
+    RNG = np.random.RandomState(0)
+    Source, Target, GroundTruth, InlierMask = benchmarking.generateSyntheticCorrespondences(100, OutlierRatio=0.0, Seed=0)
+    Truth = GroundTruth['Rotation']
+    Offset = utilities.rotation_matrix(np.array([0.0, 0.0, 1.0]), math.radians(5.0))
+    # Engines return the transposed rotation. Non-uniform row scales make the estimate non-orthonormal like restricted_affine,
+    # an affine estimate also adds a small shear
+    Shear = np.identity(3) + 0.01 * RNG.randn(3, 3)
+    for Distortion, Tolerance in [(np.identity(3), 1e-6), (np.diag([1.2, 0.9, 1.05]), 1e-6), (Shear, 1.0)]:
+        Estimate = (Distortion @ Offset @ Truth).T
+        Errors = benchmarking.evaluateAlignment(GroundTruth, GroundTruth['Scales'], Estimate, GroundTruth['Translation'], Source, Target, InlierMask)
+        assert abs(Errors['rotation_error_deg'] - 5.0) < Tolerance
+
+def test_engines_recover_known_rotation():
+    Source, Target, GroundTruth, InlierMask = benchmarking.generateSyntheticCorrespondences(500, OutlierRatio=0.0, Seed=1)
+    for Name, Engine in benchmarking.AlignmentEngines.items():
+        Scales, Rotation, Translation, _ = Engine(Source, Target)
+        Errors = benchmarking.evaluateAlignment(GroundTruth, Scales, Rotation, Translation, Source, Target, InlierMask)
+        assert Errors['rotation_error_deg'] < 1e-3, Name
+
+    # A known rotation offset on the target is reported for every engine
+    Offset = utilities.rotation_matrix(np.array([1.0, 0.0, 0.0]), math.radians(10.0))
+    Rotated = (Target - GroundTruth['Translation']) @ Offset.T + GroundTruth['Translation']
+    for Name, Engine in benchmarking.AlignmentEngines.items():
+        Scales, Rotation, Translation, _ = Engine(Source, Rotated)
+        Errors = benchmarking.evaluateAlignment(GroundTruth, Scales, Rotation, Translation, Source, Rotated, InlierMask)
+        assert abs(Errors['rotation_error_deg'] - 10.0) < 1e-3, Name
+
+def test_restricted_affine_error_is_not_hidden_by_clipping():
+    Source, Target, GroundTruth, InlierMask = benchmarking.generateSyntheticCorrespondences(1000, OutlierRatio=0.0, NoiseLevel=0.01, Seed=0)
+    Scales, Rotation, Translation, _ = benchmarking.AlignmentEngines['restricted_affine'](Source, Target)
+    Errors = benchmarking.evaluateAlignment(GroundTruth, Scales, Rotation, Translation, Source, Target, InlierMask)
+    assert Errors['rotation_error_deg'] > 0.1
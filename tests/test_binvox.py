@@ -0,0 +1,96 @@
+import io, os
+import numpy as np
+import pytest
+
+from tk3dv.extern.binvox import binvox_rw
+
+BinvoxDir = os.path.join(os.path.dirname(__file__), '..', 'tk3dv', 'extern', 'binvox')
+
+def writeToBytes(Model):
+    f = io.BytesIO()
+    Model.write(f)
+    return f.getvalue()
+
+def test_write_matches_reference_files():
+    for Name in ['chair.binvox', '8a85.binvox']:
+        with open(os.path.join(BinvoxDir, Name), 'rb') as f:
+            Raw = f.read()
+        Dense = binvox_rw.read_as_3d_array(io.BytesIO(Raw))
+        Sparse = binvox_rw.read_as_coord_array(io.BytesIO(Raw))
+        Out = writeToBytes(Dense)
+        assert Out[Out.index(b'data\n'):] == Raw[Raw.index(b'data\n'):]
+        assert writeToBytes(Sparse) == Out
+
+def test_write_long_runs_roundtrip():
+    RNG = np.random.RandomState(0)
+    for Density in [0.0, 0.001, 0.5, 1.0]:
+        Dims = [37, 20, 41]
+        Data = RNG.rand(*Dims) < Density
+        Data[5:30] = True if Density > 0.1 else Data[5:30]
+        Model = binvox_rw.Voxels(Data, Dims, [0.0, 0.0, 0.0], 1.0, 'xzy')
+        Out = writeToBytes(Model)
+        Pairs = np.frombuffer(Out[Out.index(b'data\n') + 5:], dtype=np.uint8)
+        assert np.all(Pairs[1::2] > 0)
+        assert np.all(binvox_rw.read_as_3d_array(io.BytesIO(Out), fix_coords=False).data == Data)
+        SparseModel = binvox_rw.Voxels(binvox_rw.dense_to_sparse(Data), Dims, [0.0, 0.0, 0.0], 1.0, 'xzy')
+        assert writeToBytes(SparseModel) == Out
+
+def test_coord_array_matches_dense():
+    with open(os.path.join(BinvoxDir, 'chair.binvox'), 'rb') as f:
+        Raw = f.read()
+    for FixCoords in [True, False]:
+        Dense = binvox_rw.read_as_3d_array(io.BytesIO(Raw), fix_coords=FixCoords)
+        Sparse = binvox_rw.read_as_coord_array(io.BytesIO(Raw), fix_coords=FixCoords)
+        assert Sparse.data.dtype == np.int32
+        Expected = binvox_rw.dense_to_sparse(Dense.data)
+        assert np.array_equal(Sparse.data[:, np.lexsort(Sparse.data)], Expected[:, np.lexsort(Expected)])
+
+def test_packed_voxels():
+    RNG = np.random.RandomState(1)
+    for Dims in [[16, 24, 40], [13, 7, 21]]:
+        for AxisOrder in ['xzy', 'xyz']:
+            Shape = Dims if AxisOrder == 'xzy' else [Dims[0], Dims[2], Dims[1]]
+            Data = RNG.rand(*Shape) < 0.3
+            Model = binvox_rw.Voxels(Data, Dims, [0.0, 0.0, 0.0], 1.0, AxisOrder)
+            Raw = writeToBytes(Model)
+            Packed = binvox_rw.read_as_packed_array(io.BytesIO(Raw), fix_coords=(AxisOrder == 'xyz'))
+            assert Packed.data.nbytes == Dims[0] * Shape[1] * ((Shape[2] + 7) // 8)
+            assert np.array_equal(Packed.data, Model.pack().data)
+            assert np.array_equal(Packed.unpack().data, Data)
+            assert writeToBytes(Packed) == Raw
+            assert Packed.count() == np.count_nonzero(Data)
+
+            i, j, k = np.nonzero(np.ones(Shape, dtype=bool))
+            assert np.array_equal(Packed.occupied(i, j, k), Data[i, j, k])
+
+            Other = binvox_rw.Voxels(RNG.rand(*Shape) < 0.5, Dims, [0.0, 0.0, 0.0], 1.0, AxisOrder).pack()
+            OtherData = Other.unpack().data
+            assert np.array_equal((Packed & Other).unpack().data, Data & OtherData)
+            assert np.array_equal((Packed | Other).unpack().data, Data | OtherData)
+            assert np.isclose(Packed.iou(Other), np.count_nonzero(Data & OtherData) / np.count_nonzero(Data | OtherData))
+
+def test_decode_runs_and_unpack_bits():
+    RNG = np.random.RandomState(2)
+    for Dims in [[16, 24, 40], [13, 7, 21], [5, 9, 3]]:
+        for Density in [0.0, 0.3, 1.0]:
+            Data = RNG.rand(*Dims) < Density
+            Raw = writeToBytes(binvox_rw.Voxels(Data, Dims, [0.0, 0.0, 0.0], 1.0, 'xzy'))
+            Expected = binvox_rw.read_as_3d_array(io.BytesIO(Raw)).data
+            Pairs = np.frombuffer(Raw[Raw.index(b'data\n') + 5:], dtype=np.uint8)
+
+            Out = np.full(Dims, 7, dtype=np.uint8)
+            binvox_rw.decode_runs(Pairs[::2], Pairs[1::2], Out.reshape(-1))
+            assert np.array_equal(Out.transpose(0, 2, 1), Expected)
+
+            Packed = binvox_rw.read_as_packed_array(io.BytesIO(Raw), fix_coords=False).data
+            Unpacked = np.empty(Packed.shape[:2] + (Packed.shape[2] * 8,), dtype=np.uint8)
+            binvox_rw.unpack_bits(Packed, Unpacked)
+            assert not Unpacked[:, :, Dims[2]:].any()
+            assert np.array_equal(Unpacked[:, :, :Dims[2]].transpose(0, 2, 1), Expected)
+
+def test_decode_runs_rejects_bad_runs():
+    Out = np.empty(10, dtype=np.uint8)
+    # a zero count run would share its start with the next value change
+    for Values, Counts in [([1, 0, 1], [4, 0, 6]), ([1, 0], [4, 5]), ([], [])]:
+        with pytest.raises(ValueError):
+            binvox_rw.decode_runs(np.array(Values, dtype=np.uint8), np.array(Counts, dtype=np.uint8), Out)
@@ -0,0 +1,83 @@
+import numpy as np
+
+from tk3dv.nocstools import calibration
+
+def makeCorrespondences(N=500, Noise=0.0, Seed=0):
+    RNG = np.random.RandomState(Seed)
+    K = np.array([[500, 0, 320], [0, 500, 240], [0, 0, 1.0]])
+    R, _ = np.linalg.qr(RNG.randn(3, 3))
+    R *= np.linalg.det(R)
+    T = np.array([0.1, -0.2, 3.0])
+    X = RNG.uniform(0.0, 1.0, (N, 3))
+    Projected = (K @ (R @ X.T + T[:, np.newaxis])).T
+    x = Projected[:, :2] / Projected[:, 2:] + RNG.normal(0, Noise, (N, 2))
+
+    return x, X, K
+
+def test_array_and_tuple_api_match():
+    x, X, _ = makeCorrespondences()
+    Corr = [(x[i], X[i]) for i in range(x.shape[0])]
+
+    assert np.allclose(calibration.constructMatrixA(Corr), calibration.constructMatrixA((x, X)))
+
+    NormTuples, t1, u1 = calibration.normalize(Corr)
+    NormArrays, t2, u2 = calibration.normalize((x, X))
+    assert np.allclose(t1, t2) and np.allclose(u1, u2)
+    assert np.allclose(np.array([c[0] for c in NormTuples]), NormArrays[0])
+    assert np.allclose(np.array([c[1] for c in NormTuples]), NormArrays[1])
+
+    P = np.random.RandomState(1).rand(12)
+    assert np.allclose(calibration.reprojectionError(P, NormTuples), calibration.reprojectionError(P, NormArrays))
+
+def test_camera_parameters_from_arrays():
+    x, X, K = makeCorrespondences(Noise=0.1)
+    p, c, k, r, Flip = calibration.calculateCameraParameters((x, X))
+
+    assert np.allclose(k, K, rtol=1e-2, atol=1.0)
+    assert np.mean(calibration.reprojectionError(p.flatten(), (x, X))) < 0.5
+
+def test_analytic_jacobian():
+    x, X, _ = makeCorrespondences(N=50, Noise=0.5)
+    NormCorr, _, _ = calibration.normalize((x, X))
+    P = calibration.dlt(NormCorr).flatten()
+    Jacobian = calibration.reprojectionJacobian(P, NormCorr)
+    Eps = 1e-7
+    NumJacobian = np.zeros_like(Jacobian)
+    for i in range(0, 12):
+        Delta = np.zeros(12)
+        Delta[i] = Eps
+        NumJacobian[:, i] = (calibration.reprojectionResiduals(P + Delta, NormCorr) - calibration.reprojectionResiduals(P - Delta, NormCorr)) / (2 * Eps)
+    assert np.allclose(Jacobian, NumJacobian, atol=1e-5)
+
+def test_robust_loss_with_outliers():
+    x, X, K = makeCorrespondences(N=1000, Noise=0.5)
+    x[:100] += np.random.RandomState(2).uniform(0, 100, (100, 2))
+    _, _, k, _, _ = calibration.calculateCameraParameters((x, X), loss='soft_l1', lossScale=2.0)
+
+    assert np.allclose(k, K, rtol=1e-2, atol=2.0)
+
+def test_ransac_with_outliers():
+    x, X, K = makeCorrespondences(N=5000, Noise=0.5)
+    nOutliers = 2000
+    x[:nOutliers] += np.random.RandomState(3).uniform(-80, 80, (nOutliers, 2))
+    p, c, k, r, Flip, Inliers = calibration.calculateCameraParametersRANSAC((x, X), threshold=2.0, seed=0)
+
+    assert np.allclose(k, K, rtol=1e-2, atol=2.0)
+    assert np.count_nonzero(Inliers[nOutliers:]) > 0.95 * (x.shape[0] - nOutliers)
+    assert np.array_equal(Inliers, calibration.reprojectionError(p.flatten(), (x, X)) < 2.0)
+
+def test_ransac_minimal_sets_are_distinct():
+    RNG = np.random.RandomState(0)
+    for nPoints in [6, 10, 1000]:
+        Samples = calibration.sampleMinimalSets(RNG, nPoints, 500)
+        assert Samples.shape == (500, 6) and Samples.min() >= 0 and Samples.max() < nPoints
+        Sorted = np.sort(Samples, axis=1)
+        assert np.all(Sorted[:, 1:] != Sorted[:, :-1])
+
+def test_ransac_few_points():
+    x, X, K = makeCorrespondences(N=10, Noise=0.1)
+    x[0] += 50
+    p, c, k, r, Flip, Inliers = calibration.calculateCameraParametersRANSAC((x, X), threshold=2.0, seed=0)
+
+    assert np.array_equal(Inliers, calibration.reprojectionError(p.flatten(), (x, X)) < 2.0)
+    assert not Inliers[0] and np.all(Inliers[1:])
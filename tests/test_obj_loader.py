@@ -0,0 +1,148 @@
+import numpy as np
+import pytest
+
+from tk3dv.nocstools import obj_loader
+
+def writeOBJ(path, Text):
+    with open(path, 'w') as f:
+        f.write(Text)
+    return str(path)
+
+def test_parse_face_forms_and_negative_indices(tmp_path):
+    path = writeOBJ(tmp_path / 'quad.obj', '# quad\n'
+                    'v 0 0 0 255 0 0\nv 1 0 0 0 255 0\nv 1 1 0 0 0 255\nv 0 1 0 255 255 255\n'
+                    'vt 0 0\nvt 1 0\nvt 1 1\nvn 0 0 1\n'
+                    'f 1/1/1 2/2/1 3/3/1 4/1/1\n'
+                    'f -4//-1 -3//-1 -2//-1\n'
+                    'f 1 3 4\n')
+    Arrays = obj_loader.parseOBJ(path)
+
+    assert np.array_equal(Arrays['faces'], [[0, 1, 2], [0, 2, 3], [0, 1, 2], [0, 2, 3]])
+    assert np.array_equal(Arrays['face_texcoords'], [[0, 1, 2], [0, 2, 0], [-1, -1, -1], [-1, -1, -1]])
+    assert np.array_equal(Arrays['face_normals'], [[0, 0, 0], [0, 0, 0], [0, 0, 0], [-1, -1, -1]])
+    assert np.allclose(Arrays['vertcolors'][0], [1, 0, 0])
+    assert Arrays['texcoords'].shape == (3, 2) and Arrays['normals'].shape == (1, 3)
+
+def test_mesh_cache_roundtrip(tmp_path):
+    path = writeOBJ(tmp_path / 'tri.obj', 'v 0 0 0\nv 2 0 0\nv 0 1 0\nvn 0 0 1\nf 1//1 2//1 3//1\n')
+    CacheDir = str(tmp_path / 'cache')
+    Parsed = obj_loader.loadMeshCached(path, CacheDir, isNormalize=True)
+    Cached = obj_loader.loadMeshCached(path, CacheDir, isNormalize=True)
+
+    assert isinstance(Cached['vertices'], np.memmap)
+    for Name in obj_loader.MeshArrays:
+        assert np.array_equal(Parsed[Name], Cached[Name])
+    assert not np.array_equal(obj_loader.loadMeshCached(path, CacheDir)['vertices'], Cached['vertices'])
+
+def test_streaming_chunks_and_decimation(tmp_path):
+    Lines = ['v {} {} {}'.format(x * 0.1, y * 0.1, 0) for y in range(10) for x in range(10)]
+    Lines += ['f {} {} {}'.format(i + 1, i + 2, i + 11) for i in range(89) if i % 10 != 9]
+    path = writeOBJ(tmp_path / 'grid.obj', '\n'.join(Lines) + '\n')
+    Whole = obj_loader.parseOBJ(path)
+    Chunked = obj_loader.parseOBJ(path, ChunkSize=64)
+    for Name in Whole:
+        assert np.array_equal(Whole[Name], Chunked[Name])
+
+    Decimated = obj_loader.parseOBJ(path, ChunkSize=64, ClusterSize=0.25)
+    assert 0 < len(Decimated['vertices']) < len(Whole['vertices'])
+    assert 0 < len(Decimated['faces']) < len(Whole['faces'])
+    assert Decimated['faces'].max() < len(Decimated['vertices'])
+    assert len(obj_loader.parseOBJ(path, Subsample=4)['vertices']) == 25
+
+def test_vertex_normals(tmp_path):
+    # Unit square in z = 0 split into two triangles of different areas, with and without per-corner file normals
+    Quad = 'v 0 0 0\nv 1 0 0\nv 1 1 0\nv 0 1 0\n'
+    Arrays = obj_loader.loadMesh(writeOBJ(tmp_path / 'plain.obj', Quad + 'f 1 2 3\nf 1 3 4\n'))
+    assert np.allclose(Arrays['vertnormals'], [0, 0, 1])
+
+    Arrays = obj_loader.loadMesh(writeOBJ(tmp_path / 'split.obj', Quad + 'vn 0 0 1\nvn 0 0 -2\nf 1//1 2//1 3//1\nf 1//2 3//2 4//2\n'))
+    assert len(Arrays['vertices']) == 6 and len(Arrays['vertnormals']) == 6
+    Corners = Arrays['vertnormals'][Arrays['faces']]
+    assert np.allclose(Corners[0], [0, 0, 1]) and np.allclose(Corners[1], [0, 0, -1])
+    assert np.allclose(Arrays['vertices'][Arrays['faces']], np.array([[0, 0, 0], [1, 0, 0], [1, 1, 0], [0, 0, 0], [1, 1, 0], [0, 1, 0]]).reshape(2, 3, 3))
+
+def test_lod_chain(tmp_path):
+    Lines = ['v {} {} {}'.format(x / 31, y / 31, (x * y) % 3 / 100) for y in range(32) for x in range(32)]
+    Lines += ['f {} {} {}\nf {} {} {}'.format(i + 1, i + 2, i + 33, i + 2, i + 34, i + 33) for i in range(32 * 31) if i % 32 != 31]
+    path = writeOBJ(tmp_path / 'grid.obj', '\n'.join(Lines) + '\n')
+    Arrays = obj_loader.loadMesh(path)
+    LODs = obj_loader.buildLODChain(Arrays, nLevels=3, BaseResolution=16)
+    nFaces = [len(Arrays['faces'])] + [len(L['faces']) for _, L in LODs]
+    assert len(LODs) > 0 and all(a > b for a, b in zip(nFaces[:-1], nFaces[1:]))
+
+    obj_loader.writeLODChain(path, LODs, nLevels=3, BaseResolution=16)
+    Cached = obj_loader.readLODChain(path, nLevels=3, BaseResolution=16)
+    assert [C[0] for C in Cached] == [L[0] for L in LODs]
+    assert np.array_equal(Cached[-1][1]['faces'], LODs[-1][1]['faces'])
+    assert obj_loader.readLODChain(path, isNormalize=True, nLevels=3, BaseResolution=16) is None
+
+    ClusterSizes = [L[0] for L in LODs]
+    assert obj_loader.selectLODLevel(ClusterSizes, 1.0 / ClusterSizes[0] * 10) == 0
+    assert obj_loader.selectLODLevel(ClusterSizes, 1.0 / ClusterSizes[-1]) == len(LODs)
+
+def test_parse_whitespace_and_comments(tmp_path):
+    path = writeOBJ(tmp_path / 'tri.obj', 'v 0 0 0 # a\n  v 1 0 0\n\tv 0 1 0#b\n# f 9 9 9\nvn 0 0 1 # up\n f 1//1 2//1 3//1 # face\n')
+    Arrays = obj_loader.parseOBJ(path)
+
+    assert np.allclose(Arrays['vertices'], [[0, 0, 0], [1, 0, 0], [0, 1, 0]])
+    assert np.array_equal(Arrays['faces'], [[0, 1, 2]])
+    assert np.array_equal(Arrays['face_normals'], [[0, 0, 0]])
+
+def test_growing_array_keeps_returned_arrays_valid():
+    Array = obj_loader.GrowingArray((3,), np.int64, Capacity=2)
+    Array.append(np.arange(6).reshape(2, 3))
+    View = Array.view()
+    Final = Array.finalize()
+    Array.append(np.full((10, 3), 7))
+    assert np.array_equal(View, [[0, 1, 2], [3, 4, 5]]) and np.array_equal(Final, View)
+    Final = Array.finalize()
+    assert Final.shape == (12, 3) and Final.base is None and np.all(Final[2:] == 7)
+
+    # Without outside references the buffer is grown and shrunk in place, never copied by finalize()
+    Array = obj_loader.GrowingArray((3,), np.int64, Capacity=4)
+    for i in range(10):
+        Array.append(np.full((3, 3), i))
+    Buffer = id(Array.Data)
+    Final = Array.finalize()
+    assert id(Final) == Buffer and Final.shape == (30, 3) and Final.base is None
+    assert np.array_equal(Final[::3, 0], np.arange(10))
+    Array.append(np.zeros((1, 3)))
+    assert np.array_equal(Final[::3, 0], np.arange(10))
+
+def test_indexed_loader_and_soup_attributes(tmp_path):
+    path = writeOBJ(tmp_path / 'quad.obj', 'v 0 0 0 255 0 0\nv 1 0 0 0 255 0\nv 1 1 0 0 0 255\nv 0 1 0 255 255 255\nf 1 2 3\nf 1 3 4\n')
+    Arrays = obj_loader.loadMesh(path)
+    Model = obj_loader.Loader(path, isVerbose=False, Arrays=Arrays)
+    assert Model.isIndexed and len(Model.vertices) == 4
+    assert Model.nElements == 6
+    assert np.array_equal(Model.VBOIndices.data, np.array([[0, 1, 2], [0, 2, 3]], dtype=np.uint32))
+
+    # Old colour files hold one row per face corner, in the order of the triangle soup
+    Soup = np.asarray(Model.vertices)[Model.faces].reshape(-1, 3)
+    SoupColors = Soup * 2
+    assert np.allclose(Model.toVertexAttribute(SoupColors), np.asarray(Model.vertices) * 2)
+    assert np.allclose(Model.toVertexAttribute(SoupColors[:4]), SoupColors[:4])
+    with pytest.raises(RuntimeError):
+        Model.toVertexAttribute(SoupColors[:5])
+
+    Colors = np.asarray(Model.Colors)
+    Model.deindex()
+    assert not Model.isIndexed
+    assert np.allclose(Model.vertices, Soup)
+    assert np.allclose(Model.Colors, Colors[[0, 1, 2, 0, 2, 3]])
+    assert np.allclose(Model.toVertexAttribute(SoupColors), SoupColors)
+
+def test_parallel_loader_matches_loader(tmp_path):
+    paths = [writeOBJ(tmp_path / 'tri_{}.obj'.format(i), 'v 0 0 0\nv {} 0 0\nv 0 1 {}\nf 1 2 3\n'.format(i + 1, i)) for i in range(3)]
+    paths.insert(1, str(tmp_path / 'missing.obj'))
+    for CacheDir in [None, str(tmp_path / 'cache')]:
+        Parallel = obj_loader.ParallelLoader(paths, isNormalize=True, CacheDir=CacheDir, nWorkers=2, isVerbose=False)
+        assert sorted(Parallel.wait()) == [0, 2, 3]
+        assert Parallel.isDone() and Parallel.Executor is None
+        assert Parallel.Loaders[1] is None
+        for path, Loaded in zip(paths, Parallel.Loaders):
+            if Loaded is None:
+                continue
+            Serial = obj_loader.Loader(path, isNormalize=True, isVerbose=False)
+            for Name in ['vertices', 'faces', 'Colors', 'vertnormals']:
+                assert np.array_equal(getattr(Loaded, Name), getattr(Serial, Name))
@@ -0,0 +1,43 @@
+import os
+import numpy as np
+
+from tk3dv.extern.binvox import binvox_rw
+from tk3dv.nocstools import octree
+
+BinvoxFile = os.path.join(os.path.dirname(__file__), '..', 'tk3dv', 'extern', 'binvox', 'chair.binvox')
+
+def makeBall(Shape, Center, Radius):
+    Grid = np.indices(Shape).transpose(1, 2, 3, 0)
+    return np.linalg.norm(Grid - np.asarray(Center), axis=-1) < Radius
+
+def test_octree_matches_dense_grid():
+    for Data in [makeBall((20, 13, 17), (8, 6, 9), 7), makeBall((32, 32, 32), (16, 16, 16), 40), np.zeros((8, 8, 8), dtype=bool)]:
+        Tree = octree.SparseVoxelOctree.fromVoxels(Data)
+        Points = np.vstack([np.argwhere(np.ones(Data.shape, dtype=bool)), [[-1, 0, 0], [0, 100, 0]]])
+        Occupied = Tree.isOccupied(Points)
+        assert np.array_equal(Occupied[:-2], Data.ravel()) and not np.any(Occupied[-2:])
+
+        Origins, Sizes = Tree.getLeaves()
+        Leaves = np.zeros((Tree.Size,) * 3, dtype=bool)
+        for Origin, Size in zip(Origins, Sizes):
+            Leaves[Origin[0]:Origin[0] + Size, Origin[1]:Origin[1] + Size, Origin[2]:Origin[2] + Size] = True
+        assert np.count_nonzero(Leaves) == np.sum(Sizes.astype(np.int64) ** 3)
+        assert np.array_equal(Leaves[:Data.shape[0], :Data.shape[1], :Data.shape[2]], Data)
+        assert np.array_equal(Tree.downsample(0), Data)
+
+        Padded = np.zeros((Tree.Size,) * 3)
+        Padded[:Data.shape[0], :Data.shape[1], :Data.shape[2]] = Data
+        for Level in range(1, Tree.nLevels + 1):
+            s = Tree.Size >> Level
+            Fraction = Padded.reshape(s, 1 << Level, s, 1 << Level, s, 1 << Level).mean(axis=(1, 3, 5))
+            Shape = -(-np.array(Data.shape) // (1 << Level))
+            for Threshold in [0.0, 0.5]:
+                assert np.array_equal(Tree.downsample(Level, Threshold), (Fraction > Threshold)[:Shape[0], :Shape[1], :Shape[2]])
+
+def test_octree_from_binvox():
+    with open(BinvoxFile, 'rb') as f:
+        Model = binvox_rw.read_as_3d_array(f)
+    Tree = octree.SparseVoxelOctree.fromBinvox(BinvoxFile)
+    for Other in [Model, Model.pack(), binvox_rw.Voxels(binvox_rw.dense_to_sparse(Model.data), Model.dims, Model.translate, Model.scale, 'xyz')]:
+        assert np.array_equal(octree.SparseVoxelOctree.fromVoxels(Other).Children, Tree.Children)
+    assert np.array_equal(Tree.isOccupied(np.argwhere(np.ones(Model.data.shape, dtype=bool))), Model.data.ravel())
@@ -0,0 +1,165 @@
+import numpy as np
+
+from tk3dv.nocstools import parsing
+
+def test_split_instances_matches_masks():
+    RNG = np.random.RandomState(0)
+    Labels = RNG.choice([0, 3, 7, 255], size=(48, 64)).astype(np.uint8)
+    Color = RNG.randint(0, 255, (48, 64, 3)).astype(np.uint8)
+    Depth = RNG.randint(0, 5000, (48, 64)).astype(np.uint16)
+    IDs, Instances = parsing.splitInstances(Labels, {'Color': Color, 'Depth': Depth}, Background=255)
+
+    assert IDs == [0, 3, 7]
+    for ID, Instance in zip(IDs, Instances):
+        Rows, Cols = np.where(Labels == ID)
+        assert np.array_equal(Instance['Rows'], Rows) and np.array_equal(Instance['Cols'], Cols)
+        assert np.array_equal(Instance['Color'], Color[Rows, Cols])
+        assert np.array_equal(Instance['Depth'], Depth[Rows, Cols])
+        assert Instance['Color'].flags['C_CONTIGUOUS']
+
+from tk3dv.common import utilities
+from tk3dv.nocstools import datastructures as ds
+
+Height, Width = 24, 32
+
+def makeIntrinsics():
+    return ds.CameraIntrinsics(matrix=np.array([[30.0, 0, 16], [0, 30.0, 12], [0, 0, 1]]))
+
+def makeFrame(Seed=0):
+    RNG = np.random.RandomState(Seed)
+    Color = RNG.randint(0, 256, (Height, Width, 3)).astype(np.uint8)
+    Coord = RNG.randint(0, 256, (Height, Width, 3)).astype(np.uint8)
+    Depth = RNG.randint(0, 3000, (Height, Width)).astype(np.uint16)
+    Depth[RNG.rand(Height, Width) < 0.1] = 0 # Missing depth
+    return Color, Coord, Depth
+
+def makeDetections(Seed=0):
+    # Two overlapping instances, each inside its ROI (y1, x1, y2, x2)
+    RNG = np.random.RandomState(Seed)
+    ROIs = np.array([[2, 3, 15, 20], [8, 10, 22, 30]])
+    Masks = np.zeros((Height, Width, 2), dtype=np.uint8)
+    for Idx, (y1, x1, y2, x2) in enumerate(ROIs):
+        Masks[y1:y2, x1:x2, Idx] = RNG.rand(y2 - y1, x2 - x1) < 0.7
+    Coords = RNG.rand(Height, Width, 2, 3)
+    return {'rois': ROIs, 'masks': Masks, 'coords': Coords, 'class_ids': [1, 2]}
+
+def nonZeroPoints(Points):
+    return Points[np.any(Points != 0, axis=1)]
+
+def extractPerPixel(NOCIm, ColIm, DepIm, IDMask, K, isFlipped):
+    # The per-pixel loop of the original parsing code, kept as the reference
+    NOCPoints, RGBColors = [], []
+    MaskIdx = np.where((IDMask >= 255))
+    for i in range(0, MaskIdx[0].shape[0]):
+        Val = NOCIm[MaskIdx[0][i], MaskIdx[1][i], :] / 255
+        Col = ColIm[MaskIdx[0][i], MaskIdx[1][i], :] / 255
+        NOCPoints.append([1 - Val[2], Val[1], Val[0]] if isFlipped else [Val[0], Val[1], Val[2]])
+        RGBColors.append([Col[2], Col[1], Col[0]])
+    Metric = utilities.backproject(DepIm, K)
+
+    return np.array(NOCPoints).reshape(-1, 3), np.array(RGBColors).reshape(-1, 3), nonZeroPoints(Metric)
+
+def test_pose_rcnn_input_matches_per_pixel_loop():
+    Color, Coord, Depth = makeFrame()
+    Labels = np.random.RandomState(1).choice([0, 3, 255], size=(Height, Width)).astype(np.uint8)
+    MaskImage = np.stack([Labels] * 3, axis=-1)
+    Intrinsics = makeIntrinsics()
+    Input = parsing.PoseRCNNInput(Color, Coord, Depth, MaskImage, Intrinsics)
+
+    assert Input.MaskIDs == [0, 3]
+    for ID, Instance in zip(Input.MaskIDs, Input.Instances):
+        IDMask = np.uint8(Labels == ID)
+        NOCPoints, RGBColors, Metric = extractPerPixel(Coord * IDMask[..., np.newaxis], Color * IDMask[..., np.newaxis], Depth * IDMask, IDMask * 255, Intrinsics.Matrix, isFlipped=True)
+        assert np.allclose(Instance.NOC.Points, NOCPoints) and np.allclose(Instance.NOC.Colors, NOCPoints)
+        assert np.allclose(Instance.Metric.Colors, RGBColors)
+        assert np.allclose(nonZeroPoints(Instance.Metric.Points), Metric)
+
+def test_pose_rcnn_input_overlapping_matches_per_pixel_loop():
+    Color, _, Depth = makeFrame()
+    Data = makeDetections()
+    Intrinsics = makeIntrinsics()
+    Input = parsing.PoseRCNNInputOverlapping(Color, Depth, Data, Intrinsics)
+
+    assert len(Input.Instances) == 2
+    for Idx, Instance in enumerate(Input.Instances):
+        IDMask = Data['masks'][:, :, Idx]
+        NOCPoints, RGBColors, Metric = extractPerPixel(Data['coords'][:, :, Idx, :] * IDMask[..., np.newaxis] * 255, Color * IDMask[..., np.newaxis], Depth * IDMask, IDMask * 255, Intrinsics.Matrix, isFlipped=False)
+        assert np.allclose(Instance.NOC.Points, NOCPoints) and np.allclose(Instance.NOC.Colors, NOCPoints)
+        assert np.allclose(Instance.Metric.Colors, RGBColors)
+        assert np.allclose(nonZeroPoints(Instance.Metric.Points), Metric)
+
+def test_pose_rcnn_input_overlapping_roi_matches_full_frame():
+    Color, _, Depth = makeFrame()
+    Data = makeDetections()
+    Intrinsics = makeIntrinsics()
+    Cropped = parsing.PoseRCNNInputOverlapping(Color, Depth, Data, Intrinsics)
+    FullData = dict(Data, rois=np.array([[0, 0, Height, Width]] * 2), class_ids=[1, 2])
+    Full = parsing.PoseRCNNInputOverlapping(Color, Depth, FullData, Intrinsics)
+
+    for Idx in range(0, 2):
+        assert Cropped.Masks[Idx].shape == [(13, 17), (14, 20)][Idx]
+        assert np.array_equal(Cropped.uncrop(Idx, Cropped.Masks[Idx]), Full.Masks[Idx])
+        assert np.array_equal(Cropped.uncrop(Idx, Cropped.Masks[Idx]), Data['masks'][:, :, Idx] * 255)
+        for Name in ['NOC', 'Metric']:
+            A, B = getattr(Cropped.Instances[Idx], Name), getattr(Full.Instances[Idx], Name)
+            assert np.allclose(A.Points, B.Points) and np.allclose(A.Colors, B.Colors)
+        # One metric point per mask pixel
+        assert len(Cropped.Instances[Idx].Metric.Points) == np.count_nonzero(Data['masks'][:, :, Idx])
+
+def test_instances_are_built_lazily_once(monkeypatch):
+    Color, Coord, Depth = makeFrame()
+    Labels = np.random.RandomState(1).choice([0, 3, 255], size=(Height, Width)).astype(np.uint8)
+    Built = []
+    Original = parsing.PoseRCNNInput.buildInstance
+    def countingBuild(self, Idx):
+        Built.append(Idx)
+        return Original(self, Idx)
+    monkeypatch.setattr(parsing.PoseRCNNInput, 'buildInstance', countingBuild)
+
+    Input = parsing.PoseRCNNInput(Color, Coord, Depth, np.stack([Labels] * 3, axis=-1), makeIntrinsics())
+    assert Built == [] and not any(Instance.isEvaluated() for Instance in Input.Instances)
+
+    NOC = Input.Instances[1].NOC
+    assert Built == [1] and not Input.Instances[0].isEvaluated()
+    assert Input.Instances[1].Metric is Input.Instances[1].evaluate()[1] and Input.Instances[1].NOC is NOC
+    assert Built == [1]
+
+    NOCs, Metrics = Input.NOCs, Input.Metrics
+    assert Built == [1, 0] and NOCs[1] is NOC and len(Metrics) == 2
+    assert Input.NOCs[0] is NOCs[0] and Built == [1, 0]
+    # Nothing is uploaded or measured before the first draw
+    assert not NOC.isVBOBound and np.all(NOC.BoundingBox[1] == 0)
+
+class RecordingGL(object):
+    # Stands in for OpenGL.GL and OpenGL.arrays.vbo so that the draw path runs without a GL context
+    def __init__(self):
+        self.Calls = []
+
+    def __getattr__(self, Name):
+        if Name.startswith('GL_'):
+            return Name
+        return lambda *Args, **KWArgs: self.Calls.append((Name,) + Args)
+
+    def VBO(self, Data):
+        self.Calls.append(('VBO',))
+        return RecordingGL()
+
+def test_legacy_point_set_lists_draw(monkeypatch):
+    GL = RecordingGL()
+    monkeypatch.setattr(ds, 'gl', GL)
+    monkeypatch.setattr(ds, 'glvbo', GL)
+    Color, Coord, Depth = makeFrame()
+    Labels = np.random.RandomState(1).choice([0, 3, 255], size=(Height, Width)).astype(np.uint8)
+    Input = parsing.PoseRCNNInput(Color, Coord, Depth, np.stack([Labels] * 3, axis=-1), makeIntrinsics())
+
+    for N in Input.NOCs + Input.Metrics:
+        N.draw()
+    Draws = [Call for Call in GL.Calls if Call[0] == 'glDrawArrays']
+    assert [Call[3] for Call in Draws] == [len(N) for N in Input.NOCs + Input.Metrics]
+    for N in Input.NOCs:
+        assert N.isVBOBound and np.allclose(N.BoundingBox[1], N.Points.max(axis=0))
+    # Already uploaded point sets are not uploaded again
+    nUploads = GL.Calls.count(('VBO',))
+    assert nUploads == 2 * len(Draws)
+    Input.Instances[0].drawNOC()
+    assert GL.Calls.count(('VBO',)) == nUploads and GL.Calls[-2][0] == 'glDrawArrays'
@@ -0,0 +1,141 @@
+import numpy as np
+import cv2
+
+from tk3dv.nocstools import datastructures as ds
+from tk3dv.nocstools import pose_estimation
+
+Width, Height = 160, 120
+
+def makeIntrinsics():
+    Intrinsics = ds.CameraIntrinsics(matrix=np.array([[200, 0, 80], [0, 200, 60], [0, 0, 1]], dtype=np.float64))
+    Intrinsics.Width, Intrinsics.Height = Width, Height
+    return Intrinsics
+
+def makeCubePoints(N=100000, Seed=0):
+    # Points on the surface of a cube inside the NOCS
+    P = np.random.RandomState(Seed).uniform(0.1, 0.9, (N, 3))
+    Axis = np.arange(N) % 3
+    P[np.arange(N), Axis] = np.where(np.arange(N) % 2 == 0, 0.1, 0.9)
+    return P
+
+def renderNOCSMap(rvec, tvec, Intrinsics, Points=None):
+    '''
+    NOCS map (white background) of the cube seen by the camera x = R X + t, in the image coordinates of
+    getCorrespondences() (measured from the bottom right).
+    '''
+    Points = makeCubePoints() if Points is None else Points
+    R, _ = cv2.Rodrigues(np.asarray(rvec, dtype=np.float64))
+    Camera = Points @ R.T + np.asarray(tvec, dtype=np.float64).ravel()
+    uv = Camera @ Intrinsics.Matrix.T
+    uv = uv[:, :2] / uv[:, 2:]
+    Cols = np.round(Width - uv[:, 0]).astype(int)
+    Rows = np.round(Height - uv[:, 1]).astype(int)
+    Valid = (Cols >= 0) & (Cols < Width) & (Rows >= 0) & (Rows < Height)
+    # Nearest point per pixel
+    Order = np.lexsort((Camera[Valid, 2], Rows[Valid] * Width + Cols[Valid]))
+    Pixels, First = np.unique((Rows[Valid] * Width + Cols[Valid])[Order], return_index=True)
+    NOCSMap = np.full((Height, Width, 3), 255, dtype=np.uint8)
+    NOCSMap.reshape(-1, 3)[Pixels] = np.round(Points[Valid][Order][First] * 255).astype(np.uint8)
+    return NOCSMap
+
+def getTruePose(rvec, tvec):
+    return pose_estimation.getPoseFromRodrigues(np.asarray(rvec, dtype=np.float64).reshape(3, 1), np.asarray(tvec, dtype=np.float64).reshape(3, 1))
+
+def test_pose_tracker():
+    Intrinsics = makeIntrinsics()
+    Points = makeCubePoints()
+    # Slow motion with a sudden jump at frame 4
+    Rotations = [[0.3 + 0.02 * i, 0.5, 0.1] for i in range(4)] + [[0.3, 0.5, 2.5], [0.3, 0.5, 2.52]]
+    Translation = [-0.5, -0.5, 3.0]
+    Tracker = pose_estimation.PoseTracker(Intrinsics, N=1000)
+
+    FullSolves = []
+    for rvec in Rotations:
+        Pose = Tracker.track(renderNOCSMap(rvec, Translation, Intrinsics, Points))
+        assert Pose is not None
+        r, c = getTruePose(rvec, Translation)
+        assert np.allclose(Pose[2], r, atol=0.02) and np.allclose(Pose[3], c, atol=0.1)
+        FullSolves.append(Tracker.isLastFrameFull)
+    assert FullSolves == [True, False, False, False, True, False]
+    assert Tracker.nFrames == 6 and Tracker.nFullSolves == 2
+
+    # A failed full solve loses track but keeps the statistics
+    Tracker.solveFull = lambda X, x: (None, None)
+    Tracker.JumpFactor = 0.0
+    assert Tracker.track(renderNOCSMap(Rotations[-1], Translation, Intrinsics, Points)) is None
+    assert Tracker.rvec is None and Tracker.ReferenceError is None
+    assert Tracker.nFrames == 7 and Tracker.nFullSolves == 2
+
+def test_correspondences():
+    NOCSMap = np.full((4, 5, 3), 255, dtype=np.uint8)
+    NOCSMap[0, 1] = [200, 0, 0]
+    NOCSMap[2, 4] = [0, 51, 254]
+    NOCSMap[3, 0] = [254, 254, 254]
+    x, X = pose_estimation.getCorrespondences(NOCSMap)
+
+    # Pixel (row, col) ==> (W - col, H - row), paired with its own NOCS value and not with the background
+    assert x.dtype == np.float32 and X.dtype == np.float32
+    assert np.array_equal(x, [[4, 4], [1, 2], [5, 1]])
+    assert np.allclose(X, np.array([[200, 0, 0], [0, 51, 254], [254, 254, 254]]) / 255)
+
+def writeNOCSMap(FileName, NOCSMap):
+    cv2.imwrite(str(FileName), cv2.cvtColor(NOCSMap, cv2.COLOR_RGB2BGR))
+    return str(FileName)
+
+def test_pose_cache(tmp_path, monkeypatch):
+    Intrinsics = makeIntrinsics()
+    NOCSMap = renderNOCSMap([0.3, 0.5, 0.1], [-0.5, -0.5, 3.0], Intrinsics)
+    FileName = writeNOCSMap(tmp_path / 'nocs.png', NOCSMap)
+    assert np.array_equal(pose_estimation.loadNOCSMap(FileName), NOCSMap)
+    CacheDir = str(tmp_path / 'cache')
+    Pose = pose_estimation.estimateCameraPoseCached(FileName, CacheDir, N=500, Seed=0, isVerbose=False)
+    assert Pose[0] is not None and len(list((tmp_path / 'cache').glob('*.json'))) == 1
+
+    # Cached poses are returned without estimation
+    def fail(*Args):
+        raise AssertionError('Pose was estimated again.')
+    monkeypatch.setattr(pose_estimation, 'estimateCameraPose', fail)
+    Cached = pose_estimation.estimateCameraPoseCached(FileName, CacheDir, N=500, Seed=0, isVerbose=False)
+    assert Cached[4] == Pose[4]
+    for A, B in zip(Pose[:4], Cached[:4]):
+        assert np.allclose(A, B)
+
+    # Changing the parameters or the file content invalidates the cache
+    for Kwargs in [dict(N=400, Seed=0), dict(N=500, Seed=1), dict(N=500, Seed=0, RANSACThreshold=2.0), dict(N=500, Seed=0, Intrinsics=Intrinsics)]:
+        with np.testing.assert_raises(AssertionError):
+            pose_estimation.estimateCameraPoseCached(FileName, CacheDir, isVerbose=False, **Kwargs)
+    writeNOCSMap(FileName, renderNOCSMap([0.3, 0.6, 0.1], [-0.5, -0.5, 3.0], Intrinsics))
+    with np.testing.assert_raises(AssertionError):
+        pose_estimation.estimateCameraPoseCached(FileName, CacheDir, N=500, Seed=0, isVerbose=False)
+
+def test_failed_pose_is_not_cached(tmp_path, monkeypatch):
+    Intrinsics = makeIntrinsics()
+    FileName = writeNOCSMap(tmp_path / 'nocs.png', renderNOCSMap([0.3, 0.5, 0.1], [-0.5, -0.5, 3.0], Intrinsics))
+    monkeypatch.setattr(pose_estimation.cv2, 'solvePnPRansac', lambda *Args, **Kwargs: (False, None, None, None))
+    Pose = pose_estimation.estimateCameraPoseCached(FileName, str(tmp_path / 'cache'), N=500, Intrinsics=Intrinsics, isVerbose=False)
+    assert np.all(np.isnan(Pose[2])) and np.all(np.isnan(Pose[3]))
+    assert not (tmp_path / 'cache').exists()
+
+def test_cache_key():
+    Intrinsics = makeIntrinsics()
+    Key = pose_estimation.getCacheKey('abc', 1000, Intrinsics, None, 0, (Width, Height))
+    assert Key == pose_estimation.getCacheKey('abc', 1000, Intrinsics, None, 0, (Width, Height))
+    Other = makeIntrinsics()
+    Other.Matrix = Other.Matrix * [[1.01], [1], [1]]
+    Keys = [pose_estimation.getCacheKey('abd', 1000, Intrinsics, None, 0, (Width, Height)),
+            pose_estimation.getCacheKey('abc', 500, Intrinsics, None, 0, (Width, Height)),
+            pose_estimation.getCacheKey('abc', 1000, Other, None, 0, (Width, Height)),
+            pose_estimation.getCacheKey('abc', 1000, None, None, 0, None),
+            pose_estimation.getCacheKey('abc', 1000, Intrinsics, 2.0, 0, (Width, Height)),
+            pose_estimation.getCacheKey('abc', 1000, Intrinsics, None, 1, (Width, Height)),
+            pose_estimation.getCacheKey('abc', 1000, Intrinsics, None, 0, (2 * Width, 2 * Height))]
+    assert len(set(Keys + [Key])) == len(Keys) + 1
+
+def test_batch_matches_single(tmp_path):
+    Intrinsics = makeIntrinsics()
+    FileNames = [writeNOCSMap(tmp_path / '{}.png'.format(i), renderNOCSMap([0.3, 0.5 + 0.1 * i, 0.1], [-0.5, -0.5, 3.0], Intrinsics)) for i in range(2)]
+    Poses = pose_estimation.estimateCameraPosesBatch(FileNames, CacheDir=str(tmp_path / 'cache'), nWorkers=2, N=500, Seed=0)
+    assert len(list((tmp_path / 'cache').glob('*.json'))) == 2
+    for FileName, Pose in zip(FileNames, Poses):
+        Single = pose_estimation.estimateCameraPoseCached(FileName, None, N=500, Seed=0, isVerbose=False)
+        assert np.allclose(Pose['R'], Single[2]) and np.allclose(Pose['C'], Single[3])
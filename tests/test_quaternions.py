@@ -0,0 +1,40 @@
+import numpy as np
+
+from tk3dv.extern import quaternions
+
+def makeQuaternions(N=200, Seed=0):
+    Q = np.random.default_rng(Seed).normal(size=(N, 4))
+    return Q / np.linalg.norm(Q, axis=1, keepdims=True)
+
+def test_batch_matches_single():
+    Q = makeQuaternions()
+    V = np.random.default_rng(1).normal(size=(len(Q), 3))
+    M = quaternions.quat2mat_batch(Q)
+    assert M.shape == (len(Q), 3, 3)
+    assert np.allclose(M, [quaternions.quat2mat(q) for q in Q])
+    assert np.allclose(quaternions.mult_batch(Q, Q[::-1]), [quaternions.mult(a, b) for a, b in zip(Q, Q[::-1])])
+    assert np.allclose(quaternions.inverse_batch(Q), [quaternions.inverse(q) for q in Q])
+    assert np.allclose(quaternions.rotate_vector_batch(V, Q), [quaternions.rotate_vector(v, q) for v, q in zip(V, Q)])
+    Theta = np.linspace(-3, 3, len(Q))
+    assert np.allclose(quaternions.angle_axis2quat_batch(Theta, V), [quaternions.angle_axis2quat(t, v) for t, v in zip(Theta, V)])
+    assert np.allclose(quaternions.angle_axis2mat_batch(Theta, V), [quaternions.angle_axis2mat(t, v) for t, v in zip(Theta, V)])
+
+def test_mat2quat_round_trip():
+    Q = makeQuaternions()
+    # Rotations by pi are the ill-conditioned cases for a single pivot
+    Q[:3] = np.eye(4)[1:]
+    M = quaternions.quat2mat_batch(Q)
+    for Robust in [False, True]:
+        Q2 = quaternions.mat2quat_batch(M, robust=Robust)
+        assert np.all(Q2[:, 0] >= 0)
+        assert np.allclose(quaternions.quat2mat_batch(Q2), M)
+        assert np.all(quaternions.nearly_equivalent_batch(Q2, Q))
+    assert np.allclose(quaternions.mat2quat_batch(M[5]), quaternions.mat2quat(M[5]))
+
+def test_broadcasting_and_edge_cases():
+    Q = makeQuaternions(12).reshape(3, 4, 4)
+    assert quaternions.mult_batch(Q, Q[0]).shape == (3, 4, 4)
+    assert quaternions.rotate_vector_batch([1.0, 0.0, 0.0], Q).shape == (3, 4, 3)
+    assert np.allclose(quaternions.quat2mat_batch(np.zeros((2, 4))), np.eye(3))
+    Theta, Vector = quaternions.quat2angle_axis_batch(np.array([[1.0, 0, 0, 0], [0, 1.0, 0, 0]]))
+    assert np.allclose(Theta, [0, np.pi]) and np.allclose(Vector, [[1, 0, 0], [1, 0, 0]])
@@ -0,0 +1,70 @@
+import numpy as np
+
+from tk3dv.common import trajectory, utilities
+from tk3dv.extern import quaternions
+
+def makeGLViewerRotation(Pitch, Yaw, Roll):
+    # GLViewer.makeRotationMatrix()
+    Rz = utilities.rotation_matrix(np.array([0, 0, 1]), Roll)
+    Ry = utilities.rotation_matrix(Rz.dot(np.array([0, 1, 0])), Yaw)
+    Rx = utilities.rotation_matrix(Ry.dot(np.array([1, 0, 0])), Pitch)
+    return Rx @ Ry @ Rz
+
+def makeKeyframes(K=8, Seed=0):
+    RNG = np.random.default_rng(Seed)
+    Times = np.concatenate(([0.0], np.cumsum(RNG.uniform(0.5, 2.0, K - 1))))
+    Rotations = RNG.normal(size=(K, 4))
+    return Times, Rotations / np.linalg.norm(Rotations, axis=1, keepdims=True), RNG.normal(size=(K, 3)) * 10
+
+def test_slerp():
+    Q1 = quaternions.angle_axis2quat(np.pi / 2, [0, 0, 1])
+    Angles, _ = quaternions.quat2angle_axis_batch(trajectory.slerp([1.0, 0, 0, 0], Q1, np.linspace(0, 1, 5)))
+    assert np.allclose(Angles, np.linspace(0, np.pi / 2, 5))
+    # Takes the short way for the negated quaternion and is stable for equal ones
+    assert np.allclose(trajectory.slerp([1.0, 0, 0, 0], -Q1, 0.5), quaternions.angle_axis2quat(np.pi / 4, [0, 0, 1]))
+    assert np.allclose(trajectory.slerp(Q1, Q1, [0.0, 0.3, 1.0]), Q1)
+
+def test_keyframes_are_interpolated():
+    Times, Rotations, Positions = makeKeyframes()
+    for RotationMode in trajectory.RotationModes:
+        for PositionMode in trajectory.PositionModes:
+            Trajectory = trajectory.CameraTrajectory(Times, Rotations, Positions, RotationMode, PositionMode)
+            Poses = Trajectory.getPoses(Times)
+            assert Poses.shape == (len(Times), 4, 4)
+            assert np.allclose(Poses[:, :3, :3], quaternions.quat2mat_batch(Rotations))
+            assert np.allclose(Poses[:, :3, 3], Positions)
+            # Clamped outside the keyframes
+            assert np.allclose(Trajectory.getPoses([Times[0] - 1, Times[-1] + 1]), Poses[[0, -1]])
+
+def test_squad_is_smooth():
+    Times, Rotations, Positions = makeKeyframes()
+    Eps = 1e-6
+    T = Times[1:-1, np.newaxis] + np.array([-2 * Eps, -Eps, Eps, 2 * Eps])
+    for RotationMode, isSmooth in [('squad', True), ('slerp', False)]:
+        Q = trajectory.CameraTrajectory(Times, Rotations, Positions, RotationMode).getRotations(T)
+        Left, Right = (Q[:, 1] - Q[:, 0]) / Eps, (Q[:, 3] - Q[:, 2]) / Eps
+        assert np.allclose(Left, Right, atol=1e-4) == isSmooth
+
+def test_camera_stacks(tmp_path):
+    Times, _, Translations = makeKeyframes()
+    RNG = np.random.default_rng(1)
+    Pitch, Yaw = RNG.uniform(-3, 3, (2, len(Times)))
+    Roll = RNG.uniform(-1, 1, len(Times))
+    Distances = RNG.uniform(100, 600, len(Times))
+    assert np.allclose(trajectory.makeStackRotations(Pitch, Yaw, Roll), [makeGLViewerRotation(*A) for A in zip(Pitch, Yaw, Roll)])
+
+    np.savez(tmp_path / 'cams.npz', ps=Pitch, rs=np.zeros_like(Pitch), ys=Yaw, ds=Distances, fs=np.full(len(Times), 60.0), ts=Translations)
+    Trajectory = trajectory.CameraTrajectory.fromCameraFile(tmp_path / 'cams.npz', Times)
+    Trajectory.saveCameraFile(tmp_path / 'out.npz', Times)
+    CamData = np.load(tmp_path / 'out.npz')
+    assert np.allclose(CamData['ts'], Translations) and np.allclose(CamData['ds'], Distances) and np.allclose(CamData['fs'], 60.0)
+    Stacks = [makeGLViewerRotation(*A) for A in zip(CamData['ps'], CamData['ys'], CamData['rs'])]
+    assert np.allclose(Stacks, trajectory.makeStackRotations(Pitch, Yaw, 0.0))
+
+    # Camera centers and viewing directions in between follow the poses
+    T = np.linspace(Times[0], Times[-1], 1000)
+    Poses = Trajectory.getPoses(T)
+    Stacks = Trajectory.getCameraStacks(T)
+    Rotations = trajectory.makeStackRotations(Stacks['ps'], Stacks['ys'], Stacks['rs'])
+    assert np.allclose(Rotations[:, :, 2], Poses[:, :3, 2])
+    assert np.allclose(Rotations[:, :, 2] * Stacks['ds'][:, np.newaxis] + Stacks['ts'], Poses[:, :3, 3])
@@ -0,0 +1,85 @@
+import os
+import numpy as np
+import pytest
+
+import tk3dv.nocstools
+from tk3dv.nocstools import voxelizer
+from tk3dv.extern.binvox import binvox_rw
+
+def makeCube():
+    Vertices = np.array([[x, y, z] for x in (0, 1) for y in (0, 1) for z in (0, 1)], dtype=np.float64)
+    Faces = np.array([[0, 1, 3], [0, 3, 2], [4, 6, 7], [4, 7, 5], [0, 4, 5], [0, 5, 1], [2, 3, 7], [2, 7, 6], [0, 2, 6], [0, 6, 4], [1, 5, 7], [1, 7, 3]])
+    return Vertices, Faces
+
+def makeOctahedron(Scale=(1.0, 0.8, 0.6)):
+    Vertices = np.array([[1, 0, 0], [-1, 0, 0], [0, 1, 0], [0, -1, 0], [0, 0, 1], [0, 0, -1]], dtype=np.float64) * Scale
+    Faces = np.array([[0, 2, 4], [2, 1, 4], [1, 3, 4], [3, 0, 4], [2, 0, 5], [1, 2, 5], [3, 1, 5], [0, 3, 5]])
+    return Vertices, Faces
+
+def test_cube_aligned_with_grid():
+    Vertices, Faces = makeCube()
+    Surface = voxelizer.voxelizeMesh(Vertices, Faces, 16, Fill='none')
+    assert Surface.dims == [16, 16, 16] and Surface.scale == 1.0
+    assert np.count_nonzero(Surface.data) == 16 ** 3 - 14 ** 3
+    for Fill in ['flood', 'parity']:
+        assert np.all(voxelizer.voxelizeMesh(Vertices, Faces, 16, Fill=Fill).data)
+
+def test_surface_matches_brute_force():
+    Vertices, Faces = makeOctahedron()
+    Resolution = 10
+    Model = voxelizer.voxelizeMesh(Vertices, Faces, Resolution, Fill='none')
+    Triangles = (Vertices[Faces] - np.asarray(Model.translate)) * (Resolution / Model.scale)
+    Voxels = np.argwhere(np.ones((Resolution,) * 3, dtype=bool))
+    Expected = np.zeros((Resolution,) * 3, dtype=bool)
+    for Triangle in Triangles:
+        Relative = Triangle[np.newaxis] - (Voxels + 0.5)[:, np.newaxis, :]
+        Hit = voxelizer.triangleBoxOverlap(Relative[:, 0], Relative[:, 1], Relative[:, 2])
+        Expected[tuple(Voxels[Hit].T)] = True
+    assert np.array_equal(Model.data, Expected)
+
+def test_flood_and_parity_fill_agree():
+    Vertices, Faces = makeOctahedron()
+    Flood = voxelizer.voxelizeMesh(Vertices, Faces, 24, Fill='flood', ChunkSize=1000)
+    Parity = voxelizer.voxelizeMesh(Vertices, Faces, 24, Fill='parity', ChunkSize=1000)
+    assert np.array_equal(Flood.data, Parity.data)
+
+    Centers = (np.indices((24,) * 3).transpose(1, 2, 3, 0) + 0.5) / 24 * Flood.scale + Flood.translate
+    Inside = np.sum(np.abs(Centers) / (1.0, 0.8, 0.6), axis=-1) < 0.95
+    assert np.all(Flood.data[Inside])
+
+def test_face_on_grid_plane_marks_both_sides():
+    # Square spanning the grid at z = 2 in grid coordinates (voxel faces between layers 1 and 2)
+    Vertices = np.array([[0.5, 0.5, 2], [3.5, 0.5, 2], [3.5, 3.5, 2], [0.5, 3.5, 2]], dtype=np.float64)
+    Faces = np.array([[0, 1, 2], [0, 2, 3]])
+    Model = voxelizer.voxelizeMesh(Vertices, Faces, 4, Fill='none', Translate=[0.0, 0.0, 0.0], Scale=4.0)
+    Expected = np.zeros((4, 4, 4), dtype=bool)
+    Expected[:, :, 1:3] = True
+    assert np.array_equal(Model.data, Expected)
+
+def test_mesh_without_faces():
+    with pytest.raises(ValueError):
+        voxelizer.voxelizeMesh(np.random.rand(10, 3), np.zeros((0, 3), dtype=np.int64))
+    with pytest.raises(ValueError):
+        voxelizer.getGridTransform(np.zeros((0, 3)))
+    assert voxelizer.subdivideTriangles(np.zeros((0, 3, 3))).shape == (0, 3, 3)
+
+def writeOBJ(path, Vertices, Faces):
+    with open(path, 'w') as f:
+        f.write(''.join('v {} {} {}\n'.format(*v) for v in Vertices))
+        f.write(''.join('f {} {} {}\n'.format(*(np.asarray(Face) + 1)) for Face in Faces))
+    return str(path)
+
+def test_voxelize_objs_in_pool(tmp_path):
+    Meshes = [makeCube(), makeOctahedron()]
+    paths = [writeOBJ(tmp_path / 'mesh_{}.obj'.format(i), *Mesh) for i, Mesh in enumerate(Meshes)]
+    paths.append(writeOBJ(tmp_path / 'points.obj', makeCube()[0], []))
+    paths.append(str(tmp_path / 'missing.obj'))
+    OutDir = str(tmp_path / 'out')
+    OutFiles = voxelizer.voxelizeOBJs(paths, OutDir=OutDir, Resolution=12, nWorkers=2, isVerbose=False)
+
+    assert OutFiles[2:] == [None, None]
+    for OutFile, (Vertices, Faces) in zip(OutFiles[:2], Meshes):
+        assert os.path.dirname(OutFile) == OutDir
+        with open(OutFile, 'rb') as f:
+            Model = binvox_rw.read_as_3d_array(f)
+        assert np.array_equal(Model.data, voxelizer.voxelizeMesh(Vertices, Faces, 12).data)
@@ -5,6 +5,6 @@ import os, sys
 FileDirPath = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(os.path.join(FileDirPath, '.'))
 
-import utilities, drawing, defines
+import utilities, drawing, defines, trajectory
 
 __version__= defines.__version__
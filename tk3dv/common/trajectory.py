@@ -0,0 +1,248 @@
+import numpy as np
+from scipy import interpolate
+
+from tk3dv.extern import quaternions
+
+RotationModes = ['slerp', 'squad']
+PositionModes = ['linear', 'catmull-rom', 'cubic']
+
+# Defaults of the pyEasel GLViewer camera stacks
+DefaultDistance = 500.0
+DefaultFOVY = 75.0
+
+def alignHemispheres(Quaternions):
+    # Flips the signs of (K, 4) quaternions so that consecutive ones have a non-negative dot product, i.e. interpolation takes the short way
+    Signs = np.where(np.sum(Quaternions[1:] * Quaternions[:-1], axis=1) < 0, -1.0, 1.0)
+    return Quaternions * np.concatenate(([1.0], np.cumprod(Signs)))[:, np.newaxis]
+
+def quaternionLog(Q):
+    # Logarithm (half the rotation vector) of (..., 4) unit quaternions with w >= 0
+    Theta, Axis = quaternions.quat2angle_axis_batch(Q)
+    return Axis * (Theta / 2.0)[..., np.newaxis]
+
+def quaternionExp(V):
+    # Unit quaternions exp(V) of (..., 3) vectors, the inverse of quaternionLog()
+    Angle = np.linalg.norm(V, axis=-1, keepdims=True)
+    return np.concatenate([np.cos(Angle), np.sinc(Angle / np.pi) * V], axis=-1)
+
+def slerp(Q0, Q1, T, ShortestPath=True, Eps=1e-9):
+    '''
+    Spherical linear interpolation between unit quaternions Q0 and Q1 (..., 4) at parameters T (...) in [0, 1].
+    With ShortestPath, Q1 is negated where needed so that the interpolation never turns by more than 180 degrees.
+    '''
+    Q0 = np.asarray(Q0, dtype=np.float64)
+    Q1 = np.asarray(Q1, dtype=np.float64)
+    T = np.asarray(T, dtype=np.float64)[..., np.newaxis]
+    if ShortestPath:
+        Q1 = np.where(np.sum(Q0 * Q1, axis=-1, keepdims=True) < 0, -Q1, Q1)
+    # Angle between the quaternions, accurate also when they are close
+    Omega = 2.0 * np.arctan2(np.linalg.norm(Q0 - Q1, axis=-1, keepdims=True), np.linalg.norm(Q0 + Q1, axis=-1, keepdims=True))
+    SinOmega = np.sin(Omega)
+    isSmall = SinOmega < Eps
+    SinOmega = np.where(isSmall, 1.0, SinOmega)
+    W0 = np.where(isSmall, 1.0 - T, np.sin((1.0 - T) * Omega) / SinOmega)
+    W1 = np.where(isSmall, T, np.sin(T * Omega) / SinOmega)
+    Q = W0 * Q0 + W1 * Q1
+
+    return Q / np.linalg.norm(Q, axis=-1, keepdims=True)
+
+def getSquadControlPoints(Quaternions, Times=None):
+    '''
+    Inner control points of SQUAD for (K, 4) hemisphere aligned keyframe quaternions (see alignHemispheres()).
+    With keyframe Times, the tangents are weighted by the neighbouring segment durations so that the angular velocity
+    is continuous in time rather than in the segment parameter. The end points are their own control points.
+    '''
+    S = Quaternions.copy()
+    if len(Quaternions) > 2:
+        Q = Quaternions[1:-1]
+        QInv = quaternions.conjugate_batch(Q)
+        Next = quaternionLog(quaternions.mult_batch(QInv, Quaternions[2:]))
+        Prev = quaternionLog(quaternions.mult_batch(QInv, Quaternions[:-2]))
+        if Times is None:
+            Log = -(Next + Prev) / 4.0
+        else:
+            Dt = np.diff(Times)[:, np.newaxis]
+            Log = -(Dt[1:] * Prev + Dt[:-1] * Next) / (2.0 * (Dt[:-1] + Dt[1:]))
+        S[1:-1] = quaternions.mult_batch(Q, quaternionExp(Log))
+
+    return S
+
+def squad(Q0, Q1, S0, S1, T):
+    '''
+    Spherical quadrangle interpolation between Q0 and Q1 (..., 4) with control points S0 and S1 at parameters T (...).
+    Rotations are C1 continuous across keyframes when the control points come from getSquadControlPoints().
+    '''
+    T = np.asarray(T, dtype=np.float64)
+    return slerp(slerp(Q0, Q1, T), slerp(S0, S1, T, ShortestPath=False), 2.0 * T * (1.0 - T), ShortestPath=False)
+
+def getCatmullRomTangents(Times, Positions):
+    # Tangents (K, D) from central differences over non-uniform Times, one-sided at the ends
+    Tangents = np.empty_like(Positions)
+    Tangents[1:-1] = (Positions[2:] - Positions[:-2]) / (Times[2:] - Times[:-2])[:, np.newaxis]
+    Tangents[0] = (Positions[1] - Positions[0]) / (Times[1] - Times[0])
+    Tangents[-1] = (Positions[-1] - Positions[-2]) / (Times[-1] - Times[-2])
+
+    return Tangents
+
+def makeStackRotations(Pitch, Yaw, Roll):
+    '''
+    Batched GLViewer.makeRotationMatrix(): roll about z, yaw about the rolled y axis and pitch about the resulting x axis.
+    Angles in radians, returns (..., 3, 3) camera to world rotations.
+    '''
+    Pitch, Yaw, Roll = np.broadcast_arrays(*[np.asarray(A, dtype=np.float64) for A in (Pitch, Yaw, Roll)])
+    Rz = quaternions.angle_axis2mat_batch(Roll, np.broadcast_to([0.0, 0.0, 1.0], Roll.shape + (3,)), is_normalized=True)
+    Ry = quaternions.angle_axis2mat_batch(Yaw, Rz[..., :, 1], is_normalized=True)
+    Rx = quaternions.angle_axis2mat_batch(Pitch, Ry[..., :, 0], is_normalized=True)
+
+    return Rx @ Ry @ Rz
+
+def getStackAngles(Rotations):
+    '''
+    Pitch and yaw (radians) of a roll free GLViewer camera with the same viewing direction as the (..., 3, 3) rotations.
+    Cameras that are upside down (negative up vector y) stay upside down. Any twist about the viewing direction is dropped.
+    '''
+    # The GLViewer camera looks along -z, so z is the direction from the look at point to the camera
+    Z = Rotations[..., :, 2]
+    Sign = np.where(Rotations[..., 1, 1] < 0, -1.0, 1.0)
+    Pitch = np.arctan2(-Z[..., 1], Sign * np.hypot(Z[..., 0], Z[..., 2]))
+    Yaw = np.arctan2(Sign * Z[..., 0], Sign * Z[..., 2])
+
+    return Pitch, Yaw
+
+class CameraTrajectory():
+    '''
+    Smooth camera path through keyframe poses at strictly increasing Times (K,).
+    Rotations are (K, 4) quaternions (w, x, y, z) or (K, 3, 3) matrices that map camera to world coordinates in the
+    OpenGL convention of pyEasel (the camera looks along -z with y up). Positions (K, 3) are the camera centers.
+    All evaluation methods take arrays of timestamps and are vectorized over them. Timestamps outside the keyframes are clamped.
+    '''
+    def __init__(self, Times, Rotations, Positions, RotationMode='squad', PositionMode='catmull-rom'):
+        if RotationMode not in RotationModes:
+            raise ValueError('Unknown rotation mode {}. Available: {}'.format(RotationMode, RotationModes))
+        if PositionMode not in PositionModes:
+            raise ValueError('Unknown position mode {}. Available: {}'.format(PositionMode, PositionModes))
+
+        self.Times = np.asarray(Times, dtype=np.float64).ravel()
+        if len(self.Times) < 2:
+            raise ValueError('A trajectory needs at least 2 keyframes.')
+        if np.any(np.diff(self.Times) <= 0):
+            raise ValueError('Keyframe times must be strictly increasing.')
+
+        Rotations = np.asarray(Rotations, dtype=np.float64)
+        if Rotations.shape[-2:] == (3, 3):
+            Rotations = quaternions.mat2quat_batch(Rotations)
+        Rotations = Rotations.reshape(-1, 4)
+        self.Quaternions = alignHemispheres(Rotations / np.linalg.norm(Rotations, axis=1, keepdims=True))
+        self.Positions = np.asarray(Positions, dtype=np.float64).reshape(-1, 3)
+        if len(self.Quaternions) != len(self.Times) or len(self.Positions) != len(self.Times):
+            raise ValueError('Expected {} keyframe rotations and positions.'.format(len(self.Times)))
+
+        self.RotationMode = RotationMode
+        self.PositionMode = PositionMode
+        if RotationMode == 'squad':
+            self.SquadPoints = getSquadControlPoints(self.Quaternions, self.Times)
+        if PositionMode == 'catmull-rom':
+            self.Tangents = getCatmullRomTangents(self.Times, self.Positions)
+        elif PositionMode == 'cubic':
+            self.Spline = interpolate.CubicSpline(self.Times, self.Positions, axis=0, bc_type='natural')
+
+        # Optional keyframe distances and fields of view of GLViewer cameras, see fromCameraStacks()
+        self.Distances = None
+        self.FOVYs = None
+
+    @staticmethod
+    def fromPoses(Times, Poses, **Kwargs):
+        # Poses are (K, 4, 4) camera to world matrices
+        Poses = np.asarray(Poses, dtype=np.float64)
+        return CameraTrajectory(Times, Poses[:, :3, :3], Poses[:, :3, 3], **Kwargs)
+
+    @staticmethod
+    def fromCameraStacks(Times, PitchStack, RollStack, YawStack, DistanceStack, TranslationStack, FOVYStack=None, **Kwargs):
+        '''
+        Trajectory through GLViewer cameras. The stack distances and fields of view are interpolated linearly by getCameraStacks().
+        '''
+        Rotations = makeStackRotations(PitchStack, YawStack, RollStack).reshape(-1, 3, 3)
+        Distances = np.asarray(DistanceStack, dtype=np.float64).ravel()
+        Positions = Rotations[:, :, 2] * Distances[:, np.newaxis] + np.asarray(TranslationStack, dtype=np.float64).reshape(-1, 3)
+        Trajectory = CameraTrajectory(Times, Rotations, Positions, **Kwargs)
+        Trajectory.Distances = Distances
+        if FOVYStack is not None:
+            Trajectory.FOVYs = np.asarray(FOVYStack, dtype=np.float64).ravel()
+
+        return Trajectory
+
+    @staticmethod
+    def fromCameraFile(FileName, Times=None, **Kwargs):
+        '''
+        Trajectory through the cameras of a GLViewer camera file (see GLViewer.saveCameras()). Times default to 0, 1, 2...
+        '''
+        CamData = np.load(FileName)
+        Times = np.arange(len(CamData['ts'])) if Times is None else Times
+        return CameraTrajectory.fromCameraStacks(Times, CamData['ps'], CamData['rs'], CamData['ys'], CamData['ds'], CamData['ts'], CamData['fs'], **Kwargs)
+
+    def getSegments(self, T):
+        # Keyframe segment index and local parameter in [0, 1] of timestamps T
+        T = np.clip(np.asarray(T, dtype=np.float64), self.Times[0], self.Times[-1])
+        Idx = np.clip(np.searchsorted(self.Times, T, side='right') - 1, 0, len(self.Times) - 2)
+        H = (T - self.Times[Idx]) / (self.Times[Idx + 1] - self.Times[Idx])
+
+        return Idx, H
+
+    def getRotations(self, T):
+        # Unit quaternions (..., 4) at timestamps T (...)
+        Idx, H = self.getSegments(T)
+        if self.RotationMode == 'slerp':
+            return slerp(self.Quaternions[Idx], self.Quaternions[Idx + 1], H)
+        return squad(self.Quaternions[Idx], self.Quaternions[Idx + 1], self.SquadPoints[Idx], self.SquadPoints[Idx + 1], H)
+
+    def getPositions(self, T):
+        # Camera centers (..., 3) at timestamps T (...)
+        if self.PositionMode == 'cubic':
+            return self.Spline(np.clip(np.asarray(T, dtype=np.float64), self.Times[0], self.Times[-1]))
+
+        Idx, H = self.getSegments(T)
+        P0, P1 = self.Positions[Idx], self.Positions[Idx + 1]
+        H = H[..., np.newaxis]
+        if self.PositionMode == 'linear':
+            return P0 + (P1 - P0) * H
+
+        # Cubic Hermite basis
+        H2 = H * H
+        H3 = H2 * H
+        Dt = (self.Times[Idx + 1] - self.Times[Idx])[..., np.newaxis]
+        return (2 * H3 - 3 * H2 + 1) * P0 + (H3 - 2 * H2 + H) * Dt * self.Tangents[Idx] + (-2 * H3 + 3 * H2) * P1 + (H3 - H2) * Dt * self.Tangents[Idx + 1]
+
+    def getPoses(self, T):
+        # Camera to world matrices (..., 4, 4) at timestamps T (...)
+        T = np.asarray(T, dtype=np.float64)
+        Poses = np.zeros(T.shape + (4, 4))
+        Poses[..., :3, :3] = quaternions.quat2mat_batch(self.getRotations(T))
+        Poses[..., :3, 3] = self.getPositions(T)
+        Poses[..., 3, 3] = 1.0
+
+        return Poses
+
+    def getCameraStacks(self, T, Distance=None, FOVY=None):
+        '''
+        GLViewer camera stacks at timestamps T, as a dict with the keys of GLViewer.saveCameras() (ps, rs, ys, ds, fs, ts).
+        The cameras have the camera centers and viewing directions of the trajectory and no roll (see getStackAngles()).
+        Distance (distance to the look at point) and FOVY are scalars or per timestamp arrays. They default to the
+        interpolated keyframe stacks of fromCameraStacks() or to the GLViewer defaults.
+        '''
+        T = np.asarray(T, dtype=np.float64).ravel()
+        if Distance is None:
+            Distance = DefaultDistance if self.Distances is None else np.interp(T, self.Times, self.Distances)
+        if FOVY is None:
+            FOVY = DefaultFOVY if self.FOVYs is None else np.interp(T, self.Times, self.FOVYs)
+        Distance = np.broadcast_to(np.asarray(Distance, dtype=np.float64), T.shape)
+        FOVY = np.broadcast_to(np.asarray(FOVY, dtype=np.float64), T.shape)
+
+        Rotations = quaternions.quat2mat_batch(self.getRotations(T))
+        Pitch, Yaw = getStackAngles(Rotations)
+        Translation = self.getPositions(T) - Rotations[:, :, 2] * Distance[:, np.newaxis]
+
+        return {'ps': Pitch, 'rs': np.zeros_like(Pitch), 'ys': Yaw, 'ds': Distance.copy(), 'fs': FOVY.copy(), 'ts': Translation}
+
+    def saveCameraFile(self, FileName, T, Distance=None, FOVY=None):
+        # Writes the cameras at timestamps T in the format of GLViewer.saveCameras(), which GLViewer.loadCameras() reads
+        np.savez(FileName, **self.getCameraStacks(T, Distance, FOVY))
@@ -58,4 +58,16 @@ def backproject(DepthImage, Intrinsics, mask=None):
     pts[:, 1] = -pts[:, 1]
     OutPoints = pts
 
-    return OutPoints
\ No newline at end of file
+    return OutPoints
+
+def backprojectPixels(Rows, Cols, Depths, Intrinsics):
+    # Same as backproject() but only for the given pixels, e.g. the pixels of one instance
+    IntrinsicsInv = np.linalg.inv(Intrinsics)
+    uv_grid = np.stack([Cols, Rows, np.ones(len(Rows))], axis=0)  # [3, num_pixel]
+
+    xyz = np.transpose(IntrinsicsInv @ uv_grid)  # [num_pixel, 3]
+    pts = xyz * np.reshape(Depths, (-1, 1)) / xyz[:, -1:]
+    pts[:, 0] = -pts[:, 0]
+    pts[:, 1] = -pts[:, 1]
+
+    return pts
@@ -102,6 +102,111 @@ class Voxels(object):
     def write(self, fp):
         write(self, fp)
 
+    def pack(self):
+        """ Bit-packed copy of this model, see PackedVoxels.
+        """
+        return PackedVoxels.from_voxels(self)
+
+# number of set bits in every byte value
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+class PackedVoxels(object):
+    """ Holds a binvox model with one bit per voxel.
+
+    data is a three-dimensional numpy uint8 array holding the dense grid
+    packed with np.packbits along its last (fastest) axis, i.e. shape
+    (shape[0], shape[1], ceil(shape[2]/8)). shape is the shape of the
+    equivalent dense array and axis_order its axis ordering, as in Voxels.
+    Padding bits at the end of the last axis are always zero.
+
+    This uses 8 times less memory than the dense boolean representation and
+    supports occupancy queries, AND/OR and voxel counting without unpacking.
+    """
+
+    def __init__(self, data, shape, dims, translate, scale, axis_order):
+        self.data = data
+        self.shape = tuple(shape)
+        self.dims = dims
+        self.translate = translate
+        self.scale = scale
+        assert (axis_order in ('xzy', 'xyz'))
+        self.axis_order = axis_order
+
+    @staticmethod
+    def from_voxels(voxel_model):
+        """ Pack a dense or coordinate Voxels model.
+        Coordinate models are packed from their RLE form, without densifying.
+        """
+        if voxel_model.data.ndim==2:
+            pairs = sparse_to_rle(voxel_model.data, voxel_model.dims, voxel_model.axis_order)
+            return rle_to_packed(pairs[::2], pairs[1::2], voxel_model.dims, voxel_model.translate,
+                                 voxel_model.scale, fix_coords=(voxel_model.axis_order=='xyz'))
+        data = np.packbits(voxel_model.data.astype(np.bool_, copy=False), axis=-1)
+        return PackedVoxels(data, voxel_model.data.shape, voxel_model.dims[:], voxel_model.translate[:],
+                            voxel_model.scale, voxel_model.axis_order)
+
+    def clone(self):
+        return PackedVoxels(self.data.copy(), self.shape, self.dims[:], self.translate[:], self.scale, self.axis_order)
+
+    def unpack(self):
+        """ Dense Voxels model with the same axis order.
+        """
+        data = np.unpackbits(self.data, axis=-1, count=self.shape[2]).astype(np.bool_)
+        return Voxels(data, self.dims[:], self.translate[:], self.scale, self.axis_order)
+
+    def occupied(self, i, j, k):
+        """ Occupancy of voxels (i, j, k), indexed like the dense array.
+        Accepts integers or broadcastable integer arrays.
+        """
+        k = np.asarray(k)
+        return ((self.data[i, j, k >> 3] >> (7 - (k & 7))) & 1).astype(np.bool_)
+
+    def count(self):
+        """ Number of occupied voxels.
+        """
+        return int(_POPCOUNT[self.data].sum(dtype=np.int64))
+
+    def _check_compatible(self, other):
+        if self.shape != other.shape or self.axis_order != other.axis_order:
+            raise ValueError('Packed voxel grids have different shapes or axis orders.')
+
+    def __and__(self, other):
+        self._check_compatible(other)
+        return PackedVoxels(self.data & other.data, self.shape, self.dims[:], self.translate[:], self.scale, self.axis_order)
+
+    def __or__(self, other):
+        self._check_compatible(other)
+        return PackedVoxels(self.data | other.data, self.shape, self.dims[:], self.translate[:], self.scale, self.axis_order)
+
+    def iou(self, other):
+        """ Intersection over union of the occupied voxels.
+        """
+        union = (self | other).count()
+        return (self & other).count() / union if union > 0 else 1.0
+
+    def to_rle(self):
+        """ Interleaved (value, count) binvox pairs.
+        Run boundaries are found on the packed bits where the grid shape allows
+        it, otherwise one x slab at a time.
+        """
+        rows, cols = self.shape[1], self.shape[2]
+        if cols % 8 == 0 and (self.axis_order=='xzy' or rows % 8 == 0):
+            data = self.data if self.axis_order=='xzy' else _transpose_packed(self.data, rows, cols)
+            return _split_runs(*_packed_runs(data.ravel(), int(np.prod(self.shape))))
+
+        values, counts = [], []
+        for slab in self.data:
+            slab = np.unpackbits(slab, axis=-1, count=cols)
+            if self.axis_order=='xyz':
+                slab = slab.T
+            v, c = _runs(slab.ravel())
+            values.append(v)
+            counts.append(c)
+        return _split_runs(*_merge_runs(np.concatenate(values), np.concatenate(counts)))
+
+    def write(self, fp):
+        write(self, fp)
+
 def read_header(fp):
     """ Read binvox header. Mostly meant for internal use.
     """
@@ -150,6 +255,83 @@ def read_as_3d_array(fp, fix_coords=True):
         axis_order = 'xzy'
     return Voxels(data, dims, translate, scale, axis_order)
 
+def read_as_packed_array(fp, fix_coords=True):
+    """ Read binary binvox format as a bit-packed array.
+
+    Returns a PackedVoxels model. All runs are decoded at once by
+    rle_to_packed() directly into packed bits, so the full byte-per-voxel
+    array is never materialized (only grids whose packed axes are not
+    multiples of 8 are expanded, one x slab at a time).
+    """
+    dims, translate, scale = read_header(fp)
+    raw_data = np.frombuffer(fp.read(), dtype=np.uint8)
+    return rle_to_packed(raw_data[::2], raw_data[1::2], dims, translate, scale, fix_coords)
+
+def rle_to_packed(values, counts, dims, translate, scale, fix_coords=True):
+    """ Decode binvox (value, count) runs into a PackedVoxels model.
+    Mostly meant for internal use.
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    values = np.asarray(values).astype(np.bool_)
+    slab_shape = (dims[1], dims[2])
+    if fix_coords:
+        slab_shape = slab_shape[::-1]
+    shape = (dims[0],) + slab_shape
+    axis_order = 'xyz' if fix_coords else 'xzy'
+
+    if dims[2] % 8 == 0 and (not fix_coords or dims[1] % 8 == 0):
+        data = _runs_to_packed(values, counts, int(np.prod(dims))).reshape(dims[0], dims[1], dims[2] // 8)
+        if fix_coords:
+            data = _transpose_packed(data, dims[1], dims[2])
+        return PackedVoxels(data, shape, dims, translate, scale, axis_order)
+
+    # odd sizes: expand and pack one x slab at a time
+    end_indices = np.cumsum(counts)
+    start_indices = end_indices - counts
+    data = np.empty((dims[0], slab_shape[0], (slab_shape[1] + 7) // 8), dtype=np.uint8)
+    slab_size = dims[1]*dims[2]
+    for x in range(dims[0]):
+        lo, hi = x*slab_size, (x + 1)*slab_size
+        first = np.searchsorted(end_indices, lo, side='right')
+        last = np.searchsorted(start_indices, hi, side='left')
+        lengths = np.minimum(end_indices[first:last], hi) - np.maximum(start_indices[first:last], lo)
+        slab = np.repeat(values[first:last], lengths).reshape(dims[1], dims[2])
+        if fix_coords:
+            slab = slab.T
+        data[x] = np.packbits(slab, axis=-1)
+
+    return PackedVoxels(data, shape, dims, translate, scale, axis_order)
+
+# row b holds the 8 bits of byte b, most significant first (as np.unpackbits)
+_BIT_TABLE = np.unpackbits(np.arange(256, dtype=np.uint8)[:, np.newaxis], axis=1)
+
+def decode_runs(values, counts, out):
+    """ Decode binvox (value, count) runs into the preallocated flat uint8
+    array out (1 for filled voxels), in file (xzy) order.
+
+    Value changes are written as +1 / -1 (255) steps at the run starts and
+    then accumulated in place, so no other array of grid size is created.
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    if counts.size == 0 or np.any(counts == 0):
+        # a zero length run shares its start with the next one and would drop a step
+        raise ValueError('Binvox runs must have nonzero counts.')
+    starts = np.cumsum(counts) - counts
+    if starts[-1] + counts[-1] != out.size:
+        raise ValueError('Binvox runs do not cover the grid.')
+
+    filled = np.asarray(values) > 0
+    changed = filled != np.concatenate(([False], filled[:-1]))
+    out[:] = 0
+    out[starts[changed]] = np.where(filled[changed], 1, 255).astype(np.uint8)
+    np.cumsum(out, dtype=np.uint8, out=out)
+
+def unpack_bits(packed, out):
+    """ Unpack np.packbits bytes into the preallocated uint8 array out, which
+    holds 8 bytes per packed byte (padding bits included).
+    """
+    np.take(_BIT_TABLE, np.asarray(packed).ravel(), axis=0, out=out.reshape(-1, 8))
+
 def read_as_coord_array(fp, fix_coords=True):
     """ Read binary binvox format as coordinates.
 
@@ -158,7 +340,7 @@ def read_as_coord_array(fp, fix_coords=True):
     corresponds to a nonzero voxel and the 3 rows are the (x, z, y) coordinates
     of the voxel.  (The odd ordering is due to the way binvox format lays out
     data).  Note that coordinates refer to the binvox voxels, without any
-    scaling or translation.
+    scaling or translation. Coordinates are int32.
 
     Use this to save memory if your model is very sparse (mostly empty).
 
@@ -167,29 +349,24 @@ def read_as_coord_array(fp, fix_coords=True):
     dims, translate, scale = read_header(fp)
     raw_data = np.frombuffer(fp.read(), dtype=np.uint8)
 
-    values, counts = raw_data[::2], raw_data[1::2]
+    values, counts = raw_data[::2], raw_data[1::2].astype(np.int64)
 
-    sz = np.prod(dims)
-    index, end_index = 0, 0
+    # expand the filled runs into linear voxel indices without a Python loop:
+    # each index is the start of its run plus its offset within the run
     end_indices = np.cumsum(counts)
-    indices = np.concatenate(([0], end_indices[:-1])).astype(end_indices.dtype)
+    filled = values.astype(np.bool_)
+    run_starts = (end_indices - counts)[filled]
+    run_counts = counts[filled]
+    nz_voxels = np.arange(run_counts.sum(), dtype=np.int64)
+    nz_voxels += np.repeat(run_starts - (np.cumsum(run_counts) - run_counts), run_counts)
 
-    values = values.astype(np.bool)
-    indices = indices[values]
-    end_indices = end_indices[values]
-
-    nz_voxels = []
-    for index, end_index in zip(indices, end_indices):
-        nz_voxels.extend(range(index, end_index))
-    nz_voxels = np.array(nz_voxels)
-    # TODO are these dims correct?
     # according to docs,
     # index = x * wxh + z * width + y; // wxh = width * height = d * d
-
-    x = nz_voxels / (dims[0]*dims[1])
-    zwpy = nz_voxels % (dims[0]*dims[1]) # z*w + y
-    z = zwpy / dims[0]
-    y = zwpy % dims[0]
+    wxh = dims[1]*dims[2]
+    x = (nz_voxels // wxh).astype(np.int32)
+    zwpy = nz_voxels % wxh # z*w + y
+    z = (zwpy // dims[2]).astype(np.int32)
+    y = (zwpy % dims[2]).astype(np.int32)
     if fix_coords:
         data = np.vstack((x, y, z))
         axis_order = 'xyz'
@@ -229,55 +406,176 @@ def sparse_to_dense(voxel_data, dims, dtype=np.bool):
     #"""
     #return x*(dims[1]*dims[2]) + z*dims[1] + y
 
+def _split_runs(values, counts):
+    """ Split runs longer than 255 into pairs the binvox format can hold.
+    Returns the interleaved (value, count) pairs as a flat uint8 array.
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    keep = counts > 0
+    values, counts = values[keep], counts[keep]
+    n_chunks = (counts + 254) // 255
+    pairs = np.empty((int(n_chunks.sum()), 2), dtype=np.uint8)
+    pairs[:, 0] = np.repeat(values, n_chunks)
+    pairs[:, 1] = 255
+    pairs[np.cumsum(n_chunks) - 1, 1] = counts - 255*(n_chunks - 1)
+    return pairs.ravel()
+
+def _runs(voxels_flat):
+    """ Values and lengths of the runs in flat voxel data.
+    Run boundaries are found in one pass, without a per-voxel loop.
+    """
+    voxels_flat = np.asarray(voxels_flat).astype(np.bool_, copy=False)
+    if voxels_flat.size == 0:
+        return np.zeros(0, dtype=np.uint8), np.zeros(0, dtype=np.int64)
+    starts = np.concatenate(([0], np.flatnonzero(voxels_flat[1:] != voxels_flat[:-1]) + 1))
+    counts = np.diff(np.append(starts, voxels_flat.size))
+    return voxels_flat[starts].astype(np.uint8), counts
+
+def _merge_runs(values, counts):
+    """ Merge consecutive runs with the same value.
+    """
+    if values.size == 0:
+        return values, counts
+    starts = np.flatnonzero(np.concatenate(([True], values[1:] != values[:-1])))
+    return values[starts], np.add.reduceat(counts, starts)
+
+# bit j (most significant first) of _PREFIX_XOR[b] is the xor of bits 0..j of b
+_PREFIX_XOR = np.zeros(256, dtype=np.uint8)
+for _b in range(256):
+    for _j in range(8):
+        if bin(_b >> (7 - _j)).count('1') % 2:
+            _PREFIX_XOR[_b] |= 128 >> _j
+
+def _runs_to_packed(values, counts, size):
+    """ Decode runs into flat bits packed like np.packbits.
+    Only the run boundaries are touched per run; the bits are then filled in
+    with a prefix xor over bytes, so no byte-per-voxel array is created.
+    """
+    keep = counts > 0
+    values, counts = values[keep], counts[keep]
+    packed = np.zeros((size + 7) // 8, dtype=np.uint8)
+    if values.size == 0:
+        return packed
+    # the grid flips value wherever a run differs from the previous one
+    starts = np.cumsum(counts) - counts
+    flips = np.concatenate(([values[0]], values[1:] != values[:-1], [values[-1]]))
+    positions = np.append(starts, starts[-1] + counts[-1])[flips]
+    positions = positions[positions < size]
+    if positions.size == 0:
+        return packed
+    byte_ix = positions >> 3
+    first = np.flatnonzero(np.concatenate(([True], byte_ix[1:] != byte_ix[:-1])))
+    packed[byte_ix[first]] = np.bitwise_or.reduceat((128 >> (positions & 7)).astype(np.uint8), first)
+
+    parity = _POPCOUNT[packed] & 1
+    carry = np.bitwise_xor.accumulate(parity) ^ parity
+    bits = _PREFIX_XOR[packed]
+    bits ^= carry * np.uint8(255)
+    return bits
+
+def _packed_runs(bits, size):
+    """ Values and lengths of the runs in flat bits packed like np.packbits.
+    """
+    if size == 0:
+        return np.zeros(0, dtype=np.uint8), np.zeros(0, dtype=np.int64)
+    # a bit differs from its predecessor where it differs from the bits shifted by one
+    shifted = bits >> 1
+    shifted[1:] |= bits[:-1] << 7
+    flips = bits ^ shifted
+    flip_bytes = np.flatnonzero(flips)
+    rows, cols = np.nonzero(np.unpackbits(flips[flip_bytes]).reshape(-1, 8))
+    boundaries = flip_bytes[rows].astype(np.int64)*8 + cols
+    boundaries = boundaries[boundaries < size]
+    if boundaries.size == 0 or boundaries[0] != 0:
+        boundaries = np.concatenate(([0], boundaries))
+    counts = np.diff(np.append(boundaries, size))
+    values = ((bits[0] >> 7) + np.arange(boundaries.size)) % 2
+    return values.astype(np.uint8), counts
+
+def _transpose8(x):
+    """ Transpose the 8x8 bit matrices held in big-endian uint64 words.
+    """
+    u = np.uint64
+    t = (x ^ (x >> u(7))) & u(0x00AA00AA00AA00AA)
+    x = x ^ t ^ (t << u(7))
+    t = (x ^ (x >> u(14))) & u(0x0000CCCC0000CCCC)
+    x = x ^ t ^ (t << u(14))
+    t = (x ^ (x >> u(28))) & u(0x00000000F0F0F0F0)
+    return x ^ t ^ (t << u(28))
+
+def _transpose_packed(data, rows, cols):
+    """ Swap the last two axes of an (n, rows, cols/8) packed bit array.
+    Returns an (n, cols, rows/8) array. rows and cols must be multiples of 8.
+    """
+    n = data.shape[0]
+    blocks = data.reshape(n, rows // 8, 8, cols // 8).transpose(0, 3, 1, 2)
+    words = np.ascontiguousarray(blocks).view('>u8').astype(np.uint64)
+    blocks = _transpose8(words).astype('>u8').view(np.uint8).reshape(n, cols // 8, rows // 8, 8)
+    return np.ascontiguousarray(blocks.transpose(0, 1, 3, 2)).reshape(n, cols, rows // 8)
+
+def dense_to_rle(voxels_flat):
+    """ Run-length encode flat (xzy ordered) dense voxel data.
+    """
+    return _split_runs(*_runs(voxels_flat))
+
+def sparse_to_rle(voxel_data, dims, axis_order='xzy'):
+    """ Run-length encode a 3xN coordinate array without densifying it.
+    Voxels that fall outside dims are discarded, as in sparse_to_dense.
+    """
+    if voxel_data.ndim!=2 or voxel_data.shape[0]!=3:
+        raise ValueError('voxel_data is wrong shape; should be 3xN array.')
+    dims = np.asarray(dims, dtype=np.int64)
+    xzy = voxel_data.astype(np.int64)
+    if axis_order=='xyz':
+        xzy = xzy[[0, 2, 1]]
+    valid_ix = ~np.any((xzy < 0) | (xzy >= dims[:, np.newaxis]), 0)
+    xzy = xzy[:, valid_ix]
+    # index = x * wxh + z * width + y, matching the dense xzy layout
+    indices = np.unique(xzy[0]*(dims[1]*dims[2]) + xzy[1]*dims[2] + xzy[2])
+    sz = int(np.prod(dims))
+    if indices.size == 0:
+        return _split_runs(np.zeros(1, dtype=np.uint8), [sz])
+    breaks = np.flatnonzero(np.diff(indices) != 1) + 1
+    run_starts = indices[np.concatenate(([0], breaks))]
+    run_ends = indices[np.append(breaks - 1, indices.size - 1)] + 1
+    # alternate empty gaps and filled runs, then the trailing gap
+    gaps = run_starts - np.concatenate(([0], run_ends[:-1]))
+    counts = np.empty(2*run_starts.size + 1, dtype=np.int64)
+    counts[0:-1:2] = gaps
+    counts[1::2] = run_ends - run_starts
+    counts[-1] = sz - run_ends[-1]
+    values = np.zeros(counts.size, dtype=np.uint8)
+    values[1::2] = 1
+    return _split_runs(values, counts)
+
 def write(voxel_model, fp):
     """ Write binary binvox format.
 
-    Note that when saving a model in sparse (coordinate) format, it is first
-    converted to dense format.
+    Models in sparse (coordinate) format are encoded directly from their
+    coordinates, and PackedVoxels models slab by slab, without conversion to
+    dense format.
 
     Doesn't check if the model is 'sane'.
 
     """
-    if voxel_model.data.ndim==2:
-        # TODO avoid conversion to dense
-        dense_voxel_data = sparse_to_dense(voxel_model.data, voxel_model.dims)
-    else:
-        dense_voxel_data = voxel_model.data
-
-    fp.write('#binvox 1\n')
-    fp.write('dim '+' '.join(map(str, voxel_model.dims))+'\n')
-    fp.write('translate '+' '.join(map(str, voxel_model.translate))+'\n')
-    fp.write('scale '+str(voxel_model.scale)+'\n')
-    fp.write('data\n')
     if not voxel_model.axis_order in ('xzy', 'xyz'):
         raise ValueError('Unsupported voxel model axis order')
 
-    if voxel_model.axis_order=='xzy':
-        voxels_flat = dense_voxel_data.flatten()
-    elif voxel_model.axis_order=='xyz':
-        voxels_flat = np.transpose(dense_voxel_data, (0, 2, 1)).flatten()
-
-    # keep a sort of state machine for writing run length encoding
-    state = voxels_flat[0]
-    ctr = 0
-    for c in voxels_flat:
-        if c==state:
-            ctr += 1
-            # if ctr hits max, dump
-            if ctr==255:
-                fp.write(chr(state))
-                fp.write(chr(ctr))
-                ctr = 0
-        else:
-            # if switch state, dump
-            fp.write(chr(state))
-            fp.write(chr(ctr))
-            state = c
-            ctr = 1
-    # flush out remainders
-    if ctr > 0:
-        fp.write(chr(state))
-        fp.write(chr(ctr))
+    if isinstance(voxel_model, PackedVoxels):
+        rle = voxel_model.to_rle()
+    elif voxel_model.data.ndim==2:
+        rle = sparse_to_rle(voxel_model.data, voxel_model.dims, voxel_model.axis_order)
+    elif voxel_model.axis_order=='xzy':
+        rle = dense_to_rle(voxel_model.data.ravel())
+    else:
+        rle = dense_to_rle(np.transpose(voxel_model.data, (0, 2, 1)).ravel())
+
+    header = '#binvox 1\n'
+    header += 'dim '+' '.join(map(str, voxel_model.dims))+'\n'
+    header += 'translate '+' '.join(map(str, voxel_model.translate))+'\n'
+    header += 'scale '+str(voxel_model.scale)+'\n'
+    header += 'data\n'
+    fp.write(header.encode('ascii') + rle.tobytes())
 
 if __name__ == '__main__':
     import doctest
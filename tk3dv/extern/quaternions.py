@@ -28,8 +28,8 @@ they are applied on the left of the vector.  For example:
 import math
 import numpy as np
 
-MAX_FLOAT = np.maximum_sctype(np.float)
-FLOAT_EPS = np.finfo(np.float).eps
+MAX_FLOAT = np.longdouble
+FLOAT_EPS = np.finfo(np.float64).eps
 
 
 def fillpositive(xyz, w2_thresh=None):
@@ -492,3 +492,256 @@ def quat2angle_axis(quat, identity_thresh=None):
         # if vec is nearly 0,0,0, this is an identity rotation
         return 0.0, np.array([1.0, 0, 0])
     return  2 * math.acos(w), vec / n
+
+
+# Batched variants. These accept stacks of quaternions (..., 4), vectors
+# (..., 3) and matrices (..., 3, 3) and broadcast over the leading
+# dimensions, so thousands of rotations are handled without Python loops.
+
+def quat2mat_batch(q):
+    ''' Rotation matrices corresponding to quaternions
+
+    Parameters
+    ----------
+    q : array-like shape (..., 4)
+       w, x, y, z of quaternions (need not be unit)
+
+    Returns
+    -------
+    M : array shape (..., 3, 3)
+      Rotation matrices, identity where the quaternion norm is near 0
+
+    Examples
+    --------
+    >>> M = quat2mat_batch([[1, 0, 0, 0], [0, 1, 0, 0]])
+    >>> np.allclose(M, [np.eye(3), np.diag([1, -1, -1])])
+    True
+    '''
+    q = np.asarray(q, dtype=np.float64)
+    w, x, y, z = np.moveaxis(q, -1, 0)
+    Nq = w*w + x*x + y*y + z*z
+    isZero = Nq < FLOAT_EPS
+    # s = 0 gives the identity for near zero quaternions
+    s = np.where(isZero, 0.0, 2.0 / np.where(isZero, 1.0, Nq))
+    X = x*s
+    Y = y*s
+    Z = z*s
+    wX = w*X; wY = w*Y; wZ = w*Z
+    xX = x*X; xY = x*Y; xZ = x*Z
+    yY = y*Y; yZ = y*Z; zZ = z*Z
+    M = np.empty(q.shape[:-1] + (3, 3))
+    M[..., 0, 0] = 1.0-(yY+zZ); M[..., 0, 1] = xY-wZ; M[..., 0, 2] = xZ+wY
+    M[..., 1, 0] = xY+wZ; M[..., 1, 1] = 1.0-(xX+zZ); M[..., 1, 2] = yZ-wX
+    M[..., 2, 0] = xZ-wY; M[..., 2, 1] = yZ+wX; M[..., 2, 2] = 1.0-(xX+yY)
+    return M
+
+
+def mat2quat_batch(M, robust=False):
+    ''' Quaternions corresponding to rotation matrices
+
+    Parameters
+    ----------
+    M : array-like shape (..., 3, 3)
+      rotation matrices
+    robust : bool, optional
+      If True, use the eigenvector method of ``mat2quat`` (slower, best
+      for matrices that are not quite orthogonal).  Default False uses
+      the closed form pivot on the largest of w, x, y, z (Shepperd's
+      method), which agrees with ``mat2quat`` for rotation matrices.
+
+    Returns
+    -------
+    q : array shape (..., 4)
+      unit quaternions, having positive q[..., 0]
+
+    Examples
+    --------
+    >>> q = mat2quat_batch([np.eye(3), np.diag([1, -1, -1])])
+    >>> np.allclose(q, [[1, 0, 0, 0], [0, 1, 0, 0]])
+    True
+    '''
+    M = np.asarray(M, dtype=np.float64)
+    Qxx, Qyx, Qzx = M[..., 0, 0], M[..., 0, 1], M[..., 0, 2]
+    Qxy, Qyy, Qzy = M[..., 1, 0], M[..., 1, 1], M[..., 1, 2]
+    Qxz, Qyz, Qzz = M[..., 2, 0], M[..., 2, 1], M[..., 2, 2]
+    if robust:
+        K = np.zeros(M.shape[:-2] + (4, 4))
+        K[..., 0, 0] = Qxx - Qyy - Qzz
+        K[..., 1, 0] = Qyx + Qxy; K[..., 1, 1] = Qyy - Qxx - Qzz
+        K[..., 2, 0] = Qzx + Qxz; K[..., 2, 1] = Qzy + Qyz; K[..., 2, 2] = Qzz - Qxx - Qyy
+        K[..., 3, 0] = Qyz - Qzy; K[..., 3, 1] = Qzx - Qxz; K[..., 3, 2] = Qxy - Qyx; K[..., 3, 3] = Qxx + Qyy + Qzz
+        vals, vecs = np.linalg.eigh(K / 3.0)
+        idx = np.argmax(vals, axis=-1)[..., np.newaxis, np.newaxis]
+        q = np.take_along_axis(vecs, idx, axis=-1)[..., [3, 0, 1, 2], 0]
+    else:
+        # Rows of 4 q q^T for a rotation matrix; the row with the largest
+        # diagonal is the best conditioned (Shepperd's method)
+        T = np.empty(M.shape[:-2] + (4, 4))
+        T[..., 0, 0] = 1.0 + Qxx + Qyy + Qzz
+        T[..., 1, 1] = 1.0 + Qxx - Qyy - Qzz
+        T[..., 2, 2] = 1.0 - Qxx + Qyy - Qzz
+        T[..., 3, 3] = 1.0 - Qxx - Qyy + Qzz
+        T[..., 0, 1] = T[..., 1, 0] = Qyz - Qzy
+        T[..., 0, 2] = T[..., 2, 0] = Qzx - Qxz
+        T[..., 0, 3] = T[..., 3, 0] = Qxy - Qyx
+        T[..., 1, 2] = T[..., 2, 1] = Qyx + Qxy
+        T[..., 1, 3] = T[..., 3, 1] = Qzx + Qxz
+        T[..., 2, 3] = T[..., 3, 2] = Qzy + Qyz
+        idx = np.argmax(np.diagonal(T, axis1=-2, axis2=-1), axis=-1)[..., np.newaxis, np.newaxis]
+        q = np.take_along_axis(T, idx, axis=-2)[..., 0, :]
+        q = q / np.sqrt(np.sum(q*q, axis=-1, keepdims=True))
+    # Prefer quaternion with positive w
+    return q * np.where(q[..., :1] < 0, -1.0, 1.0)
+
+
+def mult_batch(q1, q2):
+    ''' Multiply quaternions, broadcasting over leading dimensions
+
+    Parameters
+    ----------
+    q1 : array-like shape (..., 4)
+    q2 : array-like shape (..., 4)
+
+    Returns
+    -------
+    q12 : array shape (..., 4)
+    '''
+    w1, x1, y1, z1 = np.moveaxis(np.asarray(q1, dtype=np.float64), -1, 0)
+    w2, x2, y2, z2 = np.moveaxis(np.asarray(q2, dtype=np.float64), -1, 0)
+    w = w1*w2 - x1*x2 - y1*y2 - z1*z2
+    x = w1*x2 + x1*w2 + y1*z2 - z1*y2
+    y = w1*y2 + y1*w2 + z1*x2 - x1*z2
+    z = w1*z2 + z1*w2 + x1*y2 - y1*x2
+    return np.stack([w, x, y, z], axis=-1)
+
+
+def conjugate_batch(q):
+    ''' Conjugates of quaternions `q` of shape (..., 4) '''
+    return np.asarray(q, dtype=np.float64) * np.array([1.0, -1, -1, -1])
+
+
+def norm_batch(q):
+    ''' Norms (as in ``norm``, the squared length) of quaternions `q` of shape (..., 4) '''
+    q = np.asarray(q, dtype=np.float64)
+    return np.sum(q*q, axis=-1)
+
+
+def inverse_batch(q):
+    ''' Multiplicative inverses of quaternions `q` of shape (..., 4) '''
+    return conjugate_batch(q) / norm_batch(q)[..., np.newaxis]
+
+
+def rotate_vector_batch(v, q):
+    ''' Apply transformations in quaternions `q` to vectors `v`
+
+    Parameters
+    ----------
+    v : array-like shape (..., 3)
+       3 dimensional vectors
+    q : array-like shape (..., 4)
+       w, i, j, k of quaternions
+
+    Returns
+    -------
+    vdash : array shape (..., 3)
+       `v` rotated by `q`, broadcasting over leading dimensions
+    '''
+    v = np.asarray(v, dtype=np.float64)
+    varr = np.concatenate([np.zeros(v.shape[:-1] + (1,)), v], axis=-1)
+    return mult_batch(q, mult_batch(varr, conjugate_batch(q)))[..., 1:]
+
+
+def nearly_equivalent_batch(q1, q2, rtol=1e-5, atol=1e-8):
+    ''' Elementwise ``nearly_equivalent`` of quaternions of shape (..., 4)
+
+    Returns
+    -------
+    equiv : bool array shape (...)
+    '''
+    q1 = np.asarray(q1)
+    q2 = np.asarray(q2)
+    return (np.all(np.isclose(q1, q2, rtol, atol), axis=-1) |
+            np.all(np.isclose(q1 * -1, q2, rtol, atol), axis=-1))
+
+
+def angle_axis2quat_batch(theta, vector, is_normalized=False):
+    ''' Quaternions for rotations of angles `theta` around `vector`
+
+    Parameters
+    ----------
+    theta : array-like shape (...)
+       angles of rotation
+    vector : array-like shape (..., 3)
+       vectors specifying axes for rotation
+    is_normalized : bool, optional
+       True if vectors are already normalized.  Default False
+
+    Returns
+    -------
+    quat : array shape (..., 4)
+
+    Examples
+    --------
+    >>> q = angle_axis2quat_batch([np.pi, 0], [1, 0, 0])
+    >>> np.allclose(q, [[0, 1, 0, 0], [1, 0, 0, 0]])
+    True
+    '''
+    theta = np.asarray(theta, dtype=np.float64)
+    vector = np.asarray(vector, dtype=np.float64)
+    if not is_normalized:
+        vector = vector / np.sqrt(np.sum(vector*vector, axis=-1, keepdims=True))
+    t2 = theta[..., np.newaxis] / 2.0
+    vector, st2 = np.broadcast_arrays(vector, np.sin(t2))
+    return np.concatenate([np.broadcast_to(np.cos(t2), st2.shape[:-1] + (1,)), vector * st2], axis=-1)
+
+
+def angle_axis2mat_batch(theta, vector, is_normalized=False):
+    ''' Rotation matrices of angles `theta` around `vector`
+
+    Parameters
+    ----------
+    theta : array-like shape (...)
+       angles of rotation
+    vector : array-like shape (..., 3)
+       vectors specifying axes for rotation
+    is_normalized : bool, optional
+       True if vectors are already normalized.  Default False
+
+    Returns
+    -------
+    mat : array shape (..., 3, 3)
+    '''
+    theta = np.asarray(theta, dtype=np.float64)
+    vector = np.asarray(vector, dtype=np.float64)
+    if not is_normalized:
+        vector = vector / np.sqrt(np.sum(vector*vector, axis=-1, keepdims=True))
+    return quat2mat_batch(angle_axis2quat_batch(theta, vector, is_normalized=True))
+
+
+def quat2angle_axis_batch(quat, identity_thresh=None):
+    ''' Convert quaternions to rotations of angles around axes
+
+    Parameters
+    ----------
+    quat : array-like shape (..., 4)
+       w, x, y, z forming quaternions
+    identity_thresh : None or scalar, optional
+       threshold below which the norm of the vector part is deemed to be
+       0, see ``quat2angle_axis``
+
+    Returns
+    -------
+    theta : array shape (...)
+       angles of rotation, 0 for identity rotations
+    vector : array shape (..., 3)
+       axes around which rotations occur, [1, 0, 0] for identity rotations
+    '''
+    quat = np.asarray(quat, dtype=np.float64)
+    if identity_thresh is None:
+        identity_thresh = FLOAT_EPS * 3
+    vec = quat[..., 1:]
+    n = np.sqrt(np.sum(vec*vec, axis=-1))
+    isIdentity = n < identity_thresh
+    theta = np.where(isIdentity, 0.0, 2 * np.arccos(np.clip(quat[..., 0], -1.0, 1.0)))
+    vec = np.where(isIdentity[..., np.newaxis], [1.0, 0, 0], vec / np.where(isIdentity, 1.0, n)[..., np.newaxis])
+    return theta, vec
@@ -6,6 +6,6 @@ import os, sys
 FileDirPath = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(os.path.join(FileDirPath, '.'))
 
-import defines, datastructures, parsing, aligning, obj_loader
+import defines, datastructures, parsing, aligning, obj_loader, octree
 
 __version__= defines.__version__
@@ -0,0 +1,149 @@
+import numpy as np
+import math, time, json, platform, itertools
+import aligning
+from tk3dv.common import utilities
+
+# Alignment engines that can be benchmarked. Each engine maps (N, 3) source and target
+# points to (Scales, Rotation, Translation, OutTransform) just like the functions in aligning.py.
+# Register faster engines here to have them timed alongside the reference implementations.
+AlignmentEngines = {
+    'similarity': aligning.estimateSimilarityTransform,
+    'restricted_affine': aligning.estimateRestrictedAffineTransform,
+}
+
+def randomRotation(RNG=np.random):
+    # Same construction as the PoseRCNNInput DEBUG generator: random rotations about x, then y, then z
+    Angles = RNG.uniform(0, 2 * math.pi, 3)
+    Rotation = np.identity(3)
+    for Axis, Theta in zip(np.identity(3), Angles):
+        Rotation = Rotation @ utilities.rotation_matrix(Axis, Theta)
+
+    return Rotation
+
+def randomSimilarity(ScaleRange=(17, 17), TranslationRange=(-70, 70), RNG=np.random):
+    Rotation = randomRotation(RNG)
+    Scales = np.ones(3) * RNG.uniform(ScaleRange[0], ScaleRange[1])
+    Translation = RNG.uniform(TranslationRange[0], TranslationRange[1], 3)
+
+    return Scales, Rotation, Translation
+
+def perturbPoints(Points, Scales, Rotation, Translation, OutlierRatio=0.1, OutlierRange=500, NoiseLevel=0.0, RNG=np.random):
+    '''
+    Applies target = Scales * (Rotation @ source) + Translation to (N, 3) points, then adds Gaussian noise
+    (standard deviation NoiseLevel, relative to the scale) and uniform outliers in [-OutlierRange, OutlierRange].
+    Returns the perturbed points and a boolean mask of the inliers.
+    '''
+    Points = np.asarray(Points, dtype=np.float64)
+    Transformed = (Points @ Rotation.T) * Scales + Translation
+    if NoiseLevel > 0:
+        Transformed = Transformed + RNG.normal(0, NoiseLevel * np.mean(Scales), Transformed.shape)
+    InlierMask = RNG.uniform(0.0, 1.0, Points.shape[0]) <= (1 - OutlierRatio)
+    nOutliers = np.count_nonzero(~InlierMask)
+    Transformed[~InlierMask] += RNG.uniform(-OutlierRange, OutlierRange, (nOutliers, 3))
+
+    return Transformed, InlierMask
+
+def generateSyntheticCorrespondences(nPoints, OutlierRatio=0.1, NoiseLevel=0.0, Seed=None):
+    '''
+    Generates nPoints NOCS points in the unit cube and their randomly transformed counterparts.
+    Returns (Source, Target, GroundTruth, InlierMask) where GroundTruth holds Scales, Rotation and Translation.
+    '''
+    RNG = np.random.RandomState(Seed)
+    Source = RNG.uniform(0.0, 1.0, (nPoints, 3))
+    Scales, Rotation, Translation = randomSimilarity(RNG=RNG)
+    Target, InlierMask = perturbPoints(Source, Scales, Rotation, Translation, OutlierRatio=OutlierRatio, NoiseLevel=NoiseLevel, RNG=RNG)
+    GroundTruth = {'Scales': Scales, 'Rotation': Rotation, 'Translation': Translation}
+
+    return Source, Target, GroundTruth, InlierMask
+
+def projectToRotation(Matrix):
+    # Closest rotation in SO(3) (Frobenius norm). Estimates such as restricted_affine are not exactly orthonormal
+    U, _, Vt = np.linalg.svd(Matrix)
+    return U @ np.diag([1.0, 1.0, np.linalg.det(U @ Vt)]) @ Vt
+
+def rotationAngle(EstRotation, Rotation):
+    # Angle in degrees between two rotations. The estimate is projected onto SO(3) first, otherwise the trace
+    # of a non-orthonormal matrix can exceed 3 and clipping would report 0
+    CosAngle = (np.trace(projectToRotation(EstRotation) @ Rotation.T) - 1) / 2
+    return math.degrees(math.acos(np.clip(CosAngle, -1.0, 1.0)))
+
+def evaluateAlignment(GroundTruth, Scales, Rotation, Translation, Source, Target, InlierMask):
+    # The engines in aligning.py return the transposed rotation, i.e. target = S * Rotation.T @ source + T
+    EstRotation = Rotation.T
+    RotationError = rotationAngle(EstRotation, GroundTruth['Rotation'])
+    TranslationError = float(np.linalg.norm(Translation - GroundTruth['Translation']))
+    ScaleError = float(np.max(np.abs(np.asarray(Scales) - GroundTruth['Scales']) / GroundTruth['Scales']))
+    Predicted = (Source[InlierMask] @ EstRotation.T) * Scales + Translation
+    InlierRMSE = float(np.sqrt(np.mean(np.sum((Predicted - Target[InlierMask]) ** 2, axis=1)))) if np.any(InlierMask) else 0.0
+
+    return {'rotation_error_deg': RotationError, 'translation_error': TranslationError, 'scale_error': ScaleError, 'inlier_rmse': InlierRMSE}
+
+def runAlignmentBenchmark(PointCounts=(100, 1000, 10000), OutlierRatios=(0.0, 0.1, 0.3), NoiseLevels=(0.0, 0.01), Engines=None, nTrials=5, Seed=0, isVerbose=True):
+    '''
+    Times every engine on a grid of point counts, outlier ratios and noise levels.
+    Returns a list of per-configuration records with median timing, throughput and accuracy.
+    '''
+    if Engines is None:
+        Engines = list(AlignmentEngines.keys())
+
+    Results = []
+    for (nPoints, OutlierRatio, NoiseLevel) in itertools.product(PointCounts, OutlierRatios, NoiseLevels):
+        Trials = [generateSyntheticCorrespondences(nPoints, OutlierRatio, NoiseLevel, Seed=Seed + t) for t in range(0, nTrials)]
+        for Name in Engines:
+            Engine = AlignmentEngines[Name]
+            Times = []
+            Errors = []
+            nFailures = 0
+            for (Source, Target, GroundTruth, InlierMask) in Trials:
+                Tic = time.perf_counter()
+                Scales, Rotation, Translation, _ = Engine(Source, Target)
+                Times.append(time.perf_counter() - Tic)
+                if Scales is None:
+                    nFailures += 1
+                    continue
+                Errors.append(evaluateAlignment(GroundTruth, Scales, Rotation, Translation, Source, Target, InlierMask))
+
+            MedianTime = float(np.median(Times))
+            Record = {'engine': Name, 'n_points': int(nPoints), 'outlier_ratio': float(OutlierRatio), 'noise_level': float(NoiseLevel), 'n_trials': nTrials
+                      , 'n_failures': nFailures, 'median_time_s': MedianTime, 'points_per_s': nPoints / MedianTime if MedianTime > 0 else float('inf')}
+            for Key in ['rotation_error_deg', 'translation_error', 'scale_error', 'inlier_rmse']:
+                Record['median_' + Key] = float(np.median([E[Key] for E in Errors])) if len(Errors) > 0 else None
+            Results.append(Record)
+
+            if isVerbose:
+                print('[ INFO ]: {:<18} N={:<7} outliers={:.2f} noise={:.3f}: {:.2f} ms, rotation error {} deg, {} failures.'.format(Name, nPoints, OutlierRatio, NoiseLevel
+                      , MedianTime * 1e3, 'n/a' if Record['median_rotation_error_deg'] is None else '{:.3f}'.format(Record['median_rotation_error_deg']), nFailures))
+
+    return Results
+
+def saveBenchmarkResults(Results, OutFile):
+    Output = {'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine(), 'results': Results}
+    with open(OutFile, 'w') as f:
+        json.dump(Output, f, indent=2)
+    print('[ INFO ]: Saved benchmark results to', OutFile)
+
+def compareBenchmarkResults(Baseline, Current, TimeTolerance=1.5, ErrorTolerance=1.5, ErrorFloor=1e-3):
+    '''
+    Compares two result lists (as returned by runAlignmentBenchmark or loaded from JSON).
+    Returns a list of human-readable regressions in speed or accuracy.
+    '''
+    def key(R):
+        return (R['engine'], R['n_points'], R['outlier_ratio'], R['noise_level'])
+
+    BaselineRecords = {key(R): R for R in Baseline}
+    Regressions = []
+    for R in Current:
+        B = BaselineRecords.get(key(R))
+        if B is None:
+            continue
+        if R['median_time_s'] > TimeTolerance * B['median_time_s']:
+            Regressions.append('{}: time {:.2f} ms -> {:.2f} ms'.format(key(R), B['median_time_s'] * 1e3, R['median_time_s'] * 1e3))
+        if R['n_failures'] > B['n_failures']:
+            Regressions.append('{}: failures {} -> {}'.format(key(R), B['n_failures'], R['n_failures']))
+        for Key in ['median_rotation_error_deg', 'median_translation_error', 'median_scale_error']:
+            if B[Key] is None or R[Key] is None:
+                continue
+            if R[Key] > max(ErrorTolerance * B[Key], ErrorFloor):
+                Regressions.append('{}: {} {:.4f} -> {:.4f}'.format(key(R), Key, B[Key], R[Key]))
+
+    return Regressions
@@ -5,7 +5,7 @@ Created on 01.11.2012
 mean reprojection error: 0.551599651484px
 root mean squared reprojection error: 0.615873177017px
 '''
-import numpy, math, scipy, cv2
+import numpy, math, time, scipy, cv2
 from scipy import optimize
 
 # computes the 2d distance between vector a and b
@@ -17,29 +17,149 @@ _EPS = numpy.finfo(float).eps * 4.0
 
 
 # Gold Standard Algorithm for estimating P (Multiple View Geometry Sec. Edition, page:181, (7.1))
+# correspondences is either a list of (image point, world point) tuples or a tuple of (N, 2) image and (N, 3) world point arrays
 # returns (p, camera center, calibration matrix, rotation matrix)
-def calculateCameraParameters(correspondences):
-    normCorr, t, u = normalize(correspondences)
+# loss and lossScale (in pixels) select an optional robust loss for the refinement, see nonLinearOptimization()
+def calculateCameraParameters(correspondences, loss='linear', lossScale=1.0):
+    normCorr, t, u = normalize(toArrays(correspondences))
     p = dlt(normCorr)
-    p = nonLinearOptimization(p, normCorr)
+    p = nonLinearOptimization(p, normCorr, loss=loss, lossScale=lossScale * t[0, 0])
     p = denormalize(p, t, u)
     c, k, r, Flip = extractCameraParameters(p)
 
     return p, c, k, r, Flip
 
+# RANSAC-wrapped variant of calculateCameraParameters for noisy correspondences (e.g. predicted NOCS maps)
+# hypotheses are estimated in batches from minimal 6-point sets and scored in a vectorized fashion on a random
+# subset of scoreSamples correspondences; the gold standard algorithm is then run only on the inliers of the best one
+# (and re-run up to refineIterations times on the inliers of its own result)
+# threshold is the inlier reprojection error in pixels, maxTime (seconds) and maxIterations bound the search
+# returns (p, camera center, calibration matrix, rotation matrix, Flip, inlier mask)
+def calculateCameraParametersRANSAC(correspondences, threshold=2.0, maxIterations=2000, maxTime=None, confidence=0.999
+                                    , batchSize=256, scoreSamples=2000, refineIterations=2, loss='linear', lossScale=1.0, seed=None):
+    normCorr, t, u = normalize(toArrays(correspondences))
+    nPoints = normCorr[0].shape[0]
+    if nPoints < 6:
+        raise RuntimeError('[ ERR ]: At least 6 correspondences are needed, got {}.'.format(nPoints))
+
+    rng = numpy.random.RandomState(seed)
+    normThreshold = threshold * t[0, 0]
+    scoreIdx = rng.permutation(nPoints)[:scoreSamples]
+    scoreCorr = (normCorr[0][scoreIdx], normCorr[1][scoreIdx])
+
+    startTime = time.perf_counter()
+    bestP = None
+    bestCount = 0
+    iterations = 0
+    requiredIterations = maxIterations
+    while iterations < min(requiredIterations, maxIterations):
+        nHypotheses = min(batchSize, maxIterations - iterations)
+        samples = sampleMinimalSets(rng, nPoints, nHypotheses)
+        hypotheses = dltBatch(normCorr[0][samples], normCorr[1][samples])
+        iterations += nHypotheses
+
+        counts = numpy.count_nonzero(inlierMaskBatch(hypotheses, scoreCorr, normThreshold), axis=1)
+        best = numpy.argmax(counts)
+        if counts[best] > bestCount:
+            bestCount = counts[best]
+            bestP = hypotheses[best]
+            # adaptive number of iterations for the requested confidence
+            noOutlierProb = 1.0 - (bestCount / scoreIdx.shape[0]) ** 6
+            if noOutlierProb <= _EPS:
+                requiredIterations = iterations
+            else:
+                requiredIterations = math.ceil(math.log(1.0 - confidence) / math.log(noOutlierProb))
+        if maxTime is not None and time.perf_counter() - startTime > maxTime:
+            break
+
+    bestInliers = numpy.ones(nPoints, dtype=bool)
+    if bestP is not None:
+        bestInliers = inlierMaskBatch(bestP[numpy.newaxis], normCorr, normThreshold)[0]
+    if numpy.count_nonzero(bestInliers) < 6:
+        print('[ WARN ]: RANSAC found too few inliers. Using all correspondences.')
+        bestInliers = numpy.ones(nPoints, dtype=bool)
+
+    # refine on the inliers, then re-select the inliers with the refined p (minimal-set hypotheses are noisy)
+    x2d, x3d = toArrays(correspondences)
+    for i in range(0, 1 + refineIterations):
+        p, c, k, r, Flip = calculateCameraParameters((x2d[bestInliers], x3d[bestInliers]), loss=loss, lossScale=lossScale)
+        inliers = reprojectionError(p.flatten(), (x2d, x3d)) < threshold
+        if numpy.count_nonzero(inliers) < 6 or numpy.array_equal(inliers, bestInliers):
+            break
+        bestInliers = inliers
+
+    # inliers always belong to the returned p, also when the refinement stopped early
+    return p, c, k, r, Flip, inliers
+
+# nSets minimal sets of setSize distinct indices below nPoints as an (nSets, setSize) array
+# sets with repeated points give degenerate DLT hypotheses; few points are shuffled, many are resampled until distinct
+def sampleMinimalSets(rng, nPoints, nSets, setSize=6):
+    if nPoints < 8 * setSize:
+        return numpy.argsort(rng.rand(nSets, nPoints), axis=1)[:, :setSize]
+
+    samples = rng.randint(0, nPoints, size=(nSets, setSize))
+    while True:
+        sortedSamples = numpy.sort(samples, axis=1)
+        isRepeated = numpy.any(sortedSamples[:, 1:] == sortedSamples[:, :-1], axis=1)
+        if not numpy.any(isRepeated):
+            return samples
+        samples[isRepeated] = rng.randint(0, nPoints, size=(numpy.count_nonzero(isRepeated), setSize))
+
+# DLT for a batch of (B, M, 2+) image and (B, M, 4) homogeneous world points, returns (B, 3, 4) projection matrices
+def dltBatch(imageCoords, worldCoords):
+    nBatch, nPoints = worldCoords.shape[:2]
+    matrix = numpy.zeros((nBatch, 2 * nPoints, 12))
+    matrix[:, 0::2, 4:8] = -worldCoords
+    matrix[:, 0::2, 8:12] = imageCoords[:, :, 1:2] * worldCoords
+    matrix[:, 1::2, 0:4] = worldCoords
+    matrix[:, 1::2, 8:12] = -imageCoords[:, :, 0:1] * worldCoords
+    _, _, v = numpy.linalg.svd(matrix)
+    return numpy.reshape(v[:, -1, :], (nBatch, 3, 4))
+
+# (B, N) inlier masks of (B, 3, 4) projection matrices on homogeneous correspondences
+# compares |x w - (p0.X, p1.X)| < threshold |w| to avoid the division by the projective depth w
+def inlierMaskBatch(ps, correspondences, threshold):
+    x2d, x3d = correspondences
+    projectedPos = ps @ x3d.T
+    w = projectedPos[:, 2, :]
+    du = projectedPos[:, 0, :] - x2d[:, 0] * w
+    dv = projectedPos[:, 1, :] - x2d[:, 1] * w
+    return du * du + dv * dv < (threshold * threshold) * (w * w)
+
+def isArrayPair(correspondences):
+    return isinstance(correspondences, tuple) and len(correspondences) == 2 \
+           and all(isinstance(c, numpy.ndarray) and c.ndim == 2 for c in correspondences)
+
+# convert correspondences into a tuple of (N, 2+) image and (N, 3+) world point arrays
+def toArrays(correspondences):
+    if isArrayPair(correspondences):
+        imageCoords, worldCoords = correspondences
+    else:
+        imageCoords = [imageCoord for (imageCoord, _) in correspondences]
+        worldCoords = [worldCoord for (_, worldCoord) in correspondences]
+    imageCoords = numpy.asarray(imageCoords, dtype=numpy.float64).reshape(len(imageCoords), -1)
+    worldCoords = numpy.asarray(worldCoords, dtype=numpy.float64).reshape(len(worldCoords), -1)
+    return imageCoords, worldCoords
+
 # construct the matrix A for the estimation of P (Multiple View Geometry Sec. Edition, page:179, (7.2))
 def constructMatrixA(correspondences):
-    matrixList = []
-    for (x, bigX) in correspondences:
-        matrixList.append([0, 0, 0, 0, -bigX[0], -bigX[1], -bigX[2], -1, x[1] * bigX[0], x[1] * bigX[1], x[1] * bigX[2], x[1] * 1])
-        matrixList.append([bigX[0], bigX[1], bigX[2], 1, 0, 0, 0, 0, -x[0] * bigX[0], -x[0] * bigX[1], -x[0] * bigX[2], -x[0] * 1])
-    return numpy.array(matrixList)
+    x, bigX = toArrays(correspondences)
+    n = bigX.shape[0]
+    bigXHom = numpy.hstack([bigX[:, :3], numpy.ones((n, 1))])
+    matrix = numpy.zeros((2 * n, 12))
+    # rows [0, 0, 0, 0, -X^T, y X^T] and [X^T, 0, 0, 0, 0, -x X^T]
+    matrix[0::2, 4:8] = -bigXHom
+    matrix[0::2, 8:12] = x[:, 1:2] * bigXHom
+    matrix[1::2, 0:4] = bigXHom
+    matrix[1::2, 8:12] = -x[:, 0:1] * bigXHom
+    return matrix
 
 
 # direct linear transform of the correspondences
 def dlt(correspondences):
     matrix = constructMatrixA(correspondences)
-    _, _, v = numpy.linalg.svd(matrix)
+    # only v is needed, the full 2N x 2N u would dominate the run time for large N
+    _, _, v = numpy.linalg.svd(matrix, full_matrices=False)
     # take the last column
     pcolumn = v[-1, : ]
     p = numpy.reshape(pcolumn, (3, 4))
@@ -49,40 +169,32 @@ def dlt(correspondences):
 
 # normalize the correspondences (mean origin and mean length)
 # returns the normalized correspondences and the transformation matrices (t,u)
+# normalized correspondences are homogeneous and of the same kind as the input (tuple list or array pair)
 def normalize(correspondences):
-    # transform correspondences from tuples into numpy.array's
-    corr = []
-    for (imageCoord, worldCoord) in correspondences:
-        corr.append((numpy.array(imageCoord), numpy.array(worldCoord)))
-        
+    imageCoords, worldCoords = toArrays(correspondences)
+    imageCoords = imageCoords[:, :2]
+    worldCoords = worldCoords[:, :3]
+
     # compute mean origin
-    imageOrigin = numpy.array([0.0, 0.0])
-    worldOrigin = numpy.array([0.0, 0.0, 0.0])
-    for (imageCoord, worldCoord) in corr:
-        imageOrigin += imageCoord
-        worldOrigin += worldCoord
-    imageOrigin /= len(correspondences)
-    worldOrigin /= len(correspondences)
-    
+    imageOrigin = numpy.mean(imageCoords, axis=0)
+    worldOrigin = numpy.mean(worldCoords, axis=0)
+
     # compute mean norm
-    imageNorm = 0.0
-    worldNorm = 0.0
-    for (imageCoord, worldCoord) in corr:
-        imageNorm += numpy.linalg.norm(imageOrigin - imageCoord)
-        worldNorm += numpy.linalg.norm(worldOrigin - worldCoord)
-    imageNorm /= len(correspondences)
-    worldNorm /= len(correspondences)
+    imageNorm = numpy.mean(numpy.linalg.norm(imageCoords - imageOrigin, axis=1))
+    worldNorm = numpy.mean(numpy.linalg.norm(worldCoords - worldOrigin, axis=1))
     tscale = math.sqrt(2) / imageNorm
     uscale = math.sqrt(3) / worldNorm
-    
+
     # create normalized correspondences by multiplying with matrix t, u
     t = numpy.array([[tscale, 0, -imageOrigin[0] * tscale ], [0, tscale, -imageOrigin[1] * tscale ], [0, 0, 1]])
     u = numpy.array([[uscale, 0, 0, -worldOrigin[0] * uscale ], [0, uscale, 0, -worldOrigin[1] * uscale ], [0, 0, uscale, -worldOrigin[2] * uscale], [0, 0, 0, 1]])
-    normalizedCorrespondences = []
-    for (imageCoord, worldCoord) in corr:
-        normalizedImageCoord = numpy.dot(t, numpy.append(imageCoord, [1]))
-        normalizedWorldCoord = numpy.dot(u, numpy.append(worldCoord, [1]))
-        normalizedCorrespondences.append((normalizedImageCoord, normalizedWorldCoord))
+    nPoints = imageCoords.shape[0]
+    normalizedImageCoords = numpy.hstack([imageCoords, numpy.ones((nPoints, 1))]) @ t.T
+    normalizedWorldCoords = numpy.hstack([worldCoords, numpy.ones((nPoints, 1))]) @ u.T
+    if isArrayPair(correspondences):
+        return (normalizedImageCoords, normalizedWorldCoords), t, u
+
+    normalizedCorrespondences = list(zip(normalizedImageCoords, normalizedWorldCoords))
     return normalizedCorrespondences, t, u
 
 def denormalize(p, t, u):
@@ -121,22 +233,59 @@ def extractCameraParameters(p):
     return c, k, r, Flip
 
 
+def toHomogeneousWorld(x3d):
+    if x3d.shape[1] == 3:
+        x3d = numpy.hstack([x3d, numpy.ones((x3d.shape[0], 1))])
+    return x3d
+
+
 def reprojectionError(p, correspondences):
-    projectionerr = []
     p = numpy.reshape(p[0:12], (3, 4))
-    for (x2d, x3d) in correspondences:
-        projectedPos = numpy.dot(p , x3d)
-        projectedPos /= projectedPos[2]
-        dst = distance((projectedPos[0], projectedPos[1]), x2d)
-        projectionerr.append(dst)
-    return numpy.asarray(projectionerr)
-
-
-def nonLinearOptimization(p, correspondences):
-    # convert p matrix into vector, p.flatten() somehow doesn't work :(
-    pflat = numpy.array([p[0, 0], p[0, 1], p[0, 2], p[0, 3], p[1, 0], p[1, 1], p[1, 2], p[1, 3], p[2, 0], p[2, 1], p[2, 2], p[2, 3]])
-    p = optimize.leastsq(reprojectionError, pflat, correspondences, factor=0.01)
-    p = numpy.reshape(p[0], (3, 4))
+    x2d, x3d = toArrays(correspondences)
+    projectedPos = toHomogeneousWorld(x3d) @ p.T
+    projectedPos = projectedPos[:, :2] / projectedPos[:, 2:3]
+    return numpy.linalg.norm(projectedPos - x2d[:, :2], axis=1)
+
+
+# per-coordinate reprojection residuals (u0, v0, u1, v1, ...)
+# the sum of their squares equals the sum of squared reprojection errors, but unlike the distances they are smooth at 0
+def reprojectionResiduals(p, correspondences):
+    p = numpy.reshape(p[0:12], (3, 4))
+    x2d, x3d = toArrays(correspondences)
+    projectedPos = toHomogeneousWorld(x3d) @ p.T
+    projectedPos = projectedPos[:, :2] / projectedPos[:, 2:3]
+    return (projectedPos - x2d[:, :2]).ravel()
+
+
+# analytic 2N x 12 jacobian of reprojectionResiduals with respect to the entries of p
+def reprojectionJacobian(p, correspondences):
+    p = numpy.reshape(p[0:12], (3, 4))
+    _, x3d = toArrays(correspondences)
+    x3d = toHomogeneousWorld(x3d)
+    projectedPos = x3d @ p.T
+    invW = 1.0 / projectedPos[:, 2:3]
+    scaledX = x3d * invW
+    jacobian = numpy.zeros((2 * x3d.shape[0], 12))
+    # u = p0.X / p2.X and v = p1.X / p2.X
+    jacobian[0::2, 0:4] = scaledX
+    jacobian[0::2, 8:12] = -(projectedPos[:, 0:1] * invW) * scaledX
+    jacobian[1::2, 4:8] = scaledX
+    jacobian[1::2, 8:12] = -(projectedPos[:, 1:2] * invW) * scaledX
+    return jacobian
+
+
+# refine p with Levenberg-Marquardt using the analytic jacobian of the reprojection residuals
+# loss can be any robust loss supported by scipy.optimize.least_squares (e.g. 'huber', 'soft_l1', 'cauchy')
+# lossScale is the inlier/outlier soft margin in the (normalized) image coordinates of the correspondences
+def nonLinearOptimization(p, correspondences, loss='linear', lossScale=1.0):
+    pflat = numpy.asarray(p, dtype=numpy.float64).flatten()
+    # convert once, so that every residual evaluation works on arrays
+    corr = toArrays(correspondences)
+    if loss == 'linear':
+        p = optimize.leastsq(reprojectionResiduals, pflat, args=(corr,), Dfun=reprojectionJacobian, factor=0.01)[0]
+    else:
+        p = optimize.least_squares(reprojectionResiduals, pflat, jac=reprojectionJacobian, args=(corr,), loss=loss, f_scale=lossScale, method='trf').x
+    p = numpy.reshape(p, (3, 4))
     # print("optimized p")
     # print(p)
     return p
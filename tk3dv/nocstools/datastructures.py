@@ -103,7 +103,10 @@ class PointSet3D(PointSet):
 
     def draw(self, pointSize = 10):
         if self.isVBOBound == False:
-            print('[ WARN ]: VBOs not bound. Call update().')
+            # VBOs are created on first draw if update() was not called
+            self.update()
+        if self.isVBOBound == False:
+            print('[ WARN ]: VBOs not bound. Point set is empty.')
             return
 
         gl.glPushAttrib(gl.GL_POINT_BIT)
@@ -362,6 +365,12 @@ class VoxelGrid(PointSet3D):
         if type(self.VG) is np.ndarray:
             self.GridSize = self.VG.shape[0] # Assuming cube grid
             self.VGNZ = np.nonzero(self.VG)
+        elif hasattr(self.VG, 'getLeaves'):
+            # Sparse voxel octree, full octants are drawn as single cubes
+            self.GridSize = self.VG.GridShape[0] # Assuming cube grid
+            Origins, Sizes = self.VG.getLeaves()
+            self.VGNZ = tuple(Origins.T)
+            self.VGSizes = Sizes
         else:
             self.GridSize = self.VG.dims[0]
             self.VGNZ = np.nonzero(self.VG.data)
@@ -400,41 +409,35 @@ class VoxelGrid(PointSet3D):
             self.VBOIndices.delete()
 
     def createVG(self, Color=None):
-        for i in range(0, len(self.VGNZ[0])):
-            VoxelCenter = (np.array([self.VGNZ[0][i], self.VGNZ[1][i], self.VGNZ[2][i]]) + 0.5) / self.GridSize
-            self.add(VoxelCenter[0], VoxelCenter[1], VoxelCenter[2], VoxelCenter[0], VoxelCenter[1], VoxelCenter[2])
-
-            # Create vertices of voxels
-            VO = (np.array([self.VGNZ[0][i], self.VGNZ[1][i], self.VGNZ[2][i]])) / self.GridSize # Voxel origin
-            VS = 1 / self.GridSize # Voxel side
-            Corners = [
-                        VO[0], VO[1], VO[2],
-                        VO[0] + VS, VO[1], VO[2],
-                        VO[0] + VS, VO[1] + VS, VO[2],
-                        VO[0], VO[1] + VS, VO[2],
-                        VO[0], VO[1] + VS, VO[2] + VS,
-                        VO[0] + VS, VO[1] + VS, VO[2] + VS,
-                        VO[0] + VS, VO[1], VO[2] + VS,
-                        VO[0], VO[1], VO[2] + VS,
-                    ]
-            self.VGCorners = np.vstack([self.VGCorners, np.asarray(Corners).reshape((-1, 3))])
-
-            SI = i * 8 # start index
-            Indices = [
-                    SI+0, SI+1, SI+2, SI+2, SI+3, SI+0,
-                    SI+0, SI+3, SI+4, SI+4, SI+7, SI+0,
-                    SI+4, SI+7, SI+6, SI+6, SI+5, SI+4,
-                    SI+0, SI+7, SI+6, SI+6, SI+1, SI+0,
-                    SI+1, SI+6, SI+5, SI+5, SI+2, SI+1,
-                    SI+3, SI+4, SI+5, SI+5, SI+2, SI+3,
-                    ]
-            self.VGIndices = np.vstack([self.VGIndices, np.asarray(Indices).reshape((-1, 1))])
-
-            if Color is None:
-                Color = self.DefaultColor
-            for kk in range(0, 8):
-                self.VGColors = np.vstack([self.VGColors, np.asarray(Color).reshape((-1, 4))])
-                self.VGBorderColors = np.vstack([self.VGBorderColors, np.asarray(self.DefaultBorderColor).reshape((-1, 4))])
+        VO = np.transpose(self.VGNZ).astype(np.float64).reshape(-1, 3) # Voxel origins
+        VS = getattr(self, 'VGSizes', np.ones(len(VO)))[:, np.newaxis] # Voxel sides
+        VoxelCenters = (VO + 0.5 * VS) / self.GridSize
+        self.Points = np.vstack([self.Points, VoxelCenters])
+        self.Colors = np.vstack([self.Colors, VoxelCenters])
+
+        # Create vertices of voxels
+        CornerOffsets = np.array([
+                    [0, 0, 0], [1, 0, 0], [1, 1, 0], [0, 1, 0],
+                    [0, 1, 1], [1, 1, 1], [1, 0, 1], [0, 0, 1],
+                ], dtype=np.float64)
+        Corners = (VO[:, np.newaxis, :] + CornerOffsets * VS[:, :, np.newaxis]) / self.GridSize
+        self.VGCorners = np.vstack([self.VGCorners, Corners.reshape((-1, 3))])
+
+        Indices = np.array([
+                0, 1, 2, 2, 3, 0,
+                0, 3, 4, 4, 7, 0,
+                4, 7, 6, 6, 5, 4,
+                0, 7, 6, 6, 1, 0,
+                1, 6, 5, 5, 2, 1,
+                3, 4, 5, 5, 2, 3,
+                ], dtype=np.int32)
+        SI = np.arange(len(VO), dtype=np.int32)[:, np.newaxis] * 8 # start indices
+        self.VGIndices = np.vstack([self.VGIndices, (SI + Indices).reshape((-1, 1))])
+
+        if Color is None:
+            Color = self.DefaultColor
+        self.VGColors = np.vstack([self.VGColors, np.tile(np.asarray(Color, dtype=np.float64), (len(Corners) * 8, 1))])
+        self.VGBorderColors = np.vstack([self.VGBorderColors, np.tile(np.asarray(self.DefaultBorderColor, dtype=np.float64), (len(Corners) * 8, 1))])
 
         self.update()
 
@@ -492,15 +495,8 @@ class DepthImage(PointSet3D):
 
     def createFromDepthImage(self, DepthImage, Intrinsics, mask=None):
         self.Intrinsics = Intrinsics
-        if len(DepthImage.shape) == 3:
-            # This is encoded depth image, let's convert
-            Depth16 = np.uint16(DepthImage[:, :, 1]*256) + np.uint16(DepthImage[:, :, 2]) # NOTE: RGB is actually BGR in opencv
-            Depth16 = Depth16.astype(np.uint16)
-            self.DepthImage16 = Depth16
-        elif len(DepthImage.shape) == 2 and DepthImage.dtype == 'uint16':
-            self.DepthImage16 = DepthImage
-        else:
-            print('[ WARN ]: Unsupported depth type.')
+        self.DepthImage16 = self.decode(DepthImage)
+        if self.DepthImage16 is None:
             return
 
         self.Points = utilities.backproject(DepthImage, Intrinsics, mask)
@@ -510,6 +506,18 @@ class DepthImage(PointSet3D):
         # print('Min depth:', np.min(self.Points[:, 2]))
         # print('Added', self.Points.shape, 'points.')
 
+    @staticmethod
+    def decode(DepthImage):
+        if len(DepthImage.shape) == 3:
+            # This is encoded depth image, let's convert
+            Depth16 = np.uint16(DepthImage[:, :, 1]*256) + np.uint16(DepthImage[:, :, 2]) # NOTE: RGB is actually BGR in opencv
+            return Depth16.astype(np.uint16)
+        elif len(DepthImage.shape) == 2 and DepthImage.dtype == 'uint16':
+            return DepthImage
+
+        print('[ WARN ]: Unsupported depth type.')
+        return None
+
     def __del__(self):
         super().__del__()
 
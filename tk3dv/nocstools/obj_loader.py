@@ -1,87 +1,644 @@
+import os, re, json, hashlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import numpy as np
 import OpenGL.GL as gl
 import OpenGL.arrays.vbo as glvbo
 
+def splitRecords(Data, Keywords=(b'v', b'vt', b'vn', b'f')):
+    '''
+    Separates the records of OBJ data (bytes) by keyword in bulk. Returns a dict mapping each keyword to
+    (Blob, Lines) where Blob holds the fields of all those records, one record per line with the keyword
+    blanked out, and Lines are the line numbers of the records. Leading whitespace and # comments are ignored.
+    '''
+    Buf = np.frombuffer(Data + b'\n', dtype=np.uint8).copy()
+    isNewline = Buf == ord('\n')
+    Ends = np.flatnonzero(isNewline)
+    Starts = np.concatenate([[0], Ends[:-1] + 1])
+
+    # Blank out comments: every byte after a # on its line
+    Hashes = np.cumsum(Buf == ord('#'))
+    HashesBefore = Hashes[Starts] - (Buf[Starts] == ord('#'))
+    isComment = (Hashes - np.repeat(HashesBefore, Ends - Starts + 1)) > 0
+    Buf[isComment & ~isNewline] = ord(' ')
+
+    # Keywords are matched at the first non-whitespace byte of every line
+    NonSpace = np.flatnonzero(Buf > ord(' '))
+    First = np.concatenate([NonSpace, [len(Buf)]])[np.searchsorted(NonSpace, Starts)]
+    First = np.minimum(First, Ends)
+
+    # Type of every line (0 for other records), then of every byte without per-byte line indices
+    LineTypes = np.zeros(len(Starts), dtype=np.int8)
+    for Type, Keyword in enumerate(Keywords, 1):
+        K = len(Keyword)
+        # The keyword must be followed by a space or a tab
+        isRecord = np.ones(len(Starts), dtype=bool)
+        for i in range(0, K + 1):
+            Char = Buf[np.minimum(First + i, len(Buf) - 1)]
+            isRecord &= ((Char == Keyword[i]) if i < K else ((Char == ord(' ')) | (Char == ord('\t')))) & (First + i < Ends)
+        LineTypes[isRecord] = Type
+        for i in range(0, K):
+            Buf[First[isRecord] + i] = ord(' ')
+    Delta = np.zeros(len(Buf), dtype=np.int8)
+    Delta[Starts] = np.diff(np.concatenate([[0], LineTypes]))
+    ByteTypes = np.cumsum(Delta, dtype=np.int8)
+
+    Records = {}
+    for Type, Keyword in enumerate(Keywords, 1):
+        Records[Keyword.decode()] = (Buf[ByteTypes == Type].tobytes(), np.flatnonzero(LineTypes == Type))
+
+    return Records
+
+def countTokens(Blob):
+    # Number of whitespace separated tokens on every line of Blob, and the start offset of every token
+    B = np.frombuffer(Blob, dtype=np.uint8)
+    isSpace = B <= ord(' ')
+    TokenStarts = np.flatnonzero(~isSpace & np.concatenate([[True], isSpace[:-1]]))
+    LineEnds = np.flatnonzero(B == ord('\n'))
+    Counts = np.diff(np.concatenate([[0], np.searchsorted(TokenStarts, LineEnds)]))
+
+    return Counts, TokenStarts
+
+def parseNumbers(Blob, Count, dtype=np.float64):
+    Values = np.fromstring(Blob, dtype=dtype, sep=' ') if len(Blob) > 0 else np.zeros(0, dtype=dtype)
+    if len(Values) != Count: # Malformed numbers, use the slower but stricter path
+        Values = np.array(Blob.split(), dtype=dtype)
+
+    return Values
+
+def toMatrix(Values, Counts, nCols, Fill=0):
+    # Rows of Values with Counts[i] entries each, truncated or padded with Fill to nCols columns
+    if len(Counts) > 0 and np.all(Counts == Counts[0]) and Counts[0] >= nCols:
+        return Values.reshape(len(Counts), Counts[0])[:, :nCols].copy()
+
+    Matrix = np.full((len(Counts), nCols), Fill, dtype=Values.dtype)
+    RowStarts = np.cumsum(Counts) - Counts
+    for k in range(0, nCols):
+        Sel = Counts > k
+        Matrix[Sel, k] = Values[RowStarts[Sel] + k]
+
+    return Matrix
+
+def resolveIndices(Indices, nBefore):
+    # OBJ indices are 1-based, negative indices are relative to the records read so far and 0 means missing
+    Resolved = np.where(Indices > 0, Indices - 1, nBefore + Indices)
+    Resolved[Indices == 0] = -1
+
+    return Resolved
+
+StreamChunkSize = 64 * 1024 * 1024
+
+class GrowingArray(object):
+    '''
+    Appendable array of rows with amortized growth, used to stream records into typed arrays.
+    The buffer is resized in place (realloc) while nothing else references it, and with a new buffer otherwise,
+    so arrays returned by view() or finalize() stay valid. Peak memory is at most 2.5x the final array (old and
+    new buffer during a 1.5x growth step) and finalize() never copies the rows.
+    '''
+    def __init__(self, RowShape=(), dtype=np.float64, Capacity=1024):
+        self.Data = np.zeros((Capacity,) + tuple(RowShape), dtype=dtype)
+        self.Size = 0
+
+    def __len__(self):
+        return self.Size
+
+    def view(self):
+        return self.Data[:self.Size]
+
+    def resize(self, Capacity):
+        # Returns False if the buffer is referenced elsewhere and was left untouched
+        try:
+            self.Data.resize((Capacity,) + self.Data.shape[1:])
+        except ValueError:
+            return False
+        return True
+
+    def reserve(self, Size):
+        if Size > len(self.Data):
+            # Grow by 1.5x so that the final array is never much larger than needed
+            Capacity = max(Size, int(len(self.Data) * 1.5))
+            if not self.resize(Capacity):
+                Data = np.zeros((Capacity,) + self.Data.shape[1:], dtype=self.Data.dtype)
+                Data[:self.Size] = self.Data[:self.Size]
+                self.Data = Data
+
+    def append(self, Rows):
+        self.reserve(self.Size + len(Rows))
+        self.Data[self.Size:self.Size + len(Rows)] = Rows
+        self.Size += len(Rows)
+
+    def finalize(self):
+        # Shrinks the buffer in place if possible. Otherwise returns a view, keeping at most a third of the buffer as spare capacity
+        if self.Size == len(self.Data) or self.resize(self.Size):
+            return self.Data
+        return self.Data[:self.Size]
+
+class VertexClusterer(object):
+    '''
+    Incremental vertex clustering decimation: vertices are merged per grid cell of side ClusterSize (cluster position
+    and color are the means) and triangles that collapse are dropped. Vertices can be added in chunks.
+    '''
+    CellBits = 21
+
+    def __init__(self, ClusterSize):
+        self.ClusterSize = ClusterSize
+        self.SortedKeys = np.zeros(0, dtype=np.int64)
+        self.SortedIDs = np.zeros(0, dtype=np.int64)
+        self.VertexClusters = GrowingArray((), np.int32)
+        self.Sums = GrowingArray((3,), np.float64)
+        self.ColorSums = GrowingArray((3,), np.float64)
+        self.Counts = GrowingArray((), np.int64)
+        self.Triangles = GrowingArray((3,), np.int32)
+
+    def addVertices(self, Vertices, Colors=None):
+        Offset = 1 << (self.CellBits - 1)
+        Cells = np.clip(np.floor(Vertices / self.ClusterSize).astype(np.int64) + Offset, 0, (1 << self.CellBits) - 1)
+        Keys = (Cells[:, 0] << (2 * self.CellBits)) | (Cells[:, 1] << self.CellBits) | Cells[:, 2]
+        UniqueKeys, Inverse = np.unique(Keys, return_inverse=True)
+
+        # Look up existing clusters, and create the others
+        Pos = np.minimum(np.searchsorted(self.SortedKeys, UniqueKeys), max(len(self.SortedKeys) - 1, 0))
+        isFound = (self.SortedKeys[Pos] == UniqueKeys) if len(self.SortedKeys) > 0 else np.zeros(len(UniqueKeys), dtype=bool)
+        IDs = np.zeros(len(UniqueKeys), dtype=np.int64)
+        IDs[isFound] = self.SortedIDs[Pos[isFound]]
+        nNew = np.count_nonzero(~isFound)
+        IDs[~isFound] = len(self.Counts) + np.arange(nNew)
+        if nNew > 0:
+            Keys = np.concatenate([self.SortedKeys, UniqueKeys[~isFound]])
+            Order = np.argsort(Keys, kind='stable')
+            self.SortedKeys, self.SortedIDs = Keys[Order], np.concatenate([self.SortedIDs, IDs[~isFound]])[Order]
+            for Array in [self.Sums, self.ColorSums, self.Counts]:
+                Array.append(np.zeros((nNew,) + Array.Data.shape[1:], dtype=Array.Data.dtype))
+
+        Clusters = IDs[Inverse]
+        self.VertexClusters.append(Clusters.astype(np.int32))
+        np.add.at(self.Counts.view(), Clusters, 1)
+        np.add.at(self.Sums.view(), Clusters, Vertices)
+        if Colors is not None:
+            np.add.at(self.ColorSums.view(), Clusters, Colors)
+
+    def addTriangles(self, Triangles):
+        # Triangles index the vertices added so far
+        isValid = np.all((Triangles >= 0) & (Triangles < len(self.VertexClusters)), axis=1)
+        if not np.all(isValid):
+            print('[ WARN ]: Dropping', np.count_nonzero(~isValid), 'faces that reference vertices not defined before them.')
+        Clustered = self.VertexClusters.view()[Triangles[isValid]]
+        isKept = (Clustered[:, 0] != Clustered[:, 1]) & (Clustered[:, 1] != Clustered[:, 2]) & (Clustered[:, 0] != Clustered[:, 2])
+        self.Triangles.append(Clustered[isKept])
+
+    def finalize(self):
+        # Returns the cluster vertices, colors and the triangles without duplicates
+        Counts = self.Counts.view()[:, np.newaxis]
+        Vertices = self.Sums.view() / Counts
+        Colors = self.ColorSums.view() / Counts
+        Triangles = self.Triangles.view()
+        if len(Triangles) > 0:
+            _, Unique = np.unique(np.sort(Triangles, axis=1), axis=0, return_index=True)
+            Triangles = Triangles[np.sort(Unique)]
+
+        return Vertices, Colors, Triangles
+
+def readChunks(path, ChunkSize=StreamChunkSize):
+    # Yields the file in chunks of about ChunkSize bytes that end at line boundaries
+    with open(path, 'rb') as f:
+        Rest = b''
+        while True:
+            Data = f.read(ChunkSize)
+            if not Data:
+                if Rest:
+                    yield Rest
+                return
+            Data = Rest + Data
+            Cut = Data.rfind(b'\n') + 1
+            if Cut > 0:
+                yield Data[:Cut]
+            Rest = Data[Cut:]
+
+def parseChunk(Data, nRecords):
+    '''
+    Parses one chunk of OBJ data. nRecords holds the number of v, vt and vn records before the chunk, to resolve face indices.
+    '''
+    Records = splitRecords(Data)
+
+    Arrays = {}
+    for Key, Name, nCols in [('v', 'vertices', 3), ('vn', 'normals', 3), ('vt', 'texcoords', 2)]:
+        Blob, _ = Records[Key]
+        Counts, _ = countTokens(Blob)
+        Values = parseNumbers(Blob, np.sum(Counts))
+        Arrays[Name] = toMatrix(Values, Counts, nCols)
+        if Key == 'v':
+            VertexCounts, VertexValues = Counts, Values
+
+    # Vertex colors are the 4th to 6th values of v records where available
+    Arrays['HasColor'] = VertexCounts == 6
+    Arrays['vertcolors'] = None
+    if np.all(Arrays['HasColor']):
+        Colors = toMatrix(VertexValues, VertexCounts, 6)[:, 3:]
+        Colors[np.linalg.norm(Colors, axis=1) > 1.74] /= 255 # Check if between 0-1 or 0-255
+        Arrays['vertcolors'] = Colors
+
+    # Faces: every corner is v, v/vt, v//vn or v/vt/vn. Missing indices become 0
+    Blob, FaceLines = Records['f']
+    Blob = re.sub(rb'/(?=[/\s])', b'/0', Blob)
+    CornersPerFace, CornerStarts = countTokens(Blob)
+    Slashes = np.flatnonzero(np.frombuffer(Blob, dtype=np.uint8) == ord('/'))
+    FieldsPerCorner = 1 + np.bincount(np.searchsorted(CornerStarts, Slashes, side='right') - 1, minlength=len(CornerStarts))
+    Fields = parseNumbers(Blob.replace(b'/', b' '), np.sum(FieldsPerCorner), dtype=np.int64)
+    Corners = toMatrix(Fields, FieldsPerCorner, 3)
+    for k, Key in enumerate(['v', 'vt', 'vn']):
+        nBefore = nRecords[Key] + np.repeat(np.searchsorted(Records[Key][1], FaceLines), CornersPerFace)
+        Corners[:, k] = resolveIndices(Corners[:, k], nBefore)
+
+    # Fan triangulation (0, i, i + 1) of every face with at least 3 corners
+    nTriangles = np.maximum(CornersPerFace - 2, 0)
+    FaceStarts = np.repeat(np.cumsum(CornersPerFace) - CornersPerFace, nTriangles)
+    Fan = np.arange(np.sum(nTriangles)) - np.repeat(np.cumsum(nTriangles) - nTriangles, nTriangles)
+    Triangles = Corners[np.stack([FaceStarts, FaceStarts + Fan + 1, FaceStarts + Fan + 2], axis=1)]
+    Arrays['faces'] = Triangles[:, :, 0]
+    Arrays['face_texcoords'] = Triangles[:, :, 1]
+    Arrays['face_normals'] = Triangles[:, :, 2]
+
+    return Arrays
+
+def parseOBJ(path, ChunkSize=StreamChunkSize, Subsample=1, ClusterSize=None):
+    '''
+    Vectorized streaming OBJ parser. Returns a dict with 'vertices' (N, 3), 'vertcolors' (N, 3) or (0, 3), 'normals' (M, 3),
+    'texcoords' (T, 2) and zero-based (F, 3) triangle index arrays 'faces', 'face_texcoords' and 'face_normals'
+    (-1 where a face has no such index). Polygons are triangulated as fans.
+    The file is read in chunks of ChunkSize bytes into growing arrays, so peak memory stays close to the size of the result.
+    Subsample > 1 keeps every Subsample-th vertex as a point cloud (no faces). ClusterSize decimates the mesh on the fly
+    by vertex clustering (see VertexClusterer). Both drop normals and texture coordinates.
+    '''
+    isReduced = Subsample > 1 or ClusterSize is not None
+    Clusterer = VertexClusterer(ClusterSize) if ClusterSize is not None else None
+    Output = {'vertices': GrowingArray((3,)), 'vertcolors': GrowingArray((3,)), 'normals': GrowingArray((3,)), 'texcoords': GrowingArray((2,))
+              , 'faces': GrowingArray((3,), np.int64), 'face_texcoords': GrowingArray((3,), np.int64), 'face_normals': GrowingArray((3,), np.int64)}
+    nRecords = {'v': 0, 'vt': 0, 'vn': 0}
+    nColored = 0
+    for Data in readChunks(path, ChunkSize):
+        Arrays = parseChunk(Data, nRecords)
+        Vertices, Colors = Arrays['vertices'], Arrays['vertcolors']
+        nColored += np.count_nonzero(Arrays['HasColor'])
+        if nColored < nRecords['v'] + len(Vertices):
+            Colors = None
+            Output['vertcolors'] = None # Only some vertices have colors
+        if Clusterer is not None:
+            Clusterer.addVertices(Vertices, Colors)
+            Clusterer.addTriangles(Arrays['faces'])
+        elif Subsample > 1:
+            Kept = (nRecords['v'] + np.arange(len(Vertices))) % Subsample == 0
+            Output['vertices'].append(Vertices[Kept])
+            if Colors is not None:
+                Output['vertcolors'].append(Colors[Kept])
+        else:
+            for Name in ['vertices', 'normals', 'texcoords', 'faces', 'face_texcoords', 'face_normals']:
+                Output[Name].append(Arrays[Name])
+            if Colors is not None:
+                Output['vertcolors'].append(Colors)
+        nRecords['v'] += len(Vertices)
+        nRecords['vt'] += len(Arrays['texcoords'])
+        nRecords['vn'] += len(Arrays['normals'])
+        del Arrays, Data
+
+    if Output['vertcolors'] is None:
+        if nColored > 0:
+            print('[ WARN ]: Only some vertices have colors. Ignoring vertex colors.')
+        Output['vertcolors'] = GrowingArray((3,), Capacity=0)
+    Result = {Name: Array.finalize() for Name, Array in Output.items()}
+    if Clusterer is not None:
+        Result['vertices'], Colors, Result['faces'] = Clusterer.finalize()
+        Result['vertcolors'] = Colors if nColored == nRecords['v'] and nColored > 0 else np.zeros((0, 3))
+        Result['faces'] = Result['faces'].astype(np.int64)
+    if isReduced:
+        Result['face_texcoords'] = np.full(Result['faces'].shape, -1, dtype=np.int64)
+        Result['face_normals'] = np.full(Result['faces'].shape, -1, dtype=np.int64)
+
+    return Result
+
+MeshCacheVersion = 2
+MeshCacheMagic = b'TK3DVMSH'
+MeshArrays = ['vertices', 'Colors', 'vertcolors', 'vertnormals', 'normals', 'texcoords', 'faces', 'face_texcoords', 'face_normals']
+
+def normalizeRows(Vectors):
+    Lengths = np.linalg.norm(Vectors, axis=1, keepdims=True)
+    return np.divide(Vectors, Lengths, out=np.zeros(Vectors.shape), where=Lengths > 0)
+
+def computeVertexNormals(Vertices, Faces):
+    '''
+    Area-weighted vertex normals. The cross product of the edges of every triangle (whose length is twice
+    its area) is scatter-added to its three vertices in one pass, then normalized.
+    '''
+    Triangles = np.asarray(Vertices)[Faces]
+    FaceNormals = np.cross(Triangles[:, 1] - Triangles[:, 0], Triangles[:, 2] - Triangles[:, 0])
+    Normals = np.zeros((len(Vertices), 3))
+    for c in range(0, 3):
+        Normals[:, c] = np.bincount(Faces.ravel(), weights=np.repeat(FaceNormals[:, c], 3), minlength=len(Vertices))
+
+    return normalizeRows(Normals)
+
+def setVertexNormals(Arrays):
+    '''
+    Adds per-vertex normals ('vertnormals') to mesh arrays: the file normals if every face corner has one,
+    otherwise area-weighted normals computed from the faces. Vertices used with several file normals are
+    duplicated, which is the only case where faces are (partially) de-indexed.
+    '''
+    Vertices, Faces, FaceNormals, Normals = Arrays['vertices'], Arrays['faces'], Arrays['face_normals'], Arrays['normals']
+    if len(Faces) == 0:
+        # Point clouds can only use file normals given per vertex
+        Arrays['vertnormals'] = normalizeRows(Normals) if len(Normals) == len(Vertices) else np.zeros((0, 3))
+        return Arrays
+    if len(Normals) == 0 or np.any(FaceNormals < 0):
+        Arrays['vertnormals'] = computeVertexNormals(Vertices, Faces)
+        return Arrays
+
+    VertexNormalIdx = np.zeros(len(Vertices), dtype=np.int64)
+    VertexNormalIdx[Faces.ravel()] = FaceNormals.ravel()
+    if np.array_equal(VertexNormalIdx[Faces], FaceNormals):
+        # Every vertex uses a single normal
+        Arrays['vertnormals'] = normalizeRows(Normals[VertexNormalIdx])
+        return Arrays
+
+    # Split the vertices into unique (vertex, normal) pairs
+    Pairs = Faces.ravel().astype(np.int64) * len(Normals) + FaceNormals.ravel()
+    UniquePairs, Inverse = np.unique(Pairs, return_inverse=True)
+    VertexIdx, NormalIdx = np.divmod(UniquePairs, len(Normals))
+    for Name in ['vertices', 'Colors', 'vertcolors']:
+        if len(Arrays[Name]) > 0:
+            Arrays[Name] = np.asarray(Arrays[Name])[VertexIdx]
+    Arrays['vertnormals'] = normalizeRows(Normals[NormalIdx])
+    Arrays['faces'] = Inverse.reshape(Faces.shape)
+
+    return Arrays
+
+def loadMesh(path, isNormalize=False, isOverrideVertexColors=False, Subsample=1, ClusterSize=None):
+    '''
+    Parses an OBJ file and prepares the CPU side arrays used by Loader (see MeshArrays), optionally normalized to lie within the NOCS.
+    Subsample and ClusterSize reduce very large meshes while streaming them, see parseOBJ().
+    '''
+    Arrays = parseOBJ(path, Subsample=Subsample, ClusterSize=ClusterSize)
+    Arrays['Colors'] = None
+    if len(Arrays['vertcolors']) > 0:  # Prefer vertex colors if available
+        print('[ INFO ]: Rendering using available vertex colors.')
+        Arrays['Colors'] = Arrays['vertcolors']
+
+    if isNormalize is True:
+        # Normalize model vertices to lie within the NOCS
+        VerticesNP = Arrays['vertices']
+        # Compute extents of the vertices used by faces, if any
+        UsedVertices = VerticesNP[np.unique(Arrays['faces'])] if len(Arrays['faces']) > 0 else VerticesNP
+        XYZMin = np.min(UsedVertices, axis=0)
+        XYZMax = np.max(UsedVertices, axis=0)
+        DiagonalLength = np.linalg.norm(XYZMax - XYZMin)  # Get diagonal length
+        Arrays['vertices'] = (VerticesNP / DiagonalLength) + 0.5  # Normalize. Similar to ShapeNet normalization
+        print('[ INFO ]: Normalization factor (diagonal length) =', DiagonalLength)
+    if isOverrideVertexColors or Arrays['Colors'] is None:
+        Arrays['Colors'] = Arrays['vertices']
+
+    # Normals are not affected by the normalization (uniform scale and offset)
+    return setVertexNormals(Arrays)
+
+def getMeshCacheKey(path, Options):
+    Stat = os.stat(path)
+    Params = {'version': MeshCacheVersion, 'path': os.path.abspath(path), 'size': Stat.st_size, 'mtime': Stat.st_mtime_ns, 'options': Options}
+
+    return hashlib.sha1(json.dumps(Params, sort_keys=True).encode('utf-8')).hexdigest()
+
+def writeMeshCache(CacheFile, Arrays, Names=MeshArrays):
+    # Layout: magic, header length (uint64), JSON header with the dtype, shape and offset of every array, then the 64-byte aligned array data
+    Header = {}
+    Offset = 0
+    for Name in Names:
+        Array = np.ascontiguousarray(Arrays[Name])
+        Header[Name] = [Array.dtype.str, list(Array.shape), Offset]
+        Offset += (Array.nbytes + 63) // 64 * 64
+    HeaderBytes = json.dumps(Header).encode('utf-8')
+    DataStart = (len(MeshCacheMagic) + 8 + len(HeaderBytes) + 63) // 64 * 64
+
+    # Write to a temporary file first so that concurrent readers never see partial results
+    TempFile = CacheFile + '.{}.tmp'.format(os.getpid())
+    with open(TempFile, 'wb') as f:
+        f.write(MeshCacheMagic + np.uint64(len(HeaderBytes)).tobytes() + HeaderBytes)
+        for Name in Names:
+            f.seek(DataStart + Header[Name][2])
+            f.write(np.ascontiguousarray(Arrays[Name]).tobytes())
+        f.truncate(DataStart + Offset)
+    os.replace(TempFile, CacheFile)
+
+def readMeshCache(CacheFile):
+    # Memory-maps the arrays written by writeMeshCache()
+    with open(CacheFile, 'rb') as f:
+        if f.read(len(MeshCacheMagic)) != MeshCacheMagic:
+            return None
+        HeaderLength = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+        Header = json.loads(f.read(HeaderLength).decode('utf-8'))
+    DataStart = (len(MeshCacheMagic) + 8 + HeaderLength + 63) // 64 * 64
+
+    Arrays = {}
+    for Name, (dtype, Shape, Offset) in Header.items():
+        if np.prod(Shape) == 0:
+            Arrays[Name] = np.zeros(Shape, dtype=dtype)
+        else:
+            Arrays[Name] = np.memmap(CacheFile, dtype=dtype, mode='r', offset=DataStart + Offset, shape=tuple(Shape))
+
+    return Arrays
+
+def getMeshCacheFile(path, CacheDir, isNormalize=False, isOverrideVertexColors=False, Subsample=1, ClusterSize=None):
+    Key = getMeshCacheKey(path, {'normalize': bool(isNormalize), 'override_colors': bool(isOverrideVertexColors), 'subsample': int(Subsample)
+                                 , 'cluster_size': None if ClusterSize is None else float(ClusterSize)})
+
+    return os.path.join(CacheDir, Key + '.mesh')
+
+def loadMeshCached(path, CacheDir=None, isNormalize=False, isOverrideVertexColors=False, Subsample=1, ClusterSize=None):
+    '''
+    Same as loadMesh() but with the results cached in CacheDir, keyed on the absolute path, size and modification time
+    of the file and the loader options. Cached arrays are memory-mapped (read-only).
+    '''
+    if CacheDir is None:
+        return loadMesh(path, isNormalize, isOverrideVertexColors, Subsample, ClusterSize)
+
+    CacheFile = getMeshCacheFile(path, CacheDir, isNormalize, isOverrideVertexColors, Subsample, ClusterSize)
+    if os.path.exists(CacheFile):
+        try:
+            Arrays = readMeshCache(CacheFile)
+            if Arrays is not None:
+                return Arrays
+        except (OSError, ValueError) as e:
+            print('[ WARN ]: Ignoring unreadable mesh cache file', CacheFile, ':', e)
+
+    Arrays = loadMesh(path, isNormalize, isOverrideVertexColors, Subsample, ClusterSize)
+    os.makedirs(CacheDir, exist_ok=True)
+    writeMeshCache(CacheFile, Arrays)
+
+    return Arrays
+
+LODBaseResolution = 64 # Clusters along the bounding box diagonal for the first decimated level
+
+def decimateMesh(Arrays, ClusterSize):
+    '''
+    Decimates mesh arrays (see MeshArrays) by vertex clustering with cells of side ClusterSize.
+    Cluster colors are the mean colors and normals are recomputed.
+    '''
+    Clusterer = VertexClusterer(ClusterSize)
+    Clusterer.addVertices(np.asarray(Arrays['vertices']), np.asarray(Arrays['Colors']))
+    Clusterer.addTriangles(np.asarray(Arrays['faces']))
+    Vertices, Colors, Faces = Clusterer.finalize()
+    Faces = Faces.astype(np.int64)
+    Level = {'vertices': Vertices, 'Colors': Colors, 'vertcolors': np.zeros((0, 3)), 'vertnormals': computeVertexNormals(Vertices, Faces)
+             , 'normals': np.zeros((0, 3)), 'texcoords': np.zeros((0, 2)), 'faces': Faces
+             , 'face_texcoords': np.full(Faces.shape, -1, dtype=np.int64), 'face_normals': np.full(Faces.shape, -1, dtype=np.int64)}
+
+    return Level
+
+def buildLODChain(Arrays, nLevels=3, BaseResolution=LODBaseResolution):
+    '''
+    Builds up to nLevels decimated versions of a mesh, each with half the resolution of the previous one.
+    Returns a list of (ClusterSize, Arrays) from the finest to the coarsest level.
+    '''
+    Vertices = np.asarray(Arrays['vertices'])
+    if len(Arrays['faces']) == 0 or len(Vertices) == 0:
+        return []
+    Diagonal = np.linalg.norm(np.max(Vertices, axis=0) - np.min(Vertices, axis=0))
+    LODs = []
+    nFaces = len(Arrays['faces'])
+    for Level in range(0, nLevels):
+        ClusterSize = Diagonal / (BaseResolution / 2 ** Level)
+        Decimated = decimateMesh(Arrays, ClusterSize)
+        if len(Decimated['faces']) == 0:
+            break
+        if len(Decimated['faces']) > 0.8 * nFaces: # Not worth a level
+            continue
+        LODs.append((ClusterSize, Decimated))
+        nFaces = len(Decimated['faces'])
+
+    return LODs
+
+def getLODFile(path):
+    # LOD chains are cached next to the model
+    return path + '.lod.mesh'
+
+def getLODSource(path, isNormalize, isOverrideVertexColors, nLevels, BaseResolution):
+    # Identifies the model file and options an LOD chain was built from
+    Stat = os.stat(path)
+    return np.array([MeshCacheVersion, Stat.st_size, Stat.st_mtime_ns, int(isNormalize), int(isOverrideVertexColors), nLevels, BaseResolution], dtype=np.int64)
+
+def writeLODChain(path, LODs, isNormalize=False, isOverrideVertexColors=False, nLevels=3, BaseResolution=LODBaseResolution):
+    Arrays = {'source': getLODSource(path, isNormalize, isOverrideVertexColors, nLevels, BaseResolution), 'cluster_sizes': np.array([L[0] for L in LODs])}
+    for Level, (_, LevelArrays) in enumerate(LODs):
+        for Name in MeshArrays:
+            Arrays['lod{}/{}'.format(Level, Name)] = LevelArrays[Name]
+    writeMeshCache(getLODFile(path), Arrays, Names=list(Arrays.keys()))
+
+def readLODChain(path, isNormalize=False, isOverrideVertexColors=False, nLevels=3, BaseResolution=LODBaseResolution):
+    # Returns None if there is no up to date LOD chain for these options next to the model
+    LODFile = getLODFile(path)
+    if not os.path.exists(LODFile):
+        return None
+    try:
+        Arrays = readMeshCache(LODFile)
+    except (OSError, ValueError) as e:
+        print('[ WARN ]: Ignoring unreadable LOD file', LODFile, ':', e)
+        return None
+    if Arrays is None or not np.array_equal(Arrays.get('source'), getLODSource(path, isNormalize, isOverrideVertexColors, nLevels, BaseResolution)):
+        return None
+
+    return [(float(ClusterSize), {Name: Arrays['lod{}/{}'.format(Level, Name)] for Name in MeshArrays}) for Level, ClusterSize in enumerate(Arrays['cluster_sizes'])]
+
+def loadLODChain(path, Arrays, nLevels=3, isNormalize=False, isOverrideVertexColors=False, BaseResolution=LODBaseResolution):
+    # Uses the LOD chain precomputed next to the model (see examples/buildOBJLODs.py) if it is up to date, else builds it
+    LODs = readLODChain(path, isNormalize, isOverrideVertexColors, nLevels, BaseResolution)
+    if LODs is None:
+        LODs = buildLODChain(Arrays, nLevels, BaseResolution)
+
+    return LODs
+
+def selectLODLevel(ClusterSizes, PixelsPerUnit, PixelTolerance=1.0):
+    # Coarsest level whose clusters project to at most PixelTolerance pixels. 0 is the full resolution mesh, i the (i-1)th LOD
+    Level = 0
+    for i, ClusterSize in enumerate(ClusterSizes):
+        if ClusterSize * PixelsPerUnit <= PixelTolerance:
+            Level = i + 1
+
+    return Level
+
+def loadMeshWorker(path, CacheDir, isNormalize, isOverrideVertexColors, nLODs=0):
+    # With a cache, only return the cache file name so that the arrays are memory-mapped by the caller instead of pickled
+    Arrays = loadMeshCached(path, CacheDir, isNormalize, isOverrideVertexColors)
+    LODs = loadLODChain(path, Arrays, nLODs, isNormalize, isOverrideVertexColors) if nLODs > 0 else []
+    if CacheDir is not None:
+        return getMeshCacheFile(path, CacheDir, isNormalize, isOverrideVertexColors), LODs
+
+    return Arrays, LODs
+
+class ParallelLoader(object):
+    '''
+    Parses many OBJ files concurrently in a process pool. Call poll() from the GL thread (e.g. in a module's draw())
+    to create the Loader objects of the models that have finished so far, so that they appear progressively.
+    '''
+    def __init__(self, paths, isNormalize=False, isOverrideVertexColors=False, CacheDir=None, nWorkers=None, isVerbose=True, nLODs=0):
+        self.paths = list(paths)
+        self.isVerbose = isVerbose
+        self.Loaders = [None] * len(self.paths)
+        self.Executor = ProcessPoolExecutor(max_workers=nWorkers) if len(self.paths) > 0 else None
+        self.Futures = {}
+        for Idx, path in enumerate(self.paths):
+            self.Futures[self.Executor.submit(loadMeshWorker, path, CacheDir, isNormalize, isOverrideVertexColors, nLODs)] = Idx
+
+    def __len__(self):
+        return len(self.paths)
+
+    def isDone(self):
+        return len(self.Futures) == 0
+
+    def poll(self, isBlocking=False):
+        # Returns the indices of the models loaded by this call
+        Loaded = []
+        Done = [Future for Future in self.Futures if Future.done()] if not isBlocking else list(as_completed(self.Futures))
+        for Future in Done:
+            Idx = self.Futures.pop(Future)
+            try:
+                Result, LODs = Future.result()
+                Arrays = readMeshCache(Result) if isinstance(Result, str) else Result
+                self.Loaders[Idx] = Loader(self.paths[Idx], isVerbose=self.isVerbose, Arrays=Arrays, LODs=LODs)
+                Loaded.append(Idx)
+            except Exception as e:
+                print('[ WARN ]: Failed to load', self.paths[Idx], ':', e)
+        if self.isDone() and self.Executor is not None:
+            self.Executor.shutdown(wait=False)
+            self.Executor = None
+
+        return Loaded
+
+    def wait(self):
+        return self.poll(isBlocking=True)
+
 class Loader(object):
-    def __init__(self, path, isNormalize=False, isOverrideVertexColors=False, isVerbose=True):
+    def __init__(self, path, isNormalize=False, isOverrideVertexColors=False, isVerbose=True, CacheDir=None, Arrays=None, Subsample=1, ClusterSize=None, nLODs=0, LODs=None):
         self.isVBOBound = False
 
-        vertices = []
-        normals = []
-        texcoords = []
-        faces = []
-        vertcolors = []
-        for line in open(path, "r"):
-            if line.startswith('#'):
-                continue
-            values = line.split()
-            if not values:
-                continue
-            if values[0] == 'v':
-                vertices.append(tuple(map(float, values[1:4])))
-                if len(values) == 7: # read vertex colors where available in values[4:7]
-                    ColVal = np.array(list(map(float, values[4:7])))
-                    if np.linalg.norm(ColVal) > 1.74: # Check if between 0-1 or 0-255
-                        ColVal /= 255
-                        vertcolors.append((ColVal[0], ColVal[1], ColVal[2]))
-                    else:
-                        vertcolors.append(tuple(map(float, values[4:7])))
-            elif values[0] == 'vn':
-                normals.append(tuple(map(float, values[1:4])))
-            elif values[0] == 'vt':
-                texcoords.append(tuple(map(float, values[1:3])))
-            elif values[0] == 'f':
-                face = []
-                for v in values[1:]:
-                    w = map(lambda x: int(x) if x else None, v.split('/'))
-                    w = map(lambda x: x-1 if x != None and x > 0 else x, w)
-                    face.append(tuple(w))
-                faces.append(tuple(face))
+        # Arrays can be passed if already loaded (see ParallelLoader)
+        if Arrays is None:
+            Arrays = loadMeshCached(path, CacheDir, isNormalize, isOverrideVertexColors, Subsample, ClusterSize)
+        # Decimated levels of detail, picked by projected size in draw()
+        if LODs is None:
+            LODs = loadLODChain(path, Arrays, nLODs, isNormalize, isOverrideVertexColors) if nLODs > 0 else []
+        self.LODClusterSizes = [LOD[0] for LOD in LODs]
+        self.LODs = [Loader(path, isVerbose=False, Arrays=LODArrays) for _, LODArrays in LODs]
+        self.LODPixelTolerance = 1.0
+        self.activeLOD = 0
 
         # Final data
-        self.vertices = vertices
-        self.normals = normals
-        self.texcoords = texcoords
-        self.faces = faces
-        self.vertcolors = vertcolors
-        self.Colors = None
-        if len(self.vertcolors) > 0:  # Prefer vertex colors if available
-            # print('[ INFO ]: Rendering using available vertex colors.')
-            self.Colors = np.asarray(self.vertcolors)
+        self.vertices = Arrays['vertices']
+        self.normals = Arrays['normals']
+        self.texcoords = Arrays['texcoords']
+        self.faces = Arrays['faces']
+        self.face_texcoords = Arrays['face_texcoords']
+        self.face_normals = Arrays['face_normals']
+        self.vertcolors = Arrays['vertcolors']
+        self.vertnormals = Arrays['vertnormals']
+        self.Colors = Arrays['Colors']
+        self.BBCenter = (np.min(self.vertices, axis=0) + np.max(self.vertices, axis=0)) / 2 if len(self.vertices) > 0 else np.zeros(3)
 
-        if len(self.faces) > 0:
-            # TODO: This is extremely inefficient
-            self.triangle_vertices = []
-            self.triangle_vertices_colors = []
-            for Face in self.faces:
-                self.triangle_vertices.append((self.vertices[Face[0][0]]))
-                self.triangle_vertices.append((self.vertices[Face[1][0]]))
-                self.triangle_vertices.append((self.vertices[Face[2][0]]))
-                if len(self.vertcolors) > 0:
-                    self.triangle_vertices_colors.append((self.vertcolors[Face[0][0]]))
-                    self.triangle_vertices_colors.append((self.vertcolors[Face[1][0]]))
-                    self.triangle_vertices_colors.append((self.vertcolors[Face[2][0]]))
-
-            self.vertices = self.triangle_vertices
-            self.vertcolors = self.triangle_vertices_colors
-            if len(self.vertcolors) > 0: # Prefer vertex colors if available
-                print('[ INFO ]: Rendering using available vertex colors.')
-                self.Colors = np.asarray(self.vertcolors)
-
-        # TODO: Do the normals need to be recomputed?
-        if isNormalize is True:
-            # Normalize model vertices to lie within the NOCS
-            VerticesNP = np.asarray(self.vertices)
-            # Compute extents
-            XYZMin = np.min(VerticesNP, axis=0)
-            XYZMax = np.max(VerticesNP, axis=0)
-            DiagonalLength = np.linalg.norm(XYZMax - XYZMin)  # Get diagonal length
-            self.vertices = (VerticesNP / DiagonalLength) + 0.5  # Normalize. Similar to ShapeNet normalization
-            print('[ INFO ]: Normalization factor (diagonal length) =', DiagonalLength)
-        if isOverrideVertexColors or len(self.vertcolors) <= 0 or self.Colors is None:
-            self.Colors = np.asarray(self.vertices)
-
-        # self.Colors = VerticesNP / DiagonalLength # Normalize. Similar to ShapeNet normalization
+        # Faces are drawn indexed, with unique vertices and one element per triangle corner
+        self.isIndexed = len(self.faces) > 0
 
         if isVerbose:
             print('[ INFO ]: Loaded', path, '\n\t\twith vertices/faces/normals:',
@@ -93,6 +650,36 @@ class Loader(object):
         if self.isVBOBound:
             self.VBOPoints.delete()
             self.VBOColors.delete()
+            if self.VBOIndices is not None:
+                self.VBOIndices.delete()
+            if self.VBONormals is not None:
+                self.VBONormals.delete()
+
+    def deindex(self):
+        # Expand indexed faces to a triangle soup. Only needed for attributes that are per face corner instead of per vertex
+        if not self.isIndexed:
+            return
+        self.vertices = np.asarray(self.vertices)[self.faces].reshape(-1, 3)
+        self.Colors = np.asarray(self.Colors)[self.faces].reshape(-1, 3)
+        if len(self.vertcolors) > 0:
+            self.vertcolors = self.vertcolors[self.faces].reshape(-1, 3)
+        if len(self.vertnormals) > 0:
+            self.vertnormals = self.vertnormals[self.faces].reshape(-1, 3)
+        self.isIndexed = False
+
+    def toVertexAttribute(self, Values):
+        # Map a per vertex attribute, or a triangle soup one (three rows per face, as drawn before indexing), onto the drawn vertices
+        Values = np.asarray(Values)
+        if not self.isIndexed or len(Values) == len(self.vertices):
+            if len(Values) != len(self.vertices):
+                raise RuntimeError('[ ERR ]: Expected {} attribute rows, got {}.'.format(len(self.vertices), len(Values)))
+            return Values
+        if len(Values) != self.faces.size:
+            raise RuntimeError('[ ERR ]: Expected {} (vertices) or {} (face corners) attribute rows, got {}.'.format(len(self.vertices), self.faces.size, len(Values)))
+        # Corners sharing a vertex take the value of the last one
+        Out = np.zeros((len(self.vertices),) + Values.shape[1:], dtype=Values.dtype)
+        Out[self.faces.ravel()] = Values
+        return Out
 
     def update(self):
         self.nPoints = len(self.vertices)
@@ -103,16 +690,59 @@ class Loader(object):
         # Create VBO
         self.VBOPoints = glvbo.VBO(np.asarray(self.vertices))
         self.VBOColors = glvbo.VBO(np.asarray(self.Colors))
+        self.VBOIndices = None
+        self.nElements = 0
+        if self.isIndexed:
+            self.VBOIndices = glvbo.VBO(np.ascontiguousarray(self.faces, dtype=np.uint32), target=gl.GL_ELEMENT_ARRAY_BUFFER)
+            self.nElements = self.faces.size
+        self.VBONormals = None
+        if len(self.vertnormals) == self.nPoints:
+            # Compact normals: signed bytes (normalized by GL), padded to 4 bytes per vertex
+            CompactNormals = np.zeros((self.nPoints, 4), dtype=np.int8)
+            CompactNormals[:, :3] = np.round(np.asarray(self.vertnormals) * 127)
+            self.VBONormals = glvbo.VBO(CompactNormals)
         self.isVBOBound = True
 
-    def draw(self, PointSize=10.0, isWireFrame=False):
+    def getPixelsPerUnit(self):
+        # Approximate size in pixels of one model unit at the bounding box center, from the current GL matrices
+        ModelView = np.array(gl.glGetDoublev(gl.GL_MODELVIEW_MATRIX)).reshape(4, 4).T
+        Projection = np.array(gl.glGetDoublev(gl.GL_PROJECTION_MATRIX)).reshape(4, 4).T
+        Viewport = gl.glGetIntegerv(gl.GL_VIEWPORT)
+        Center = ModelView @ np.append(self.BBCenter, 1)
+        PixelsPerUnit = Projection[1, 1] * Viewport[3] / 2 * np.linalg.norm(ModelView[:3, 0])
+        if Projection[3, 3] == 0: # Perspective
+            PixelsPerUnit /= max(-Center[2], 1e-6)
+
+        return PixelsPerUnit
+
+    def draw(self, PointSize=10.0, isWireFrame=False, isLit=False):
         if self.isVBOBound == False:
             print('[ WARN ]: VBOs not bound. Call update().')
             return
 
-        gl.glPushAttrib(gl.GL_POINT_BIT)
+        self.activeLOD = 0
+        if len(self.LODs) > 0:
+            self.activeLOD = selectLODLevel(self.LODClusterSizes, self.getPixelsPerUnit(), self.LODPixelTolerance)
+        if self.activeLOD > 0:
+            self.LODs[self.activeLOD - 1].draw(PointSize, isWireFrame, isLit)
+            return
+
+        gl.glPushAttrib(gl.GL_POINT_BIT | gl.GL_LIGHTING_BIT | gl.GL_ENABLE_BIT)
         gl.glPointSize(PointSize)
 
+        isLit = isLit and self.VBONormals is not None
+        if isLit:
+            # Headlight (default GL_LIGHT0) with the vertex colors as material
+            gl.glEnable(gl.GL_LIGHTING)
+            gl.glEnable(gl.GL_LIGHT0)
+            gl.glLightModeli(gl.GL_LIGHT_MODEL_TWO_SIDE, gl.GL_TRUE)
+            gl.glEnable(gl.GL_COLOR_MATERIAL)
+            gl.glColorMaterial(gl.GL_FRONT_AND_BACK, gl.GL_AMBIENT_AND_DIFFUSE)
+            gl.glEnable(gl.GL_NORMALIZE)
+            self.VBONormals.bind()
+            gl.glEnableClientState(gl.GL_NORMAL_ARRAY)
+            gl.glNormalPointer(gl.GL_BYTE, 4, self.VBONormals)
+
         if self.VBOPoints is not None:
             self.VBOPoints.bind()
             gl.glEnableClientState(gl.GL_VERTEX_ARRAY)
@@ -126,10 +756,17 @@ class Loader(object):
         if len(self.faces) > 0:
             if isWireFrame:
                 gl.glPolygonMode(gl.GL_FRONT_AND_BACK, gl.GL_LINE)
-            gl.glDrawArrays(gl.GL_TRIANGLES, 0, self.nPoints)
+            if self.VBOIndices is not None:
+                self.VBOIndices.bind()
+                gl.glDrawElements(gl.GL_TRIANGLES, self.nElements, gl.GL_UNSIGNED_INT, None)
+                self.VBOIndices.unbind()
+            else:
+                gl.glDrawArrays(gl.GL_TRIANGLES, 0, self.nPoints)
         else:
             gl.glDrawArrays(gl.GL_POINTS, 0, self.nPoints)
 
+        if isLit:
+            gl.glDisableClientState(gl.GL_NORMAL_ARRAY)
         gl.glPopAttrib()
 
 
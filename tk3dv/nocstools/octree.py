@@ -0,0 +1,202 @@
+import numpy as np
+
+from tk3dv.extern.binvox import binvox_rw
+
+# Child slot of the octant at offset (dx, dy, dz) is dx * 4 + dy * 2 + dz
+ChildOffsets = np.array([[dx, dy, dz] for dx in (0, 1) for dy in (0, 1) for dz in (0, 1)], dtype=np.int64)
+
+class SparseVoxelOctree():
+    '''
+    Array-backed sparse voxel octree over an xyz voxel grid padded to a power of two size.
+    Children is an (nNodes, 8) int32 array holding the index of each child node, or EMPTY / FULL for
+    uniform octants, so solid interiors and empty space collapse and memory scales with the surface area.
+    Nodes are stored breadth first: nodes of depth d are LevelOffsets[d]:LevelOffsets[d+1]. Node 0 is the root.
+    '''
+    EMPTY = -1
+    FULL = -2
+
+    def __init__(self, Values, Counts, Dims):
+        '''
+        Builds the octree from binvox runs: Values and Counts of the runs in binvox (xzy) order and the binvox Dims.
+        The runs are never expanded. Cells are classified with prefix sums of filled voxels along the runs.
+        '''
+        self.Dims = [int(d) for d in Dims]
+        self.GridShape = (self.Dims[0], self.Dims[2], self.Dims[1]) # xyz
+        self.nLevels = max(1, int(np.ceil(np.log2(max(self.Dims)))))
+        self.Size = 1 << self.nLevels
+
+        Counts = np.asarray(Counts, dtype=np.int64)
+        Values = np.asarray(Values).astype(np.bool_)
+        Keep = Counts > 0
+        self.RunValues = Values[Keep]
+        self.RunCounts = Counts[Keep]
+        self.RunStarts = np.cumsum(self.RunCounts) - self.RunCounts
+        self.FilledBefore = np.concatenate(([0], np.cumsum(self.RunCounts * self.RunValues)))
+
+        self.build()
+
+        # Runs are only needed while building
+        del self.RunValues, self.RunCounts, self.RunStarts, self.FilledBefore
+
+    @staticmethod
+    def fromBinvox(FileName):
+        with open(FileName, 'rb') as f:
+            Dims, _, _ = binvox_rw.read_header(f)
+            Raw = np.frombuffer(f.read(), dtype=np.uint8)
+
+        return SparseVoxelOctree(Raw[::2], Raw[1::2], Dims)
+
+    @staticmethod
+    def fromVoxels(Model):
+        '''
+        Builds the octree from binvox_rw.Voxels (dense or coordinate), binvox_rw.PackedVoxels or a dense xyz numpy array.
+        '''
+        if isinstance(Model, np.ndarray):
+            Model = binvox_rw.Voxels(Model, [Model.shape[0], Model.shape[2], Model.shape[1]], [0.0, 0.0, 0.0], 1.0, 'xyz')
+
+        if isinstance(Model, binvox_rw.PackedVoxels):
+            Pairs = Model.to_rle()
+        elif Model.data.ndim == 2:
+            Pairs = binvox_rw.sparse_to_rle(Model.data, Model.dims, Model.axis_order)
+        elif Model.axis_order == 'xzy':
+            Pairs = binvox_rw.dense_to_rle(Model.data.ravel())
+        else:
+            Pairs = binvox_rw.dense_to_rle(np.transpose(Model.data, (0, 2, 1)).ravel())
+
+        return SparseVoxelOctree(Pairs[::2], Pairs[1::2], Model.dims)
+
+    def countFilledBefore(self, LinearIndices):
+        # Number of filled voxels with binvox linear index smaller than each of LinearIndices
+        RunIdx = np.maximum(np.searchsorted(self.RunStarts, LinearIndices, side='right') - 1, 0)
+        InRun = np.clip(LinearIndices - self.RunStarts[RunIdx], 0, self.RunCounts[RunIdx])
+
+        return self.FilledBefore[RunIdx] + self.RunValues[RunIdx] * InRun
+
+    def countFilled(self, Origins, CellSize, ChunkSize=1 << 20):
+        '''
+        Number of filled voxels in each of the cubic cells with xyz Origins (n, 3) and side CellSize.
+        Each cell is the union of CellSize^2 binvox rows, so only 2 * CellSize^2 prefix lookups are needed per cell.
+        Cells are processed in chunks of about ChunkSize rows to bound memory.
+        '''
+        Filled = np.zeros(len(Origins), dtype=np.int64)
+        if self.RunStarts.size == 0:
+            return Filled
+
+        Offsets = np.arange(CellSize)
+        CellsPerChunk = max(1, ChunkSize // (CellSize * CellSize))
+        for Start in range(0, len(Origins), CellsPerChunk):
+            Chunk = Origins[Start:Start + CellsPerChunk]
+            X = Chunk[:, 0, np.newaxis, np.newaxis] + Offsets[np.newaxis, :, np.newaxis]
+            Z = Chunk[:, 2, np.newaxis, np.newaxis] + Offsets[np.newaxis, np.newaxis, :]
+            Valid = (X < self.Dims[0]) & (Z < self.Dims[1])
+            RowStart = ((X * self.Dims[1] + Z) * self.Dims[2])[Valid]
+            CellIdx = np.broadcast_to(np.arange(len(Chunk))[:, np.newaxis, np.newaxis], Valid.shape)[Valid]
+            Lo = RowStart + np.minimum(Chunk[CellIdx, 1], self.Dims[2])
+            Hi = RowStart + np.minimum(Chunk[CellIdx, 1] + CellSize, self.Dims[2])
+            RowFilled = self.countFilledBefore(Hi) - self.countFilledBefore(Lo)
+            Filled[Start:Start + len(Chunk)] = np.bincount(CellIdx, weights=RowFilled, minlength=len(Chunk)).astype(np.int64)
+
+        return Filled
+
+    def build(self):
+        Children = []
+        Origins = [np.zeros((1, 3), dtype=np.int64)]
+        Counts = [self.countFilled(Origins[0], self.Size)]
+        self.LevelOffsets = [0, 1]
+
+        nNodes = 1
+        LevelOrigins = Origins[0]
+        for Depth in range(0, self.nLevels):
+            CellSize = self.Size >> (Depth + 1)
+            ChildOrigins = (LevelOrigins[:, np.newaxis, :] + ChildOffsets * CellSize).reshape(-1, 3)
+            ChildCounts = self.countFilled(ChildOrigins, CellSize)
+
+            isPartial = (ChildCounts > 0) & (ChildCounts < CellSize ** 3)
+            Codes = np.full(len(ChildCounts), self.EMPTY, dtype=np.int32)
+            Codes[ChildCounts == CellSize ** 3] = self.FULL
+            nPartial = np.count_nonzero(isPartial)
+            Codes[isPartial] = nNodes + np.arange(nPartial, dtype=np.int32)
+            Children.append(Codes.reshape(-1, 8))
+
+            nNodes += nPartial
+            self.LevelOffsets.append(nNodes)
+            LevelOrigins = ChildOrigins[isPartial]
+            Origins.append(LevelOrigins)
+            Counts.append(ChildCounts[isPartial])
+
+        self.Children = np.concatenate(Children, axis=0)
+        self.NodeOrigins = np.concatenate(Origins, axis=0).astype(np.int32)
+        self.NodeCounts = np.concatenate(Counts, axis=0)
+
+    def __len__(self):
+        return self.Children.shape[0]
+
+    @property
+    def nbytes(self):
+        return self.Children.nbytes + self.NodeOrigins.nbytes + self.NodeCounts.nbytes
+
+    def getNodeDepths(self, Nodes):
+        return np.searchsorted(self.LevelOffsets, Nodes, side='right') - 1
+
+    def isOccupied(self, Points):
+        '''
+        Occupancy of (N, 3) integer xyz voxel coordinates. Voxels outside the grid are empty.
+        '''
+        Points = np.asarray(Points, dtype=np.int64).reshape(-1, 3)
+        Occupied = np.zeros(len(Points), dtype=np.bool_)
+        Active = np.flatnonzero(np.all((Points >= 0) & (Points < self.GridShape), axis=1))
+        Nodes = np.zeros(len(Active), dtype=np.int64)
+        for Depth in range(0, self.nLevels):
+            if len(Active) == 0:
+                break
+            Shift = self.nLevels - Depth - 1
+            Octant = (Points[Active] >> Shift) & 1
+            Child = self.Children[Nodes, Octant[:, 0] * 4 + Octant[:, 1] * 2 + Octant[:, 2]]
+            Occupied[Active[Child == self.FULL]] = True
+            isPartial = Child >= 0
+            Active = Active[isPartial]
+            Nodes = Child[isPartial]
+
+        return Occupied
+
+    def getLeaves(self):
+        '''
+        Returns the xyz origins (M, 3) and side lengths (M,) of all full octants, coarsest first.
+        '''
+        Nodes, Slots = np.nonzero(self.Children == self.FULL)
+        Sizes = (self.Size >> (self.getNodeDepths(Nodes) + 1)).astype(np.int32)
+        Origins = self.NodeOrigins[Nodes] + ChildOffsets[Slots].astype(np.int32) * Sizes[:, np.newaxis]
+
+        return Origins, Sizes
+
+    def downsample(self, Level=1, Threshold=0.0):
+        '''
+        Dense xyz boolean grid with cells of side 2^Level voxels. A cell is occupied if more than
+        Threshold of its voxels are filled, so the default marks every cell that touches the surface.
+        '''
+        if Level < 0 or Level > self.nLevels:
+            raise ValueError('Level must be between 0 and {}.'.format(self.nLevels))
+
+        CellSize = 1 << Level
+        Shape = tuple(-(-np.array(self.GridShape) // CellSize))
+        Grid = np.zeros((self.Size // CellSize,) * 3, dtype=np.bool_)
+
+        # Full octants at least as large as a cell fill whole blocks of cells
+        Origins, Sizes = self.getLeaves()
+        if Threshold < 1.0:
+            for Size in np.unique(Sizes[Sizes >= CellSize]):
+                Blocks = Origins[Sizes == Size] // CellSize
+                Span = np.arange(Size // CellSize)
+                Offsets = np.stack(np.meshgrid(Span, Span, Span, indexing='ij'), axis=-1).reshape(-1, 3)
+                Cells = (Blocks[:, np.newaxis, :] + Offsets).reshape(-1, 3)
+                Grid[Cells[:, 0], Cells[:, 1], Cells[:, 2]] = True
+
+        # Partial nodes of exactly cell size hold the filled fraction; smaller octants lie inside them
+        Depth = self.nLevels - Level
+        if Depth < len(self.LevelOffsets) - 1:
+            Nodes = np.arange(self.LevelOffsets[Depth], self.LevelOffsets[Depth + 1])
+            Occupied = Nodes[self.NodeCounts[Nodes] > Threshold * CellSize ** 3]
+            Cells = self.NodeOrigins[Occupied] // CellSize
+            Grid[Cells[:, 0], Cells[:, 1], Cells[:, 2]] = True
+
+        return Grid[:Shape[0], :Shape[1], :Shape[2]]
@@ -1,7 +1,9 @@
 import cv2
 import numpy as np
 import datastructures as ds
-import math
+from tk3dv.common import utilities
+import benchmarking
+import math, functools
 import random
 
 def rotation_matrix(axis, theta):
@@ -19,98 +21,141 @@ def rotation_matrix(axis, theta):
                      [2*(bc-ad), aa+cc-bb-dd, 2*(cd+ab)],
                      [2*(bd+ac), 2*(cd-ab), aa+dd-bb-cc]])
 
+def splitInstances(LabelImage, Images, Background=None):
+    '''
+    Splits the pixels of an (H, W) integer label image by label in a single pass.
+    Images is a dict of (H, W) or (H, W, C) images. Returns (IDs, Instances) where Instances[i] is a dict
+    with the 'Rows' and 'Cols' of the pixels labeled IDs[i] (in row-major order) and, for every key in Images,
+    a contiguous array with the values of those pixels.
+    '''
+    Labels = np.ravel(LabelImage)
+    # Stable sorts of small integer types are radix sorts, so this stays O(H x W) for any number of instances
+    Order = np.argsort(Labels, kind='stable')
+    Counts = np.bincount(Labels)
+    Offsets = np.concatenate([[0], np.cumsum(Counts)])
+    IDs = np.flatnonzero(Counts)
+    if Background is not None:
+        IDs = IDs[IDs != Background]
+
+    Rows, Cols = np.divmod(Order, LabelImage.shape[1])
+    Sorted = {}
+    for Key, Image in Images.items():
+        Sorted[Key] = np.reshape(Image, (Labels.shape[0],) + Image.shape[2:])[Order]
+
+    Instances = []
+    for ID in IDs:
+        Slice = slice(Offsets[ID], Offsets[ID + 1])
+        Instance = {'Rows': Rows[Slice], 'Cols': Cols[Slice]}
+        for Key in Sorted:
+            Instance[Key] = Sorted[Key][Slice]
+        Instances.append(Instance)
+
+    return IDs.tolist(), Instances
+
+class PoseRCNNInstance():
+    '''
+    One detected instance. The NOC and Metric point sets are only computed on first access
+    and only uploaded to the GPU on first draw (see PointSet3D.draw()), so jobs pay for the instances they actually use.
+    Their bounding boxes are computed by PointSet3D.update() on first draw, not at construction.
+    '''
+    def __init__(self, Build):
+        self.Build = Build # Returns the (NOC, Metric) point sets
+        self.PointSets = None
+
+    def isEvaluated(self):
+        return self.PointSets is not None
+
+    def evaluate(self):
+        if self.PointSets is None:
+            self.PointSets = self.Build()
+            self.Build = None
+
+        return self.PointSets
+
+    @property
+    def NOC(self):
+        return self.evaluate()[0]
+
+    @property
+    def Metric(self):
+        return self.evaluate()[1]
+
+    def drawNOC(self, pointSize=10):
+        self.NOC.draw(pointSize)
+
+    def drawMetric(self, pointSize=10):
+        self.Metric.draw(pointSize)
+
+    def __del__(self):
+        if self.PointSets is not None:
+            for PointSet in self.PointSets:
+                PointSet.__del__()
+
 class PoseRCNNInput():
     def __init__(self, ColorImage, CoordImage, DepthImage, MaskImage, Intrinsics):
         self.ColorImage, self.CoordImage, self.DepthImage, self.MaskImage = ColorImage, CoordImage, DepthImage, MaskImage
         self.Intrinsics = Intrinsics
+        self.MaskIDs = []
+        self.Instances = []
 
         # Get some stats and pre-process
         if len(self.MaskImage.shape) is not 3:
             print('[ WARN ]: Mask should be 3 channels. Please check input.')
             return
 
-        # The red channel (3) contains mask information
+        # The red channel (3) contains mask information. 255 is the background value
         MaskChannel = self.MaskImage[:, :, 2]
-        self.MaskIDs = np.unique(MaskChannel).tolist()
-        if 255 in self.MaskIDs: # Background value
-            self.MaskIDs.remove(255)
+        Depth16 = ds.DepthImage.decode(self.DepthImage)
+        if Depth16 is None:
+            return
+        self.MaskIDs, self.InstancePixels = splitInstances(MaskChannel, {'Color': self.ColorImage, 'NOCS': self.CoordImage, 'Depth': Depth16}, Background=255)
 
         print(self.MaskIDs)
 
-        self.RGBs = []
-        self.NOCImages = []
-        self.DepthImages = []
-        self.Masks = []
+        self.createInstances()
 
-        self.NOCs = []
-        self.Metrics = []
+    def createInstances(self):
+        # Instances are evaluated lazily, see PoseRCNNInstance
+        self.Instances = [PoseRCNNInstance(functools.partial(self.buildInstance, Idx)) for Idx in range(0, len(self.MaskIDs))]
 
-        for ID in self.MaskIDs:
-            IDMask = np.uint8(MaskChannel == ID)
-            self.RGBs.append(cv2.bitwise_and(self.ColorImage, self.ColorImage, mask=IDMask))
-            self.NOCImages.append(cv2.bitwise_and(self.CoordImage, self.CoordImage, mask=IDMask))
-            self.DepthImages.append(cv2.bitwise_and(self.DepthImage, self.DepthImage, mask=IDMask))
-            self.Masks.append(IDMask * 255)
+    # Lists of the point sets of all instances, drawable as before. These evaluate every instance, prefer self.Instances
+    @property
+    def NOCs(self):
+        return [Instance.NOC for Instance in self.Instances]
 
+    @property
+    def Metrics(self):
+        return [Instance.Metric for Instance in self.Instances]
+
+    def buildInstance(self, Idx):
         # FOR TESTING PURPOSES ONLY
         DEBUG = False
 
-        for Idx in range(0, len(self.MaskIDs)):
-            if DEBUG:
-                # Random: DEBUG
-                RandRotMat = rotation_matrix(np.array([1, 0, 0]), np.random.uniform(0, 359, 1))
-                RandRotMat = RandRotMat @ rotation_matrix(np.array([0, 1, 0]), np.random.uniform(0, 359, 1))
-                RandRotMat = RandRotMat @ rotation_matrix(np.array([0, 0, 1]), np.random.uniform(0, 359, 1))
-
-                RandScale = np.array([1, 1, 1]) * 17  # np.random.uniform(8, 16, 3)
-                RandTrans = np.random.uniform(-70, 70, 3)
-                RandOutliers = 0.1
-
-            NOC = ds.PointSet3D()
-            NOCIm = self.NOCImages[Idx]
-            DepIm = self.DepthImages[Idx]
-            if DEBUG == False:
-                Metric = ds.DepthImage(DepIm, self.Intrinsics.Matrix)
-            else:
-                Metric = ds.PointSet3D() # DEBUG
-            ColIm = self.RGBs[Idx]
-            IDMask = self.Masks[Idx]
-            MaskIdx = np.where((IDMask >= 255))
-            RGBColors = np.zeros([0, 3])
-
-            for i in range(0, MaskIdx[0].shape[0]):
-                Val = NOCIm[MaskIdx[0][i], MaskIdx[1][i], :] / 255
-                Col = ColIm[MaskIdx[0][i], MaskIdx[1][i], :] / 255
-                NOC.add(1 - Val[2], Val[1], Val[0], 1 - Val[2], Val[1], Val[0]) # Flip x and z (due to OpenCV) and also left/right handed coordinate systems (due to rendernigs)
-                RGBColors = np.vstack([RGBColors, np.array([Col[2], Col[1], Col[0]])])
-                if DEBUG:
-                    # DEBUG
-                    Val = np.dot(RandRotMat, Val)
-                    Val = np.multiply(Val, RandScale)
-                    Val = np.add(Val, RandTrans)
-                    if random.uniform(0.0, 1.0) > (1-RandOutliers): # % outliers
-                        Val = Val + np.random.uniform(-500, 500 , 3)
-                        # if random.uniform(0.0, 1.0) > 0.5:
-                        #     Val[0] = 0
-                        # if random.uniform(0.0, 1.0) > 0.5:
-                        #     Val[1] = 0
-                        # if random.uniform(0.0, 1.0) > 0.5:
-                        #     Val[2] = 0
-                    Metric.add(Val[0], Val[1], Val[2])
-
-            Metric.Colors = RGBColors
-            Metric.update()
-            NOC.update()
-
-            print('[ INFO ]: Mask', Idx, 'contains', NOC.Points.shape, 'points.')
-            self.NOCs.append(NOC)
-            self.Metrics.append(Metric)
+        if DEBUG:
+            # Random: DEBUG. See benchmarking.py for the standalone version of this generator
+            RandScale, RandRotMat, RandTrans = benchmarking.randomSimilarity()
+            RandOutliers = 0.1
 
-    def __del__(self):
-        for noc in self.NOCs:
-            noc.__del__()
-        for metric in self.Metrics:
-            metric.__del__()
+        NOC = ds.PointSet3D()
+        Metric = ds.PointSet3D()
+        Pixels = self.InstancePixels[Idx]
+        if DEBUG == False:
+            Metric.Points = utilities.backprojectPixels(Pixels['Rows'], Pixels['Cols'], Pixels['Depth'], self.Intrinsics.Matrix)
+
+        Vals = Pixels['NOCS'] / 255
+        Cols = Pixels['Color'] / 255
+        NOC.Points = np.stack([1 - Vals[:, 2], Vals[:, 1], Vals[:, 0]], axis=1) # Flip x and z (due to OpenCV) and also left/right handed coordinate systems (due to rendernigs)
+        NOC.Colors = NOC.Points.copy()
+        RGBColors = Cols[:, ::-1] # BGR to RGB
+
+        if DEBUG:
+            DebugPoints, _ = benchmarking.perturbPoints(Vals, RandScale, RandRotMat, RandTrans, OutlierRatio=RandOutliers)
+            Metric.addAll(DebugPoints)
+
+        Metric.Colors = RGBColors
+
+        print('[ INFO ]: Mask', Idx, 'contains', NOC.Points.shape, 'points.')
+        return NOC, Metric
 
 class PoseRCNNInputOverlapping(PoseRCNNInput):
     def __init__(self, ColorImage, DepthImage, DetectionData, Intrinsics):
@@ -125,9 +170,10 @@ class PoseRCNNInputOverlapping(PoseRCNNInput):
         self.DepthImages = []
         self.Masks = []
 
-        self.NOCs = []
-        self.Metrics = []
         self.MaskIDs = []
+        self.Instances = []
+        # The per-instance images above are crops of the detection ROIs, with their top left (row, col) here
+        self.ROIOffsets = []
 
         # Get some stats and pre-process
         self.AllROIs = self.Data['rois']
@@ -152,38 +198,63 @@ class PoseRCNNInputOverlapping(PoseRCNNInput):
         print(self.MaskIDs)
 
         for Idx in range(0, len(self.MaskIDs)):
-            IDMask = self.AllMasks[:, :, Idx]
-            self.RGBs.append(cv2.bitwise_and(self.ColorImage, self.ColorImage, mask=IDMask))
-            self.NOCImages.append(cv2.bitwise_and(self.AllCoords[:, :, Idx, :], self.AllCoords[:, :, Idx, :], mask=IDMask) * 255) # Scale 0-1 to 0-255
-            self.DepthImages.append(cv2.bitwise_and(self.DepthImage, self.DepthImage, mask=IDMask))
+            # Restrict all per-instance work to the ROI crop
+            y1, x1, y2, x2 = self.getROI(Idx)
+            IDMask = np.ascontiguousarray(self.AllMasks[y1:y2, x1:x2, Idx])
+            ColorCrop = np.ascontiguousarray(self.ColorImage[y1:y2, x1:x2])
+            CoordCrop = np.ascontiguousarray(self.AllCoords[y1:y2, x1:x2, Idx, :])
+            DepthCrop = np.ascontiguousarray(self.DepthImage[y1:y2, x1:x2])
+            self.RGBs.append(cv2.bitwise_and(ColorCrop, ColorCrop, mask=IDMask))
+            self.NOCImages.append(cv2.bitwise_and(CoordCrop, CoordCrop, mask=IDMask) * 255) # Scale 0-1 to 0-255
+            self.DepthImages.append(cv2.bitwise_and(DepthCrop, DepthCrop, mask=IDMask))
             self.Masks.append(IDMask * 255)
+            self.ROIOffsets.append((y1, x1))
 
-        for Idx in range(0, len(self.MaskIDs)):
-            NOC = ds.PointSet3D()
-            NOCIm = self.NOCImages[Idx]
-            DepIm = self.DepthImages[Idx]
-            Metric = ds.DepthImage(DepIm, self.Intrinsics.Matrix, mask=self.Masks[Idx])
-            ColIm = self.RGBs[Idx]
-            IDMask = self.Masks[Idx]
-            MaskIdx = np.where((IDMask >= 255))
-            RGBColors = np.zeros([0, 3])
-
-            for i in range(0, MaskIdx[0].shape[0]):
-                Val = NOCIm[MaskIdx[0][i], MaskIdx[1][i], :] / 255
-                Col = ColIm[MaskIdx[0][i], MaskIdx[1][i], :] / 255
-                NOC.add(Val[0], Val[1], Val[2], Val[0], Val[1], Val[2])
-                RGBColors = np.vstack([RGBColors, np.array([Col[2], Col[1], Col[0]])])
-
-            Metric.Colors = RGBColors
-            Metric.update()
-            NOC.update()
-
-            print('[ INFO ]: Mask', Idx, 'contains', NOC.Points.shape, 'points.')
-            self.NOCs.append(NOC)
-            self.Metrics.append(Metric)
+        self.createInstances()
 
-    def __del__(self):
-        for noc in self.NOCs:
-            noc.__del__()
-        for metric in self.Metrics:
-            metric.__del__()
\ No newline at end of file
+    def buildInstance(self, Idx):
+        NOC = ds.PointSet3D()
+        Metric = ds.PointSet3D()
+        NOCIm = self.NOCImages[Idx]
+        ColIm = self.RGBs[Idx]
+        IDMask = self.Masks[Idx]
+        MaskIdx = np.where((IDMask >= 255))
+        # Only the mask pixels are back-projected (in full image coordinates), so the points match the colors
+        Depth16 = ds.DepthImage.decode(self.DepthImages[Idx])
+        if Depth16 is not None:
+            y1, x1 = self.ROIOffsets[Idx]
+            Metric.Points = utilities.backprojectPixels(MaskIdx[0] + y1, MaskIdx[1] + x1, Depth16[MaskIdx[0], MaskIdx[1]], self.Intrinsics.Matrix)
+
+        Vals = NOCIm[MaskIdx[0], MaskIdx[1], :] / 255
+        Cols = ColIm[MaskIdx[0], MaskIdx[1], :] / 255
+        NOC.Points = Vals
+        NOC.Colors = Vals.copy()
+        RGBColors = Cols[:, ::-1] # BGR to RGB
+
+        Metric.Colors = RGBColors
+
+        print('[ INFO ]: Mask', Idx, 'contains', NOC.Points.shape, 'points.')
+        return NOC, Metric
+
+    def getROI(self, Idx):
+        # Detection ROIs are (y1, x1, y2, x2). Clip them to the image and fall back to the full image if invalid
+        Height, Width = self.ColorImage.shape[:2]
+        if Idx >= len(self.AllROIs):
+            print('[ WARN ]: No ROI for mask', Idx, '. Using the full image.')
+            return 0, 0, Height, Width
+        y1, x1, y2, x2 = [int(v) for v in self.AllROIs[Idx][:4]]
+        y1, x1 = max(y1, 0), max(x1, 0)
+        y2, x2 = min(y2, Height), min(x2, Width)
+        if y2 <= y1 or x2 <= x1:
+            print('[ WARN ]: Invalid ROI for mask', Idx, '. Using the full image.')
+            return 0, 0, Height, Width
+
+        return y1, x1, y2, x2
+
+    def uncrop(self, Idx, Crop):
+        # Paste a per-instance crop (e.g. self.Masks[Idx]) back into a full size image
+        Full = np.zeros(self.ColorImage.shape[:2] + Crop.shape[2:], dtype=Crop.dtype)
+        y1, x1 = self.ROIOffsets[Idx]
+        Full[y1:y1 + Crop.shape[0], x1:x1 + Crop.shape[1]] = Crop
+
+        return Full
@@ -0,0 +1,268 @@
+import os, sys, json, hashlib
+import numpy as np
+import cv2
+import calibration
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Bump when the estimation changes so that stale cached poses are not reused
+CacheVersion = 1
+
+def loadNOCSMap(FileName, ImageSize=None):
+    NOCSMap = cv2.imread(FileName, -1)
+    if NOCSMap is None:
+        raise RuntimeError('[ ERR ]: Unable to read NOCS map {}.'.format(FileName))
+    NOCSMap = NOCSMap[:, :, :3] # Ignore alpha if present
+    NOCSMap = cv2.cvtColor(NOCSMap, cv2.COLOR_BGR2RGB) # IMPORTANT: OpenCV loads as BGR, so convert to RGB
+    if ImageSize is not None and (NOCSMap.shape[1], NOCSMap.shape[0]) != tuple(ImageSize):
+        NOCSMap = cv2.resize(NOCSMap, tuple(ImageSize), interpolation=cv2.INTER_NEAREST)
+
+    return NOCSMap
+
+def getCorrespondences(NOCSMap):
+    # Returns (N, 2) image coordinates and (N, 3) NOCS coordinates of all non-background pixels
+    ValidIdx = np.where(np.all(NOCSMap != [255, 255, 255], axis=-1)) # row, col
+
+    x = np.array([ValidIdx[1], ValidIdx[0]]) # row, col ==> u, v
+    # Convert image coordinates from top left to bottom right (See Figure 6.2 in HZ)
+    x[0, :] = NOCSMap.shape[1] - x[0, :]
+    x[1, :] = NOCSMap.shape[0] - x[1, :]
+
+    X = NOCSMap[ValidIdx[0], ValidIdx[1]] / 255
+
+    return x.T.astype(np.float32), X.astype(np.float32)
+
+def estimateCameraPose(NOCSMap, N=None, Intrinsics=None, RANSACThreshold=None, Seed=None, isVerbose=True):
+    '''
+    Estimates the camera pose (and intrinsics, if not provided) from a NOCS map.
+    Returns (p, k, r, c, Flip) where p is only estimated when no intrinsics are given.
+    '''
+    x, X = getCorrespondences(NOCSMap)
+
+    # Subsample
+    # Enough to do pose estimation from a subset of points but randomly distributed in the image
+    MaxN = x.shape[0]
+    if N is not None:
+        MaxN = min(N, x.shape[0])
+    RandIdx = np.random.RandomState(Seed).permutation(x.shape[0])[:MaxN]
+    if isVerbose:
+        print('[ INFO ]: Using {} points for estimating camera pose'.format(MaxN))
+        sys.stdout.flush()
+    x = np.ascontiguousarray(x[RandIdx])
+    X = np.ascontiguousarray(X[RandIdx])
+
+    if Intrinsics is not None:
+        # solvePnP requires contiguous arrays of shape (N, 1, 2) and (N, 1, 3)
+        x = x.reshape((MaxN, 1, 2))
+        X = X.reshape((MaxN, 1, 3))
+
+        RetVal, rvec, tvec, Inliers = cv2.solvePnPRansac(X, x, Intrinsics.Matrix, Intrinsics.DistCoeffs, iterationsCount=10000, reprojectionError=0.001, confidence=0.9999999, flags=cv2.SOLVEPNP_ITERATIVE)
+        k = Intrinsics.Matrix
+        if RetVal:
+            r, c = getPoseFromRodrigues(rvec, tvec)
+        else:
+            # rvec and tvec are not initialized on failure
+            print('[ WARN ]: solvePnPRansac did not find a pose.')
+            r, c = np.full((3, 3), np.nan), np.full((3, 1), np.nan)
+
+        p, Flip = None, False
+    else:
+        if RANSACThreshold is None:
+            p, c, k, r, Flip = calibration.calculateCameraParameters((x, X))
+        else:
+            p, c, k, r, Flip, Inliers = calibration.calculateCameraParametersRANSAC((x, X), threshold=RANSACThreshold, seed=Seed)
+            if isVerbose:
+                print('[ INFO ]: RANSAC inlier ratio: {:.3f}'.format(Inliers.mean()))
+
+    if isVerbose:
+        print('[ INFO ]: Estimated pose:\n')
+        print('R:\n', r, '\n')
+        print('C:\n', c, '\n')
+        print('K:\n', k, '\n\n')
+
+    return p, k, r, c, Flip
+
+def getPoseFromRodrigues(rvec, tvec):
+    r, _ = cv2.Rodrigues(rvec)
+    c = -r.T @ tvec
+
+    return r, c
+
+class PoseTracker():
+    '''
+    Tracks the camera pose over consecutive NOCS maps of one sequence (intrinsics must be known).
+    The previous pose is used as the initial guess for a Levenberg-Marquardt refinement with a small iteration budget.
+    Full RANSAC is run for the first frame and whenever the median reprojection error jumps above
+    JumpFactor times the error of the last full solve (but at least JumpFactor * MinError pixels).
+    '''
+    def __init__(self, Intrinsics, N=1000, RANSACThreshold=2.0, RANSACIterations=1000, RefineIterations=10, JumpFactor=3.0, MinError=1.0, Seed=0, isVerbose=False):
+        self.Intrinsics = Intrinsics
+        self.N = N
+        self.RANSACThreshold = RANSACThreshold
+        self.RANSACIterations = RANSACIterations
+        self.RefineIterations = RefineIterations
+        self.JumpFactor = JumpFactor
+        self.MinError = MinError
+        self.RNG = np.random.RandomState(Seed)
+        self.isVerbose = isVerbose
+        self.reset()
+
+    def reset(self):
+        self.rvec = None
+        self.tvec = None
+        self.ReferenceError = None
+        self.LastError = None
+        self.isLastFrameFull = False
+        self.nFrames = 0
+        self.nFullSolves = 0
+
+    def reprojectionErrors(self, X, x, rvec, tvec):
+        Projected, _ = cv2.projectPoints(X, rvec, tvec, self.Intrinsics.Matrix, self.Intrinsics.DistCoeffs)
+        return np.linalg.norm(Projected.reshape(-1, 2) - x.reshape(-1, 2), axis=1)
+
+    def solveFull(self, X, x):
+        RetVal, rvec, tvec, Inliers = cv2.solvePnPRansac(X, x, self.Intrinsics.Matrix, self.Intrinsics.DistCoeffs, iterationsCount=self.RANSACIterations
+                                                         , reprojectionError=self.RANSACThreshold, confidence=0.999, flags=cv2.SOLVEPNP_ITERATIVE)
+        if not RetVal:
+            return None, None
+
+        return rvec, tvec
+
+    def refine(self, X, x, rvec, tvec):
+        rvec, tvec = rvec.copy(), tvec.copy()
+        if hasattr(cv2, 'solvePnPRefineLM'):
+            Criteria = (cv2.TERM_CRITERIA_COUNT | cv2.TERM_CRITERIA_EPS, self.RefineIterations, 1e-6)
+            rvec, tvec = cv2.solvePnPRefineLM(X, x, self.Intrinsics.Matrix, self.Intrinsics.DistCoeffs, rvec, tvec, Criteria)
+        else: # Older OpenCV: iterative solvePnP from the extrinsic guess
+            _, rvec, tvec = cv2.solvePnP(X, x, self.Intrinsics.Matrix, self.Intrinsics.DistCoeffs, rvec, tvec, useExtrinsicGuess=True, flags=cv2.SOLVEPNP_ITERATIVE)
+
+        return rvec, tvec
+
+    def track(self, NOCSMap):
+        '''
+        Returns (p, k, r, c, Flip) like estimateCameraPose(), or None if no pose could be found.
+        '''
+        x, X = getCorrespondences(NOCSMap)
+        if x.shape[0] < 6:
+            print('[ WARN ]: Too few NOCS pixels to track.')
+            return None
+        MaxN = x.shape[0] if self.N is None else min(self.N, x.shape[0])
+        RandIdx = self.RNG.permutation(x.shape[0])[:MaxN]
+        x = np.ascontiguousarray(x[RandIdx]).reshape((MaxN, 1, 2))
+        X = np.ascontiguousarray(X[RandIdx]).reshape((MaxN, 1, 3))
+
+        self.nFrames += 1
+        self.isLastFrameFull = False
+        Error = None
+        if self.rvec is not None:
+            rvec, tvec = self.refine(X, x, self.rvec, self.tvec)
+            # Refine once more without the outliers of the first refinement
+            Inliers = self.reprojectionErrors(X, x, rvec, tvec) < self.RANSACThreshold
+            if np.count_nonzero(Inliers) >= 6:
+                rvec, tvec = self.refine(X[Inliers], x[Inliers], rvec, tvec)
+            Error = np.median(self.reprojectionErrors(X, x, rvec, tvec))
+            if Error > self.JumpFactor * max(self.ReferenceError, self.MinError):
+                if self.isVerbose:
+                    print('[ INFO ]: Tracking lost (median reprojection error {:.3f}). Running full RANSAC.'.format(Error))
+                Error = None
+
+        if Error is None:
+            rvec, tvec = self.solveFull(X, x)
+            if rvec is None:
+                print('[ WARN ]: solvePnPRansac did not find a pose.')
+                # Lose track but keep the sequence statistics
+                self.rvec, self.tvec, self.ReferenceError = None, None, None
+                return None
+            Error = np.median(self.reprojectionErrors(X, x, rvec, tvec))
+            self.ReferenceError = Error
+            self.isLastFrameFull = True
+            self.nFullSolves += 1
+
+        self.rvec, self.tvec, self.LastError = rvec, tvec, Error
+        r, c = getPoseFromRodrigues(rvec, tvec)
+
+        return None, self.Intrinsics.Matrix, r, c, False
+
+def hashFile(FileName):
+    Hash = hashlib.sha1()
+    with open(FileName, 'rb') as f:
+        for Chunk in iter(lambda: f.read(1 << 20), b''):
+            Hash.update(Chunk)
+
+    return Hash.hexdigest()
+
+def getCacheKey(FileHash, N=None, Intrinsics=None, RANSACThreshold=None, Seed=None, ImageSize=None):
+    Params = {'version': CacheVersion, 'file': FileHash, 'n': N, 'ransac': RANSACThreshold, 'seed': Seed
+              , 'size': None if ImageSize is None else [int(s) for s in ImageSize]}
+    if Intrinsics is not None:
+        Params['k'] = np.asarray(Intrinsics.Matrix, dtype=np.float64).round(8).tolist()
+        Params['dist'] = np.asarray(Intrinsics.DistCoeffs, dtype=np.float64).round(8).tolist()
+
+    return hashlib.sha1(json.dumps(Params, sort_keys=True).encode('utf-8')).hexdigest()
+
+def poseToDict(p, k, r, c, Flip):
+    return {'P': None if p is None else np.asarray(p).tolist(), 'K': np.asarray(k).tolist(), 'R': np.asarray(r).tolist()
+            , 'C': np.asarray(c).tolist(), 'Flip': bool(Flip)}
+
+def poseFromDict(Pose):
+    p = None if Pose['P'] is None else np.asarray(Pose['P'])
+    return p, np.asarray(Pose['K']), np.asarray(Pose['R']), np.asarray(Pose['C']), Pose['Flip']
+
+def estimateCameraPoseCached(FileName, CacheDir=None, NOCSMap=None, N=None, Intrinsics=None, RANSACThreshold=None, Seed=None, isVerbose=True):
+    '''
+    Same as estimateCameraPose() but for a NOCS map file, with results cached in CacheDir
+    keyed on the file content and the estimation parameters. NOCSMap can be passed if already loaded.
+    '''
+    ImageSize = None if Intrinsics is None else (Intrinsics.Width, Intrinsics.Height)
+    CacheFile = None
+    if CacheDir is not None:
+        Key = getCacheKey(hashFile(FileName), N, Intrinsics, RANSACThreshold, Seed, ImageSize)
+        CacheFile = os.path.join(CacheDir, Key + '.json')
+        if os.path.exists(CacheFile):
+            with open(CacheFile) as f:
+                if isVerbose:
+                    print('[ INFO ]: Using cached pose for', FileName)
+                return poseFromDict(json.load(f))
+
+    if NOCSMap is None:
+        NOCSMap = loadNOCSMap(FileName, ImageSize)
+    Pose = estimateCameraPose(NOCSMap, N, Intrinsics, RANSACThreshold, Seed, isVerbose)
+
+    # Failed estimates (NaN poses) are not cached
+    if CacheFile is not None and np.all(np.isfinite(Pose[2])) and np.all(np.isfinite(Pose[3])):
+        os.makedirs(CacheDir, exist_ok=True)
+        # Write to a temporary file first so that concurrent readers never see partial results
+        TempFile = CacheFile + '.{}.tmp'.format(os.getpid())
+        with open(TempFile, 'w') as f:
+            json.dump(poseToDict(*Pose), f)
+        os.replace(TempFile, CacheFile)
+
+    return Pose
+
+def estimateCameraPoseWorker(FileName, CacheDir, N, Intrinsics, RANSACThreshold, Seed):
+    cv2.setNumThreads(1) # One process per NOCS map, avoid oversubscription
+    return poseToDict(*estimateCameraPoseCached(FileName, CacheDir, None, N, Intrinsics, RANSACThreshold, Seed, isVerbose=False))
+
+def estimateCameraPosesBatch(FileNames, CacheDir=None, nWorkers=None, N=None, Intrinsics=None, RANSACThreshold=None, Seed=0):
+    '''
+    Estimates the camera poses of many NOCS map files in a process pool.
+    Returns a list of pose dictionaries (see poseToDict()) in the order of FileNames; failures are None.
+    '''
+    Poses = [None] * len(FileNames)
+    with ProcessPoolExecutor(max_workers=nWorkers) as Executor:
+        Futures = {Executor.submit(estimateCameraPoseWorker, FileName, CacheDir, N, Intrinsics, RANSACThreshold, Seed): Idx for Idx, FileName in enumerate(FileNames)}
+        for Ctr, Future in enumerate(as_completed(Futures)):
+            Idx = Futures[Future]
+            try:
+                Poses[Idx] = Future.result()
+                print('[ INFO ]: [{}/{}] Estimated pose for {}'.format(Ctr + 1, len(FileNames), FileNames[Idx]))
+            except Exception as Error:
+                print('[ WARN ]: [{}/{}] Pose estimation failed for {}: {}'.format(Ctr + 1, len(FileNames), FileNames[Idx], Error))
+            sys.stdout.flush()
+
+    return Poses
+
+def savePoses(FileNames, Poses, OutFile):
+    Output = {'poses': [dict(file=os.path.abspath(F), **P) if P is not None else {'file': os.path.abspath(F)} for F, P in zip(FileNames, Poses)]}
+    with open(OutFile, 'w') as f:
+        json.dump(Output, f, indent=2)
+    print('[ INFO ]: Saved {} poses to {}'.format(len(Poses), OutFile))
@@ -0,0 +1,215 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from scipy import ndimage
+
+import obj_loader
+from tk3dv.extern.binvox import binvox_rw
+
+# Triangles are split until their bounding box spans at most this many voxels, which bounds the candidate voxels per triangle
+MaxTriangleExtent = 4
+# Distance within which a triangle touching a voxel counts as overlapping it
+OverlapEps = 1e-9
+FillModes = ['flood', 'parity', 'none']
+
+def getGridTransform(Vertices):
+    '''
+    binvox convention: the grid spans the bounding box of the vertices, scaled uniformly by its largest side.
+    Voxel (i, j, k) has center scale * (i + 0.5) / dims[0] + translate[0], etc.
+    '''
+    if len(Vertices) == 0:
+        raise ValueError('Cannot compute the grid transform of an empty vertex set.')
+    XYZMin = np.min(Vertices, axis=0)
+    Scale = float(np.max(np.max(Vertices, axis=0) - XYZMin))
+    if Scale <= 0.0:
+        Scale = 1.0
+
+    return XYZMin, Scale
+
+def subdivideTriangles(Triangles, MaxExtent=MaxTriangleExtent):
+    # Splits (M, 3, 3) triangles into 4 at the edge midpoints until none spans more than MaxExtent along any axis
+    Done = []
+    while len(Triangles) > 0:
+        Extent = np.max(np.max(Triangles, axis=1) - np.min(Triangles, axis=1), axis=1)
+        isLarge = Extent > MaxExtent
+        Done.append(Triangles[~isLarge])
+        Large = Triangles[isLarge]
+        A, B, C = Large[:, 0], Large[:, 1], Large[:, 2]
+        AB, BC, CA = (A + B) / 2, (B + C) / 2, (C + A) / 2
+        Triangles = np.concatenate([np.stack(T, axis=1) for T in [(A, AB, CA), (AB, B, BC), (CA, BC, C), (AB, BC, CA)]], axis=0)
+
+    if len(Done) == 0:
+        return np.zeros((0, 3, 3))
+    return np.concatenate(Done, axis=0)
+
+def iterateCandidates(Lo, Hi, ChunkSize):
+    '''
+    Enumerates the integer cells in the inclusive boxes [Lo, Hi] of (M, D) arrays, in chunks of about ChunkSize cells.
+    Yields (Indices, Cells): the box index and the D coordinates of every cell. Empty boxes (Hi < Lo) yield nothing.
+    '''
+    Extents = np.maximum(Hi - Lo + 1, 0)
+    Counts = np.prod(Extents, axis=1)
+    Ends = np.cumsum(Counts)
+    Start = 0
+    while Start < len(Counts):
+        # At least one box per chunk
+        Stop = max(Start + 1, int(np.searchsorted(Ends, Ends[Start] - Counts[Start] + ChunkSize, side='right')))
+        ChunkCounts = Counts[Start:Stop]
+        Indices = np.repeat(np.arange(Start, Stop), ChunkCounts)
+        Local = np.arange(len(Indices)) - np.repeat(np.cumsum(ChunkCounts) - ChunkCounts, ChunkCounts)
+        Cells = np.empty((len(Indices), Lo.shape[1]), dtype=np.int64)
+        for Axis in range(Lo.shape[1] - 1, -1, -1):
+            Cells[:, Axis] = Lo[Indices, Axis] + Local % Extents[Indices, Axis]
+            Local //= Extents[Indices, Axis]
+        yield Indices, Cells
+        Start = Stop
+
+def triangleBoxOverlap(V0, V1, V2, HalfSize=0.5, Eps=OverlapEps):
+    '''
+    Separating axis test (Akenine-Moller) of triangles (V0, V1, V2), each (K, 3) relative to the box centers,
+    against axis-aligned cubes of half side HalfSize. Touching counts as overlap.
+    The triangle plane is tested first and only the survivors go through the 9 edge axes.
+    '''
+    Overlap = np.ones(len(V0), dtype=np.bool_)
+    for Axis in range(0, 3):
+        Overlap &= (np.minimum(np.minimum(V0[:, Axis], V1[:, Axis]), V2[:, Axis]) <= HalfSize + Eps)
+        Overlap &= (np.maximum(np.maximum(V0[:, Axis], V1[:, Axis]), V2[:, Axis]) >= -HalfSize - Eps)
+    Normals = np.cross(V1 - V0, V2 - V1)
+    Overlap &= np.abs(np.einsum('kd,kd->k', Normals, V0)) <= HalfSize * np.abs(Normals).sum(axis=1) + Eps
+
+    Survivors = np.flatnonzero(Overlap)
+    Verts = [V0[Survivors], V1[Survivors], V2[Survivors]]
+    isSeparated = np.zeros(len(Survivors), dtype=np.bool_)
+    for i in range(0, 3):
+        E = Verts[(i + 1) % 3] - Verts[i]
+        # The cross product of the edge with a coordinate axis only involves the two other coordinates (a, b)
+        for a, b in [(1, 2), (2, 0), (0, 1)]:
+            P = [E[:, b] * V[:, a] - E[:, a] * V[:, b] for V in Verts]
+            R = HalfSize * (np.abs(E[:, a]) + np.abs(E[:, b])) + Eps
+            isSeparated |= (np.minimum(np.minimum(P[0], P[1]), P[2]) > R) | (np.maximum(np.maximum(P[0], P[1]), P[2]) < -R)
+    Overlap[Survivors[isSeparated]] = False
+
+    return Overlap
+
+def voxelizeSurface(Triangles, Resolution, ChunkSize=1 << 20):
+    # Marks every voxel touched by the (M, 3, 3) triangles given in grid coordinates
+    Surface = np.zeros((Resolution,) * 3, dtype=np.bool_)
+    Triangles = subdivideTriangles(Triangles)
+    # Same closed, Eps-widened boxes as triangleBoxOverlap(), so faces on a grid plane mark the voxels on both sides
+    Lo = np.clip(np.ceil(Triangles.min(axis=1) - OverlapEps) - 1, 0, Resolution - 1).astype(np.int64)
+    Hi = np.clip(np.floor(Triangles.max(axis=1) + OverlapEps), 0, Resolution - 1).astype(np.int64)
+    for Indices, Voxels in iterateCandidates(Lo, Hi, ChunkSize):
+        Tri = Triangles[Indices] - (Voxels + 0.5)[:, np.newaxis, :]
+        Hit = triangleBoxOverlap(Tri[:, 0], Tri[:, 1], Tri[:, 2])
+        Surface[Voxels[Hit, 0], Voxels[Hit, 1], Voxels[Hit, 2]] = True
+
+    return Surface
+
+def fillParity(Triangles, Resolution, ChunkSize=1 << 20):
+    '''
+    Solid interior of a closed mesh from the parity of ray crossings along +z through the voxel centers.
+    Shared edges and vertices are counted once with a top-left rule, so watertight meshes need no jitter.
+    '''
+    P = Triangles[:, :, :2]
+    Area = (P[:, 1, 0] - P[:, 0, 0]) * (P[:, 2, 1] - P[:, 0, 1]) - (P[:, 2, 0] - P[:, 0, 0]) * (P[:, 1, 1] - P[:, 0, 1])
+    Triangles = Triangles[Area != 0]
+    # Make every projected triangle counter-clockwise
+    isCW = Area[Area != 0] < 0
+    Triangles[isCW] = Triangles[isCW][:, [0, 2, 1]]
+    P = Triangles[:, :, :2]
+
+    Lo = np.clip(np.ceil(P.min(axis=1) - 0.5), 0, Resolution).astype(np.int64)
+    Hi = np.clip(np.floor(P.max(axis=1) - 0.5), -1, Resolution - 1).astype(np.int64)
+    Toggles = np.zeros((Resolution, Resolution, Resolution + 1), dtype=np.uint8)
+    for Indices, Columns in iterateCandidates(Lo, Hi, ChunkSize):
+        Tri = Triangles[Indices]
+        Q = Columns + 0.5
+        Inside = np.ones(len(Indices), dtype=np.bool_)
+        Weights = []
+        for i in range(0, 3):
+            A, B = Tri[:, (i + 1) % 3], Tri[:, (i + 2) % 3]
+            D = B[:, :2] - A[:, :2]
+            W = D[:, 0] * (Q[:, 1] - A[:, 1]) - D[:, 1] * (Q[:, 0] - A[:, 0])
+            isTopLeft = (D[:, 1] < 0) | ((D[:, 1] == 0) & (D[:, 0] > 0))
+            Inside &= (W > 0) | ((W == 0) & isTopLeft)
+            Weights.append(W)
+        Weights = np.stack(Weights, axis=1)[Inside]
+        Tri, Columns = Tri[Inside], Columns[Inside]
+        Z = np.sum(Weights * Tri[:, :, 2], axis=1) / np.sum(Weights, axis=1)
+        # The crossing toggles every voxel whose center is above it
+        K = np.clip(np.floor(Z - 0.5).astype(np.int64) + 1, 0, Resolution)
+        np.add.at(Toggles, (Columns[:, 0], Columns[:, 1], K), 1)
+
+    return (np.bitwise_xor.accumulate(Toggles & 1, axis=2)[:, :, :Resolution] == 1)
+
+def voxelizeMesh(Vertices, Faces, Resolution=32, Fill='flood', Translate=None, Scale=None, ChunkSize=1 << 20):
+    '''
+    Voxelizes a triangle mesh (vertices (N, 3), faces (M, 3)) into a Resolution^3 binvox_rw.Voxels model in xyz order.
+    Fill selects how solids are filled: 'flood' fills everything not reachable from the grid border,
+    'parity' uses ray crossing parity (needs closed meshes) and 'none' keeps only the surface.
+    Translate and Scale default to the binvox convention, see getGridTransform(). Meshes without faces raise ValueError.
+    '''
+    if Fill not in FillModes:
+        raise ValueError('Unknown fill mode {}. Available: {}'.format(Fill, FillModes))
+
+    Vertices = np.asarray(Vertices, dtype=np.float64)
+    Faces = np.asarray(Faces, dtype=np.int64).reshape(-1, 3)
+    if len(Faces) == 0:
+        raise ValueError('Cannot voxelize a mesh without faces.')
+    DefaultTranslate, DefaultScale = getGridTransform(Vertices[np.unique(Faces)])
+    Translate = DefaultTranslate if Translate is None else np.asarray(Translate, dtype=np.float64)
+    Scale = DefaultScale if Scale is None else float(Scale)
+
+    Triangles = (Vertices[Faces] - Translate) * (Resolution / Scale)
+    Data = voxelizeSurface(Triangles, Resolution, ChunkSize)
+    if Fill == 'flood':
+        Data = ndimage.binary_fill_holes(Data)
+    elif Fill == 'parity':
+        Data |= fillParity(Triangles, Resolution, ChunkSize)
+
+    return binvox_rw.Voxels(Data, [Resolution] * 3, [float(t) for t in Translate], Scale, 'xyz')
+
+def getBinvoxFile(path, OutDir=None):
+    OutFile = os.path.splitext(path)[0] + '.binvox'
+    if OutDir is not None:
+        OutFile = os.path.join(OutDir, os.path.basename(OutFile))
+
+    return OutFile
+
+def voxelizeOBJ(path, OutFile=None, Resolution=32, Fill='flood'):
+    '''
+    Voxelizes an OBJ file and writes it to OutFile (default: next to the model, see getBinvoxFile()). Returns OutFile.
+    '''
+    Arrays = obj_loader.parseOBJ(path)
+    if len(Arrays['faces']) == 0:
+        # e.g. NOCS point cloud OBJs
+        raise ValueError('{} has no faces to voxelize.'.format(path))
+    Model = voxelizeMesh(Arrays['vertices'], Arrays['faces'], Resolution, Fill)
+    OutFile = getBinvoxFile(path) if OutFile is None else OutFile
+    with open(OutFile, 'wb') as f:
+        Model.write(f)
+
+    return OutFile
+
+def voxelizeOBJs(paths, OutDir=None, Resolution=32, Fill='flood', nWorkers=None, isVerbose=True):
+    '''
+    Voxelizes many OBJ files in a process pool. Returns the written binvox files (None for failed models).
+    '''
+    if OutDir is not None:
+        os.makedirs(OutDir, exist_ok=True)
+
+    OutFiles = [None] * len(paths)
+    if len(paths) == 0:
+        return OutFiles
+    with ProcessPoolExecutor(max_workers=nWorkers) as Executor:
+        Futures = {Executor.submit(voxelizeOBJ, path, getBinvoxFile(path, OutDir), Resolution, Fill): Idx for Idx, path in enumerate(paths)}
+        for Future in as_completed(Futures):
+            Idx = Futures[Future]
+            try:
+                OutFiles[Idx] = Future.result()
+                if isVerbose:
+                    print('[ INFO ]: Wrote', OutFiles[Idx])
+            except Exception as e:
+                print('[ WARN ]: Failed to voxelize', paths[Idx], ':', e)
+
+    return OutFiles
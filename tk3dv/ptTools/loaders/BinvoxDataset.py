@@ -0,0 +1,129 @@
+import torch.utils.data
+import numpy as np
+import os, sys, math, argparse, glob, time
+
+FileDirPath = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(FileDirPath, '..'))
+import ptUtils
+from tk3dv.extern.binvox import binvox_rw
+
+# Loads directories of binvox voxel grids as uint8 occupancy tensors indexed [x, y, z]
+class BinvoxDataset(torch.utils.data.Dataset):
+    def __init__(self, root, limit=100, loadMemory=False, packed=False, Pattern='*.binvox'):
+        '''
+        root: directory (searched recursively) or list of directories with binvox files. All grids must have the same dims.
+        loadMemory: keep all grids bit-packed in one shared-memory tensor, so DataLoader workers do no file I/O.
+        packed: return the packed bits in binvox (xzy) order instead of unpacking to [x, y, z] bytes.
+        '''
+        self.DataDirs = [root] if isinstance(root, str) else list(root)
+        self.Pattern = Pattern
+        self.LoadMemory = loadMemory
+        self.isPacked = packed
+        if limit <= 0.0 or limit > 100.0:
+            raise RuntimeError('Data limit percent has to be >0% and <=100%')
+        self.DataLimit = limit
+
+        self.Cache = None
+        self.loadData()
+
+    def loadData(self):
+        self.BinvoxFiles = []
+        for Dir in self.DataDirs:
+            self.BinvoxFiles.extend(glob.glob(os.path.join(ptUtils.expandTilde(Dir), '**', self.Pattern), recursive=True))
+        self.BinvoxFiles.sort()
+        if len(self.BinvoxFiles) == 0:
+            raise RuntimeError('No binvox files found in {}.'.format(self.DataDirs))
+
+        print('[ INFO ]: Found {} items in dataset.'.format(len(self.BinvoxFiles)))
+        DatasetLength = math.ceil((self.DataLimit / 100) * len(self.BinvoxFiles))
+        self.BinvoxFiles = self.BinvoxFiles[:DatasetLength]
+
+        with open(self.BinvoxFiles[0], 'rb') as f:
+            self.Dims, _, _ = binvox_rw.read_header(f)
+        self.nPackedY = (self.Dims[2] + 7) // 8
+        self.nVoxels = int(np.prod(self.Dims))
+
+        if self.LoadMemory:
+            Tic = time.perf_counter()
+            Cache = np.empty((len(self), self.Dims[0], self.Dims[1], self.nPackedY), dtype=np.uint8)
+            for Idx in range(0, len(self)):
+                Values, Counts = self.readRuns(Idx)
+                Cache[Idx] = binvox_rw.rle_to_packed(Values, Counts, self.Dims, None, None, fix_coords=False).data
+            # Tensors in shared memory are passed to DataLoader workers without copies
+            self.Cache = torch.from_numpy(Cache).share_memory_()
+            print('[ INFO ]: Cached {} packed grids ({:.1f} MB) in {:.2f} s.'.format(len(self), Cache.nbytes / 2 ** 20, time.perf_counter() - Tic))
+
+    def __len__(self):
+        return len(self.BinvoxFiles)
+
+    def readRuns(self, idx):
+        with open(self.BinvoxFiles[idx], 'rb') as f:
+            Dims, _, _ = binvox_rw.read_header(f)
+            Raw = np.frombuffer(f.read(), dtype=np.uint8)
+        if Dims != self.Dims:
+            raise RuntimeError('Grid dims {} of {} do not match dataset dims {}.'.format(Dims, self.BinvoxFiles[idx], self.Dims))
+
+        return Raw[::2], Raw[1::2]
+
+    def getBatch(self, Indices):
+        '''
+        Returns a (B, X, Y, Z) uint8 tensor (a permuted view of the binvox xzy buffer, no copy),
+        or the (B, X, Z, ceil(Y / 8)) packed bits when packed is set.
+        '''
+        B = len(Indices)
+        if self.isPacked:
+            Batch = torch.empty((B, self.Dims[0], self.Dims[1], self.nPackedY), dtype=torch.uint8)
+            for i, Idx in enumerate(Indices):
+                if self.Cache is not None:
+                    Batch[i] = self.Cache[Idx]
+                else:
+                    Values, Counts = self.readRuns(Idx)
+                    Batch[i] = torch.from_numpy(binvox_rw.rle_to_packed(Values, Counts, self.Dims, None, None, fix_coords=False).data)
+            return Batch
+
+        Batch = torch.empty((B, self.Dims[0], self.Dims[1], self.nPackedY * 8), dtype=torch.uint8)
+        BatchNP = Batch.numpy()
+        for i, Idx in enumerate(Indices):
+            if self.Cache is not None:
+                binvox_rw.unpack_bits(self.Cache[Idx].numpy(), BatchNP[i])
+            elif self.nPackedY * 8 == self.Dims[2]:
+                binvox_rw.decode_runs(*self.readRuns(Idx), BatchNP[i].reshape(-1))
+            else:
+                Dense = np.empty(self.Dims, dtype=np.uint8)
+                binvox_rw.decode_runs(*self.readRuns(Idx), Dense.reshape(-1))
+                BatchNP[i, :, :, :self.Dims[2]] = Dense
+
+        # xzy to xyz as a view
+        return Batch[:, :, :, :self.Dims[2]].permute(0, 1, 3, 2)
+
+    def __getitem__(self, idx):
+        return self.getBatch([idx])[0]
+
+    def __getitems__(self, Indices):
+        # Used by DataLoader (torch >= 2.0) to fetch a whole batch at once; pair with collate_fn=BinvoxDataset.collate
+        return self.getBatch(Indices)
+
+    @staticmethod
+    def collate(Batch):
+        # The batch is already a single tensor when fetched with __getitems__
+        if torch.is_tensor(Batch):
+            return Batch
+        return torch.stack(Batch, 0)
+
+Parser = argparse.ArgumentParser()
+Parser.add_argument('-d', '--data-dir', help='Specify the directory with binvox files.', required=True)
+Parser.add_argument('--batch-size', help='Specify the batch size.', default=32, type=int)
+Parser.add_argument('--workers', help='Specify the number of DataLoader workers.', default=0, type=int)
+Parser.add_argument('--load-memory', help='Keep packed grids in shared memory.', action='store_true')
+
+if __name__ == '__main__':
+    Args, _ = Parser.parse_known_args()
+
+    Data = BinvoxDataset(root=Args.data_dir, loadMemory=Args.load_memory)
+    DataLoader = torch.utils.data.DataLoader(Data, batch_size=Args.batch_size, shuffle=True, num_workers=Args.workers, collate_fn=BinvoxDataset.collate)
+    Tic = time.perf_counter()
+    nVoxels = 0
+    for i, Voxels in enumerate(DataLoader, 0):
+        nVoxels += int(Voxels.sum())
+    Toc = time.perf_counter() - Tic
+    print('[ INFO ]: Loaded {} grids in {:.2f} s ({:.1f} grids/s), {} occupied voxels.'.format(len(Data), Toc, len(Data) / Toc, nVoxels))
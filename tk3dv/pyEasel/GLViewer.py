@@ -88,6 +88,14 @@ class GLViewer(QOpenGLWidget):
             self.FOVYStack = CamData['fs']
             self.TranslationStack = CamData['ts']
             self.nCameras = self.TranslationStack.shape[0]
+            # Files can hold any number of cameras (e.g. interpolated fly-throughs), so resize the per-camera state
+            N = self.nCameras
+            self.isRotateCameraStack = [False] * N
+            self.RotateSpeedStack = np.ones([N,]) * 0.1
+            self.RotateSpeedUpdateStack = np.ones([N,]) * 0.02
+            self.CamPosStack = np.zeros([N, 3])
+            self.LAtStack = np.zeros([N, 3])
+            self.activeCamStackIdx = min(self.activeCamStackIdx, N - 1)
             print('[ INFO ]: Loaded pyEasel cameras from {}'.format(self.CamFileName))
         else:
             print('[ WARN ]: No pyEasel cameras found in {}. Please save first using Ctrl+S'.format(self.CamFileName))